@@ -1,15 +1,40 @@
 import os
+import time
 import uuid
+import click
 import requests
 import traceback
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context, send_file
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_migrate import Migrate
+from sqlalchemy.exc import DBAPIError
 from urllib.parse import urlparse
-from datetime import datetime
+from werkzeug.utils import secure_filename
+from datetime import datetime, timedelta, timezone
+import hashlib
+import tempfile
+import functools
+import base64
 import qrcode
-from models import db, User, Territory, UserSettings
+from models import db, User, Territory, UserSettings, Job, ImportStaging, ImportChunk, CityStats
 from forms import LoginForm, RegistrationForm, UserSettingsForm
+import cache
+from cache import get_cached_city, store_city, get_cached_overpass, store_overpass
+import osm_client
+import rate_limit
+import osm_snapshot
+import jobs
+import rollups
+import sql_budget
+import geometry_codec
+import numbering
+import qr_cache
+import card_renderer
+import thumbnails
+import zip_stream
+import territory_export
+import tiles
+from osm_client import osm_get, osm_post
 from dotenv import load_dotenv
 
 # Charger les variables d'environnement depuis le fichier .env
@@ -23,10 +48,108 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # Configuration des dossiers
 app.config['QR_FOLDER'] = os.path.join('static', 'qrcodes')
 os.makedirs(app.config['QR_FOLDER'], exist_ok=True)
+# QR codes adressés par contenu : durée de cache navigateur et délai avant suppression d'un fichier orphelin
+app.config['QR_MAX_AGE'] = int(os.getenv('QR_MAX_AGE', str(365 * 24 * 3600)))
+app.config['QR_CLEANUP_GRACE_PERIOD'] = int(os.getenv('QR_CLEANUP_GRACE_PERIOD', '3600'))
+# Stockage des QR codes : 'memory' (rendu à la volée, cache LRU par processus) ou 'disk' (fichiers dans QR_FOLDER)
+app.config['QR_STORAGE'] = os.getenv('QR_STORAGE', 'memory')
+app.config['QR_MEMORY_CACHE_SIZE'] = int(os.getenv('QR_MEMORY_CACHE_SIZE', '1024'))
+# Vignettes des contours : niveau de détail par défaut, durée de cache navigateur et taille du cache LRU
+app.config['THUMBNAIL_LEVEL'] = int(os.getenv('THUMBNAIL_LEVEL', '2'))
+app.config['THUMBNAIL_MAX_AGE'] = int(os.getenv('THUMBNAIL_MAX_AGE', str(365 * 24 * 3600)))
+app.config['THUMBNAIL_CACHE_SIZE'] = int(os.getenv('THUMBNAIL_CACHE_SIZE', '2048'))
+
+# Cache du géocodage inverse (taille de cellule en degrés, TTL en secondes)
+app.config['GEOCODE_CACHE_PRECISION'] = float(os.getenv('GEOCODE_CACHE_PRECISION', '0.005'))
+app.config['GEOCODE_CACHE_TTL'] = int(os.getenv('GEOCODE_CACHE_TTL', str(90 * 24 * 3600)))
+app.config['GEOCODE_CACHE_MAX_ENTRIES'] = int(os.getenv('GEOCODE_CACHE_MAX_ENTRIES', '20000'))
+
+# Cache des réponses Overpass (TTL en secondes)
+app.config['OVERPASS_CACHE_TTL'] = int(os.getenv('OVERPASS_CACHE_TTL', str(7 * 24 * 3600)))
+app.config['OVERPASS_CACHE_MAX_ENTRIES'] = int(os.getenv('OVERPASS_CACHE_MAX_ENTRIES', '5000'))
+
+# Caches partagés : intervalle de mise à jour de last_used_at (s), report des compteurs
+# (toutes les N lectures ou toutes les N secondes) et éviction toutes les N écritures
+app.config['CACHE_TOUCH_INTERVAL'] = int(os.getenv('CACHE_TOUCH_INTERVAL', '3600'))
+app.config['CACHE_COUNTER_FLUSH_EVERY'] = int(os.getenv('CACHE_COUNTER_FLUSH_EVERY', '100'))
+app.config['CACHE_COUNTER_FLUSH_INTERVAL'] = int(os.getenv('CACHE_COUNTER_FLUSH_INTERVAL', '60'))
+app.config['CACHE_EVICT_EVERY'] = int(os.getenv('CACHE_EVICT_EVERY', '200'))
+
+# Enrichissement des placemarks (ville + sonnettes) : nombre de workers et débit par hôte
+app.config['ENRICHMENT_WORKERS'] = int(os.getenv('ENRICHMENT_WORKERS', '4'))
+app.config['NOMINATIM_MIN_INTERVAL'] = float(os.getenv('NOMINATIM_MIN_INTERVAL', '1.0'))  # Politique d'usage Nominatim : 1 requête/s
+app.config['OVERPASS_MIN_INTERVAL'] = float(os.getenv('OVERPASS_MIN_INTERVAL', '0'))
+# Durée de conservation (en secondes) d'un upload KML en attente de génération
+app.config['IMPORT_STAGING_TTL'] = int(os.getenv('IMPORT_STAGING_TTL', '3600'))
+
+# Tâches de fond : taille des lots, intervalle de scrutation et délai avant reprise d'une tâche abandonnée
+app.config['JOBS_CHUNK_SIZE'] = int(os.getenv('JOBS_CHUNK_SIZE', '20'))
+app.config['JOBS_POLL_INTERVAL'] = float(os.getenv('JOBS_POLL_INTERVAL', '2'))
+app.config['JOBS_STALE_AFTER'] = int(os.getenv('JOBS_STALE_AFTER', '300'))
+# Battement de cœur des tâches en cours (s), indépendant de la durée d'un lot ; doit rester bien inférieur à JOBS_STALE_AFTER
+app.config['JOBS_HEARTBEAT_INTERVAL'] = int(os.getenv('JOBS_HEARTBEAT_INTERVAL', '30'))
+# Durée maximale (s) de préparation d'une tâche ('staging') avant qu'elle soit passée en échec et ses lots supprimés
+app.config['JOBS_STAGING_TIMEOUT'] = int(os.getenv('JOBS_STAGING_TIMEOUT', '3600'))
+
+# Source des données OSM : 'auto' (snapshot local s'il couvre la zone, sinon Overpass), 'snapshot' ou 'overpass'
+app.config['OSM_SOURCE'] = os.getenv('OSM_SOURCE', 'auto')
+
+# Comptage groupé : surface maximale (en degrés carrés) de l'emprise interrogée en une seule requête
+app.config['OVERPASS_BATCH_MAX_AREA'] = float(os.getenv('OVERPASS_BATCH_MAX_AREA', '0.05'))
+# Les intervalles par hôte valent pour l'ensemble des processus (créneaux partagés en base, voir rate_limit.py)
+osm_client.configure(
+    pool_size=app.config['ENRICHMENT_WORKERS'] * 2,
+    intervals={
+        'nominatim.openstreetmap.org': app.config['NOMINATIM_MIN_INTERVAL'],
+        'overpass-api.de': app.config['OVERPASS_MIN_INTERVAL'],
+    },
+    reserve=rate_limit.shared_reserve(app, osm_client.rate_limiter.reserve_local)
+)
+
+# Listing paginé des territoires : taille de page par défaut et maximale
+app.config['LIST_TERRITORIES_PAGE_SIZE'] = int(os.getenv('LIST_TERRITORIES_PAGE_SIZE', '100'))
+app.config['LIST_TERRITORIES_MAX_PAGE_SIZE'] = int(os.getenv('LIST_TERRITORIES_MAX_PAGE_SIZE', '1000'))
+
+# Génération des territoires : nombre de lignes par INSERT groupé (chaque lot est validé séparément)
+app.config['BULK_INSERT_CHUNK_SIZE'] = int(os.getenv('BULK_INSERT_CHUNK_SIZE', '1000'))
+
+# Zoom par défaut des cartes de la page d'impression par ville (choix du niveau de détail des contours)
+app.config['PRINT_MAP_ZOOM'] = int(os.getenv('PRINT_MAP_ZOOM', '15'))
+
+# Cartes PDF d'une ville : processus de rendu (pool partagé du worker de tâches), cartes par page (colonnes x lignes), résolution et police
+app.config['CARD_RENDER_WORKERS'] = int(os.getenv('CARD_RENDER_WORKERS', str(os.cpu_count() or 1)))
+app.config['CARD_PDF_COLUMNS'] = int(os.getenv('CARD_PDF_COLUMNS', '2'))
+app.config['CARD_PDF_ROWS'] = int(os.getenv('CARD_PDF_ROWS', '4'))
+app.config['CARD_PDF_DPI'] = int(os.getenv('CARD_PDF_DPI', '200'))
+app.config['CARD_FONT'] = os.getenv('CARD_FONT', 'DejaVuSans.ttf')
+# PDF de cartes rendus par le worker de tâches de fond (dossier partagé avec les workers web), conservés CARD_PDF_MAX_AGE s
+app.config['CARD_PDF_FOLDER'] = os.getenv('CARD_PDF_FOLDER', os.path.join(tempfile.gettempdir(), 'territory_cards'))
+app.config['CARD_PDF_MAX_AGE'] = int(os.getenv('CARD_PDF_MAX_AGE', '86400'))
+# Export ZIP (QR codes et cartes) : nombre de territoires chargés par lot pendant le streaming, et
+# taille maximale de la sélection (rendue dans la requête : doit tenir largement dans le timeout gunicorn)
+app.config['ZIP_EXPORT_CHUNK_SIZE'] = int(os.getenv('ZIP_EXPORT_CHUNK_SIZE', '50'))
+app.config['ZIP_EXPORT_MAX_TERRITORIES'] = int(os.getenv('ZIP_EXPORT_MAX_TERRITORIES', '200'))
+# Avec les rues (streets=1), chaque territoire peut demander une requête Overpass : sélection plus petite
+app.config['ZIP_EXPORT_MAX_WITH_STREETS'] = int(os.getenv('ZIP_EXPORT_MAX_WITH_STREETS', '30'))
+# Export KML / GeoJSON : lignes lues par aller-retour du curseur côté serveur
+app.config['EXPORT_YIELD_PER'] = int(os.getenv('EXPORT_YIELD_PER', '500'))
+# Tuiles GeoJSON de la carte d'ensemble : nombre de tuiles rendues gardées en mémoire
+app.config['TILE_CACHE_SIZE'] = int(os.getenv('TILE_CACHE_SIZE', '4096'))
+# Sous TILE_MIN_ZOOM, ou au-delà de TILE_MAX_FEATURES territoires, une tuile ne contient que des centroïdes
+# regroupés sur une grille de TILE_CLUSTER_GRID cases de côté (TILE_CLUSTER_GRID² doit rester sous TILE_MAX_FEATURES)
+app.config['TILE_MIN_ZOOM'] = int(os.getenv('TILE_MIN_ZOOM', '12'))
+app.config['TILE_MAX_FEATURES'] = int(os.getenv('TILE_MAX_FEATURES', '1000'))
+app.config['TILE_CLUSTER_GRID'] = int(os.getenv('TILE_CLUSTER_GRID', '16'))
+
+# Instrumentation SQL par requête (détection des N+1) : activée par défaut en mode debug
+app.config['SQL_BUDGET_ENABLED'] = os.getenv('SQL_BUDGET_ENABLED', '1' if app.debug else '0') == '1'
+app.config['SQL_BUDGET_REPEAT_THRESHOLD'] = int(os.getenv('SQL_BUDGET_REPEAT_THRESHOLD', '5'))
+app.config['SQL_BUDGET_MAX_QUERIES'] = int(os.getenv('SQL_BUDGET_MAX_QUERIES', '30'))
 
 # Initialisation des extensions
 db.init_app(app)
 migrate = Migrate(app, db)
+sql_budget.init_app(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -134,10 +257,11 @@ from flask import send_from_directory
 from dotenv import load_dotenv
 import json
 import xml.etree.ElementTree as ET
-from PIL import Image
-import qrcode
+import numpy as np
+import shapely
+from shapely.geometry import Point, Polygon, box
+from shapely import STRtree
 import uuid
-import requests
 from flask import jsonify
 from datetime import datetime
 import os
@@ -149,198 +273,438 @@ if not api_key:
 else:
     print(f"Clé API chargée: {api_key[:5]}...")  # Affiche seulement les 5 premiers caractères pour la sécurité
 
-# Stockage des territoires en mémoire (dans un vrai système, cela serait dans une base de données)
-territories_store = {}
+def stage_import(user_id, territories):
+    """Conserve en base le résultat enrichi d'un upload, visible par tous les workers gunicorn"""
+    now = datetime.utcnow()
+    ImportStaging.query.filter(ImportStaging.expires_at < now).delete(synchronize_session=False)
+    
+    staging = ImportStaging.query.filter_by(user_id=user_id).first()
+    if staging is None:
+        staging = ImportStaging(user_id=user_id)
+        db.session.add(staging)
+    staging.territories = territories
+    staging.created_at = now
+    staging.expires_at = now + timedelta(seconds=app.config['IMPORT_STAGING_TTL'])
+    db.session.commit()
 
-import tempfile
+def get_staged_import(user_id):
+    """Retourne les territoires du dernier upload de l'utilisateur (liste vide si absent ou expiré)"""
+    staging = ImportStaging.query.filter(
+        ImportStaging.user_id == user_id,
+        ImportStaging.expires_at >= datetime.utcnow()
+    ).first()
+    return staging.territories if staging else []
+
+import zipfile
 import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-def parse_kml(kml_file):
-    """Parse un fichier KML et retourne une liste de territoires avec leurs coordonnées"""
-    app.logger.info("=== Début du parsing KML ===")
-    try:
-        # Créer un fichier temporaire
-        temp_dir = tempfile.mkdtemp()
-        temp_path = os.path.join(temp_dir, 'temp.kml')
-        
-        # Lire et réécrire le fichier pour gérer le BOM et autres problèmes d'encodage
-        content = kml_file.read().decode('utf-8-sig')  # utf-8-sig gère le BOM
-        app.logger.info(f"Contenu du fichier (premiers 500 caractères): {content[:500]}")
-        
-        # Vérifier si le contenu ressemble à du KML
-        if not ('<kml' in content or '<Placemark' in content):
-            app.logger.error("Le fichier ne semble pas être un KML valide")
-            return False, "Le fichier ne semble pas être un KML valide"
-        
-        with open(temp_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-        
-        app.logger.info(f"Fichier temporaire créé: {temp_path}")
+KML_CONTAINERS = ('kml', 'Document', 'Folder')
 
-        # Parser le fichier KML
+def local_name(tag):
+    """Nom d'un élément XML sans son espace de noms ({http://www.opengis.net/kml/2.2}Placemark -> Placemark)"""
+    return tag.rsplit('}', 1)[-1]
+
+def open_kml_stream(kml_file):
+    """Retourne un flux binaire sur le document KML, en décompressant les fichiers KMZ à la volée"""
+    stream = getattr(kml_file, 'stream', kml_file)
+    signature = stream.read(4)
+    stream.seek(0)
+    
+    if signature != b'PK\x03\x04':
+        return stream
+    
+    # KMZ : archive ZIP contenant doc.kml (ou à défaut le premier fichier .kml)
+    archive = zipfile.ZipFile(stream)
+    names = [name for name in archive.namelist() if name.lower().endswith('.kml')]
+    if not names:
+        raise ValueError("Aucun fichier KML trouvé dans l'archive KMZ")
+    name = 'doc.kml' if 'doc.kml' in names else names[0]
+    app.logger.info(f"Lecture de {name} dans l'archive KMZ")
+    return archive.open(name)
+
+def parse_placemark(placemark):
+    """Extrait nom, type, numéro et coordonnées d'un élément Placemark (None si pas de coordonnées)"""
+    name = territory_type = territory_number = ''
+    coords_text = None
+    for child in placemark:
+        tag = local_name(child.tag)
+        if tag == 'name':
+            name = child.text or ''
+        elif tag == 'territoryType':
+            territory_type = child.text or ''
+        elif tag == 'territoryNumber':
+            territory_number = child.text or ''
+    
+    for elem in placemark.iter():
+        if local_name(elem.tag) == 'LinearRing':
+            for coords_elem in elem:
+                if local_name(coords_elem.tag) == 'coordinates' and coords_elem.text:
+                    coords_text = coords_elem.text
+                    break
+        if coords_text:
+            break
+    
+    if not coords_text:
+        app.logger.warning(f"Pas de coordonnées trouvées pour le territoire {name}")
+        return None
+    
+    coords_list = []
+    for coord in coords_text.split():
         try:
-            tree = ET.parse(temp_path)
-            root = tree.getroot()
-        except ET.ParseError as e:
-            app.logger.error(f"Erreur de parsing XML: {str(e)}")
-            return False, f"Erreur de parsing XML: {str(e)}"
-        
-        # Gérer l'espace de noms KML
-        ns = {'kml': 'http://www.opengis.net/kml/2.2'}
-        
-        # Trouver tous les placemarks
-        placemarks = root.findall('.//kml:Placemark', ns)
-        if not placemarks:
-            placemarks = root.findall('.//Placemark')  # Essayer sans namespace
-        
-        if not placemarks:
-            app.logger.error("Aucun Placemark trouvé dans le fichier KML")
-            return False, "Aucun territoire (Placemark) trouvé dans le fichier KML"
-        
-        app.logger.info(f"Nombre total de territoires trouvés: {len(placemarks)}")
-        
-        territories = []
-        for i, placemark in enumerate(placemarks, 1):
-            try:
-                app.logger.info(f"Traitement du territoire {i}/{len(placemarks)}")
-                
-                # Extraire le nom et les informations supplémentaires
-                name = placemark.findtext('kml:name', '', ns) or placemark.findtext('name', '')
-                territory_type = placemark.findtext('kml:territoryType', '', ns) or placemark.findtext('territoryType', '')
-                territory_number = placemark.findtext('kml:territoryNumber', '', ns) or placemark.findtext('territoryNumber', '')
-                
-                app.logger.info(f"Nom du territoire: {name}")
-                app.logger.info(f"Type de territoire: {territory_type}")
-                app.logger.info(f"Numéro de territoire: {territory_number}")
-                
-                # Extraire les coordonnées
-                coords_elem = None
-                for path in ['.//kml:LinearRing/kml:coordinates', './/LinearRing/coordinates']:
-                    coords_elem = placemark.find(path, ns)
-                    if coords_elem is not None:
-                        break
-                
-                if coords_elem is None or not coords_elem.text:
-                    app.logger.warning(f"Pas de coordonnées trouvées pour le territoire {name}")
-                    continue
-                
-                coords_text = coords_elem.text.strip()
-                coords_list = []
-                
-                # Parser les coordonnées
-                for coord in coords_text.split():
-                    try:
-                        parts = coord.split(',')
-                        if len(parts) >= 2:
-                            lon, lat = float(parts[0]), float(parts[1])
-                            coords_list.append([lon, lat])
-                    except (ValueError, IndexError) as e:
-                        app.logger.warning(f"Erreur lors du parsing des coordonnées {coord}: {e}")
-                        continue
-                
-                if not coords_list:
-                    app.logger.warning(f"Aucune coordonnée valide trouvée pour le territoire {name}")
-                    continue
-                
-                # Calculer le centre du polygone pour déterminer la ville
-                center_lat = sum(point[1] for point in coords_list) / len(coords_list)
-                center_lon = sum(point[0] for point in coords_list) / len(coords_list)
-                
-                # Obtenir le nom de la ville
-                city = get_city_from_coordinates([[center_lon, center_lat]])
-                app.logger.info(f"Ville déterminée pour le territoire {name}: {city}")
-                
-                territory = {
-                    'name': name,
-                    'type': territory_type,
-                    'number': territory_number,
-                    'coordinates': coords_list,
-                    'city': city
-                }
-                territories.append(territory)
-                app.logger.info(f"Territoire ajouté: {territory['name']} ({territory['number']})")
-                
-            except Exception as e:
-                app.logger.error(f"Erreur lors du traitement du territoire {i}: {e}")
-                app.logger.error(traceback.format_exc())
+            parts = coord.split(',')
+            if len(parts) >= 2:
+                coords_list.append([float(parts[0]), float(parts[1])])
+        except (ValueError, IndexError) as e:
+            app.logger.warning(f"Erreur lors du parsing des coordonnées {coord}: {e}")
+            continue
+    
+    if not coords_list:
+        app.logger.warning(f"Aucune coordonnée valide trouvée pour le territoire {name}")
+        return None
+    
+    return {
+        'name': name,
+        'type': territory_type,
+        'number': territory_number,
+        'coordinates': coords_list
+    }
+
+class KmlError(ValueError):
+    """Document KML invalide ou sans territoire exploitable"""
+
+def iter_placemarks(kml_file, stats):
+    """Générateur des territoires d'un fichier KML ou KMZ, lus en flux (iterparse)
+
+    Chaque Placemark est détaché de l'arbre dès qu'il a été traité, de sorte que
+    la mémoire reste stable quelle que soit la taille du fichier. `stats['placemarks']`
+    compte les Placemarks lus, valides ou non. Lève KmlError si le document
+    n'est pas un KML ou pas du XML valide.
+    """
+    stats['placemarks'] = 0
+    stream = open_kml_stream(kml_file)
+    stack = []
+    placemark_depth = 0
+    try:
+        for event, elem in ET.iterparse(stream, events=('start', 'end')):
+            tag = local_name(elem.tag)
+            
+            if event == 'start':
+                if not stack and tag not in KML_CONTAINERS + ('Placemark',):
+                    raise KmlError("Le fichier ne semble pas être un KML valide")
+                stack.append(elem)
+                if tag == 'Placemark':
+                    placemark_depth += 1
                 continue
+            
+            stack.pop()
+            parent = stack[-1] if stack else None
+            
+            if tag == 'Placemark':
+                placemark_depth -= 1
+                stats['placemarks'] += 1
+                try:
+                    territory = parse_placemark(elem)
+                except Exception as e:
+                    app.logger.error(f"Erreur lors du traitement du territoire {stats['placemarks']}: {e}")
+                    app.logger.error(traceback.format_exc())
+                    territory = None
+                if territory:
+                    app.logger.info(f"Territoire ajouté: {territory['name']} ({territory['number']})")
+                    yield territory
+            
+            # Détacher les éléments traités (Placemarks, styles...) pour libérer la mémoire
+            if placemark_depth == 0 and tag not in KML_CONTAINERS and parent is not None:
+                parent.remove(elem)
+    except ET.ParseError as e:
+        raise KmlError(f"Erreur de parsing XML: {str(e)}")
+
+def check_placemarks(stats, count):
+    """Lève KmlError si le fichier ne contenait aucun territoire exploitable"""
+    if not stats['placemarks']:
+        raise KmlError("Aucun territoire (Placemark) trouvé dans le fichier KML")
+    app.logger.info(f"Nombre total de territoires trouvés: {stats['placemarks']}")
+    if not count:
+        raise KmlError("Aucun territoire valide n'a pu être extrait du fichier KML")
+
+def parse_kml(kml_file, enrich=True):
+    """Parse un fichier KML ou KMZ et retourne une liste de territoires avec leurs coordonnées
+
+    Avec enrich=False, seule la géométrie est extraite (la ville et les sonnettes
+    sont alors déterminées plus tard). Les gros fichiers passent plutôt par
+    stage_kml_job, qui ne garde jamais tous les territoires en mémoire.
+    """
+    app.logger.info("=== Début du parsing KML ===")
+    try:
+        stats = {}
+        territories = list(iter_placemarks(kml_file, stats))
+        check_placemarks(stats, len(territories))
         
-        if not territories:
-            app.logger.error("Aucun territoire valide n'a pu être extrait du fichier KML")
-            return False, "Aucun territoire valide n'a pu être extrait du fichier KML"
+        # Déterminer la ville et compter les sonnettes en parallèle
+        if enrich:
+            enrich_territories(territories)
         
         app.logger.info(f"=== Fin du parsing KML avec succès: {len(territories)} territoires extraits ===")
         return True, territories
         
+    except KmlError as e:
+        app.logger.error(str(e))
+        return False, str(e)
     except Exception as e:
         app.logger.error(f"Erreur lors du parsing KML: {e}")
         app.logger.error(traceback.format_exc())
         return False, str(e)
-    finally:
-        try:
-            # Nettoyer les fichiers temporaires
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            os.rmdir(temp_dir)
-            app.logger.info("Fichiers temporaires nettoyés")
-        except Exception as e:
-            app.logger.error(f"Erreur lors du nettoyage des fichiers temporaires: {e}")
 
-def count_buildings_and_apartments(coordinates):
-    """Compte le nombre total de sonnettes dans un territoire"""
+def stage_kml_job(kml_file, user_id):
+    """Crée la tâche d'import d'un fichier KML en écrivant ses placemarks par lots dans import_chunk
+
+    Les placemarks sont lus en flux, numérotés et insérés JOBS_CHUNK_SIZE par
+    JOBS_CHUNK_SIZE : seul le lot courant est en mémoire. La tâche reste au
+    statut 'staging', ignoré par les workers, jusqu'à ce que tous les lots
+    soient écrits ; le tout est validé en une fois. Retourne la tâche ; lève
+    KmlError si le fichier ne contient aucun territoire exploitable.
+    """
+    jobs.expire_staging(app.config['JOBS_STAGING_TIMEOUT'])
+    # Lots restants de tâches terminées ou en échec de cet utilisateur
+    ImportChunk.query.filter(ImportChunk.job_id.in_(
+        db.select(Job.id).where(Job.user_id == user_id, Job.status.in_(('done', 'failed')))
+    )).delete(synchronize_session=False)
+    job = jobs.enqueue('import_kml', user_id, status='staging')
+    job_id = job.id
+    chunk_size = app.config['JOBS_CHUNK_SIZE']
+    table = ImportChunk.__table__
+
+    def write(chunk, seq):
+        numbering.assign_numbers(chunk, user_id)
+        db.session.execute(table.insert().values(
+            job_id=job_id, seq=seq, placemarks=chunk, created_at=datetime.utcnow()
+        ))
+
+    stats = {}
+    count = seq = 0
+    chunk = []
     try:
-        # Convertir les coordonnées au format requis par Overpass
-        overpass_coords = []
-        for coord in coordinates:
-            if isinstance(coord, dict):
-                overpass_coords.append(f"{coord['lat']} {coord['lng']}")
-            else:
-                overpass_coords.append(f"{coord[1]} {coord[0]}")
+        for territory in iter_placemarks(kml_file, stats):
+            chunk.append(territory)
+            if len(chunk) == chunk_size:
+                write(chunk, seq)
+                count += len(chunk)
+                seq += 1
+                chunk = []
+        if chunk:
+            write(chunk, seq)
+            count += len(chunk)
+        check_placemarks(stats, count)
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.status = 'failed'
+        job.error = str(e)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        raise
 
-        # Créer la requête Overpass
-        area = " ".join(overpass_coords)
-        query = f"""
-        [out:json][timeout:25];
-        (
-          way(poly:"{area}")["building"];
-          relation(poly:"{area}")["building"];
-        );
-        out body;
-        >;
-        out skel qt;
-        """
+    job = db.session.get(Job, job_id)
+    job.total = count
+    job.status = 'pending'
+    db.session.commit()
+    return job
 
-        # Faire la requête à l'API Overpass
-        overpass_url = "http://overpass-api.de/api/interpreter"
-        response = requests.post(overpass_url, data=query)
-        data = response.json()
+
+class EnrichmentError(Exception):
+    """Ville ou sonnettes d'un territoire impossibles à déterminer (service OSM indisponible)"""
+
+def count_buildings_and_apartments(coordinates, strict=False):
+    """Compte le nombre total de sonnettes dans un territoire
+
+    Par défaut une erreur donne 0 sonnette ; avec strict=True elle est levée.
+    """
+    try:
+        data = fetch_osm_data('buildings', coordinates)
+        if data is None:
+            if strict:
+                raise EnrichmentError("Données OSM des bâtiments indisponibles")
+            return {'total_doorbells': 0}
 
         total_doorbells = 0
 
         # Analyser chaque bâtiment
         for element in data['elements']:
             if element['type'] in ['way', 'relation'] and 'tags' in element:
-                tags = element['tags']
-                building_type = tags.get('building', 'unknown')
-                
-                # Compter les sonnettes
-                if building_type in ['apartments', 'residential'] or 'apartments' in tags:
-                    # Pour les immeubles, estimer le nombre d'appartements
-                    levels = int(tags.get('building:levels', '3'))
-                    apts_per_floor = int(tags.get('apartments_per_floor', '2'))
-                    total_doorbells += levels * apts_per_floor
-                else:
-                    # Pour les autres bâtiments, ajouter une sonnette
-                    total_doorbells += 1
+                total_doorbells += estimate_doorbells(element['tags'])
 
         return {'total_doorbells': total_doorbells}
 
     except Exception as e:
-        print(f"Erreur lors du comptage des sonnettes : {str(e)}")
+        if strict:
+            raise
+        app.logger.warning(f"Erreur lors du comptage des sonnettes : {str(e)}")
         return {'total_doorbells': 0}
 
-def get_city_from_coordinates(polygon):
-    """Récupère le nom de la ville à partir des coordonnées du centre du polygone"""
+OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+
+OVERPASS_QUERIES = {
+    'buildings': """
+        [out:json][timeout:25];
+        (
+          way(poly:"{area}")["building"];
+          relation(poly:"{area}")["building"];
+        );
+        out body;
+        >;
+        out skel qt;
+        """,
+    'streets': """
+        [out:json][timeout:60];
+        (
+          way(poly:"{area}")[highway][name];
+        );
+        out body;
+        >;
+        out skel qt;
+        """,
+}
+
+def fetch_osm_data(kind, coordinates):
+    """Récupère les bâtiments ('buildings') ou les rues ('streets') d'un polygone
+
+    Le snapshot OSM local est utilisé lorsqu'il couvre le polygone, sinon l'API
+    Overpass. Retourne les données au format Overpass, ou None en cas d'échec.
+    """
+    source = app.config['OSM_SOURCE']
+    if source != 'overpass':
+        shape = to_shape(coordinates)
+        if shape is not None and (source == 'snapshot' or osm_snapshot.covers(shape)):
+            app.logger.info(f"Données OSM ({kind}) lues depuis le snapshot local")
+            if kind == 'buildings':
+                return osm_snapshot.buildings_in_polygon(shape)
+            return osm_snapshot.streets_in_polygon(shape)
+    
+    cached = get_cached_overpass(kind, coordinates)
+    if cached is not None:
+        app.logger.info(f"Réponse Overpass ({kind}) trouvée dans le cache")
+        return cached
+    
+    # Convertir les coordonnées au format requis par Overpass (lat lon)
+    area = " ".join(f"{lat} {lon}" for lon, lat in to_lon_lat(coordinates))
+    query = OVERPASS_QUERIES[kind].format(area=area)
+    app.logger.info(f"Requête Overpass : {query}")
+    
+    response = osm_post(OVERPASS_URL, data=query)
+    app.logger.info(f"Statut de la réponse : {response.status_code}")
+    if response.status_code != 200:
+        app.logger.error(f"Erreur Overpass : {response.text[:500]}")
+        return None
+    
+    try:
+        data = response.json()
+    except Exception as e:
+        app.logger.error(f"Erreur lors du parsing JSON : {str(e)}")
+        app.logger.error(f"Réponse reçue : {response.text[:500]}")
+        return None
+    
+    store_overpass(kind, coordinates, data)
+    return data
+
+def estimate_doorbells(tags):
+    """Estime le nombre de sonnettes d'un bâtiment à partir de ses tags OSM"""
+    building_type = tags.get('building', 'unknown')
+    
+    if building_type in ['apartments', 'residential'] or 'apartments' in tags:
+        # Pour les immeubles, estimer le nombre d'appartements
+        try:
+            levels = int(tags.get('building:levels', '3'))
+        except ValueError:
+            levels = 3
+        try:
+            apts_per_floor = int(tags.get('apartments_per_floor', '2'))
+        except ValueError:
+            apts_per_floor = 2
+        return levels * apts_per_floor
+    
+    # Pour les autres bâtiments, une seule sonnette
+    return 1
+
+def to_lon_lat(coordinates):
+    """Normalise une liste de coordonnées ([lng, lat] ou {'lat', 'lng'}) en tuples (lon, lat)"""
+    return [
+        (coord['lng'], coord['lat']) if isinstance(coord, dict) else (coord[0], coord[1])
+        for coord in coordinates
+    ]
+
+def to_shape(coordinates):
+    """Construit un polygone shapely valide à partir des coordonnées d'un territoire"""
+    points = to_lon_lat(coordinates)
+    if len(points) < 3:
+        return None
+    shape = Polygon(points)
+    if not shape.is_valid:
+        shape = shape.buffer(0)
+    return None if shape.is_empty else shape
+
+def count_buildings_batch(polygons):
+    """Compte les sonnettes de plusieurs territoires avec une seule requête Overpass
+
+    Les bâtiments de l'emprise globale sont téléchargés une fois, puis chacun est
+    attribué localement (via un STRtree) au premier territoire contenant son centre :
+    un bâtiment n'est donc compté qu'une seule fois. Retourne None si l'emprise est
+    trop grande ou si la requête échoue, afin de revenir au comptage par territoire.
+    """
+    try:
+        shapes = [to_shape(coordinates) for coordinates in polygons]
+        indexed = [(i, shape) for i, shape in enumerate(shapes) if shape is not None]
+        if not indexed:
+            return None
+        
+        # Emprise globale de l'import
+        west = min(shape.bounds[0] for _, shape in indexed)
+        south = min(shape.bounds[1] for _, shape in indexed)
+        east = max(shape.bounds[2] for _, shape in indexed)
+        north = max(shape.bounds[3] for _, shape in indexed)
+        source = app.config['OSM_SOURCE']
+        if source == 'snapshot' or (source == 'auto' and osm_snapshot.covers(box(west, south, east, north))):
+            data = osm_snapshot.buildings_in_bounds((west, south, east, north))
+        else:
+            if (east - west) * (north - south) > app.config['OVERPASS_BATCH_MAX_AREA']:
+                app.logger.info("Emprise trop grande pour une requête groupée, comptage par territoire")
+                return None
+            
+            query = f"""
+            [out:json][timeout:90];
+            (
+              way["building"]({south},{west},{north},{east});
+              relation["building"]({south},{west},{north},{east});
+            );
+            out tags center qt;
+            """
+            response = osm_post(OVERPASS_URL, data=query)
+            if response.status_code != 200:
+                app.logger.error(f"Erreur Overpass (requête groupée) : {response.status_code}")
+                return None
+            data = response.json()
+        
+        tree = STRtree([shape for _, shape in indexed])
+        doorbells = [0] * len(polygons)
+        for element in data.get('elements', []):
+            center = element.get('center')
+            if element.get('type') not in ['way', 'relation'] or 'tags' not in element or not center:
+                continue
+            matches = tree.query(Point(center['lon'], center['lat']), predicate='intersects')
+            if len(matches):
+                doorbells[indexed[min(matches)][0]] += estimate_doorbells(element['tags'])
+        
+        app.logger.info(f"Comptage groupé : {len(data.get('elements', []))} bâtiments pour {len(polygons)} territoires")
+        return [{'total_doorbells': count} for count in doorbells]
+    
+    except Exception as e:
+        app.logger.error(f"Erreur lors du comptage groupé des sonnettes : {str(e)}")
+        return None
+
+def get_city_from_coordinates(polygon, strict=False):
+    """Récupère le nom de la ville à partir des coordonnées du centre du polygone
+
+    Par défaut une erreur donne 'Ville inconnue' ; avec strict=True elle est levée.
+    """
     try:
         # Calculer le centre du polygone
         lats = [p[1] for p in polygon]
@@ -348,12 +712,15 @@ def get_city_from_coordinates(polygon):
         center_lat = sum(lats) / len(lats)
         center_lon = sum(lngs) / len(lngs)
         
+        # Consulter d'abord le cache partagé (les territoires voisins tombent dans la même cellule)
+        cached_city = get_cached_city(center_lat, center_lon)
+        if cached_city is not None:
+            app.logger.info(f"Ville trouvée dans le cache: {cached_city}")
+            return cached_city
+        
         # Utiliser Nominatim pour obtenir les informations de localisation
         url = f"https://nominatim.openstreetmap.org/reverse?format=json&lat={center_lat}&lon={center_lon}"
-        headers = {
-            'User-Agent': 'TerritoryDivider/1.0'
-        }
-        response = requests.get(url, headers=headers)
+        response = osm_get(url)
         
         if response.status_code == 200:
             data = response.json()
@@ -369,29 +736,69 @@ def get_city_from_coordinates(polygon):
                 'Ville inconnue'
             )
             
+            store_city(center_lat, center_lon, city)
             return city
-            
+        
+        if strict:
+            raise EnrichmentError(f"Nominatim a répondu {response.status_code}")
         return "Ville inconnue"
         
     except Exception as e:
+        if strict:
+            raise
         app.logger.error(f"Erreur lors de la récupération de la ville: {str(e)}")
         return "Ville inconnue"
 
-def get_next_territory_number():
-    """Retourne le prochain numéro de territoire disponible"""
-    last_territory = Territory.query.filter(
-        Territory.name.like('T%')
-    ).order_by(Territory.name.desc()).first()
+def enrich_territories(territories, workers=None):
+    """Complète chaque territoire (ville, sonnettes) en parallèle avec un nombre de workers borné
+
+    Les appels Nominatim restent espacés par le limiteur de débit par hôte,
+    tandis que les requêtes Overpass se chevauchent. Retourne la liste des
+    territoires dont l'enrichissement a échoué.
+    """
+    workers = workers or app.config['ENRICHMENT_WORKERS']
+
+    def enrich(territory):
+        """Retourne (ville, sonnettes), ou None en cas d'échec ; le territoire n'est pas modifié ici"""
+        with app.app_context():
+            try:
+                city = territory.get('city') or get_city_from_coordinates(territory['coordinates'], strict=True)
+                sonnettes = territory.get('sonnettes')
+                if sonnettes is None:
+                    building_stats = count_buildings_and_apartments(territory['coordinates'], strict=True)
+                    sonnettes = building_stats['total_doorbells']
+                return city, sonnettes
+            except Exception as e:
+                app.logger.error(f"Erreur lors de l'enrichissement du territoire {territory.get('name')}: {str(e)}")
+                return None
+
+    if not territories:
+        return []
     
-    if not last_territory:
-        return 1
+    # Une seule requête Overpass pour tous les territoires de l'import si possible
+    to_count = [t for t in territories if t.get('sonnettes') is None]
+    if len(to_count) > 1:
+        batch_stats = count_buildings_batch([t['coordinates'] for t in to_count])
+        if batch_stats is not None:
+            for territory, building_stats in zip(to_count, batch_stats):
+                territory['sonnettes'] = building_stats['total_doorbells']
     
-    try:
-        # Extraire le numéro du nom (ex: T1-Paris -> 1)
-        last_number = int(last_territory.name.split('-')[0][1:])
-        return last_number + 1
-    except (ValueError, IndexError):
-        return 1
+    app.logger.info(f"Enrichissement de {len(territories)} territoires avec {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(enrich, territories))
+
+    # Résultats appliqués une fois tous les appels terminés : un territoire en
+    # échec reçoit uniquement les valeurs par défaut, jamais un résultat partiel
+    failed = []
+    for territory, result in zip(territories, results):
+        if result is None:
+            territory['city'] = territory.get('city') or 'Ville inconnue'
+            if territory.get('sonnettes') is None:
+                territory['sonnettes'] = 0
+            failed.append(territory)
+        else:
+            territory['city'], territory['sonnettes'] = result
+    return failed
 
 @app.route('/upload-kml', methods=['POST'])
 @login_required
@@ -410,9 +817,27 @@ def upload_kml():
             app.logger.error("Nom de fichier vide")
             return jsonify({'error': 'Aucun fichier sélectionné'}), 400
             
-        if not file.filename.lower().endswith('.kml'):
+        if not file.filename.lower().endswith(('.kml', '.kmz')):
             app.logger.error("Le fichier n'est pas un KML")
-            return jsonify({'error': 'Le fichier doit être au format KML'}), 400
+            return jsonify({'error': 'Le fichier doit être au format KML ou KMZ'}), 400
+        
+        # En mode asynchrone, les placemarks sont lus en flux et stockés par lots :
+        # l'enrichissement et la création des territoires sont confiés au worker de tâches de fond
+        async_mode = request.args.get('async') == '1' or request.form.get('async') == '1'
+        
+        if async_mode:
+            try:
+                job = stage_kml_job(file, current_user.id)
+            except KmlError as e:
+                app.logger.error(f"Erreur lors du parsing: {e}")
+                return jsonify({'error': str(e)}), 400
+            app.logger.info(f"Tâche d'import {job.id} créée pour {job.total} territoires")
+            return jsonify({
+                'success': True,
+                'message': f"{job.total} territoires trouvés",
+                'job': job_progress(job),
+                'status_url': url_for('job_status', job_id=job.id)
+            }), 202
         
         # Parser le fichier KML
         app.logger.info("Parsing du fichier KML...")
@@ -422,8 +847,8 @@ def upload_kml():
             app.logger.error(f"Erreur lors du parsing: {result}")
             return jsonify({'error': result}), 400
         
-        # Stocker les coordonnées pour une utilisation ultérieure
-        territories_store['coordinates'] = result
+        # Stocker les territoires enrichis pour la génération (quel que soit le worker qui la traite)
+        stage_import(current_user.id, result)
         app.logger.info(f"Territoires stockés: {len(result)} territoires")
         
         app.logger.info("=== Fin de l'upload KML avec succès ===")
@@ -441,110 +866,171 @@ def upload_kml():
             'details': str(e)
         }), 500
 
+def territory_values(territory_data, user_id):
+    """Valeurs de colonnes d'un territoire pour une insertion groupée (lève ValueError sans coordonnées)"""
+    polygon = territory_data.get('coordinates', [])
+    if not polygon:
+        raise ValueError("Pas de coordonnées")
+
+    # Numéro du KML, ou attribué par numbering.assign_numbers
+    territory_number = territory_data.get('number', '')
+    now = datetime.utcnow()
+    values = {
+        'uuid': str(uuid.uuid4()),
+        'name': territory_data.get('name', f'Territoire {territory_number}'),
+        'type': territory_data.get('type', 'standard'),
+        'number': territory_number,
+        'city': territory_data.get('city'),
+        'sonnettes': territory_data.get('sonnettes') or 0,  # Nombre total de sonnettes
+        'buildings': 0,
+        'apartments': 0,
+        'user_id': user_id,
+        'commentaire': territory_data.get('commentaire', ''),
+        'created_at': now,
+        'updated_at': now,
+    }
+    values.update(Territory.geometry_values(polygon))
+    return values
+
+def insert_territories(kml_data, user_id):
+    """Insère des territoires par INSERT groupé, sans valider la transaction
+
+    En cas d'échec du lot, chaque ligne est réinsérée dans son propre point de
+    sauvegarde pour isoler les lignes fautives. Retourne (nombre inséré, échecs),
+    chaque échec étant {'index', 'name', 'error'} (index dans kml_data).
+    """
+    rows, indexes, failed = [], [], []
+    for index, territory_data in enumerate(kml_data):
+        try:
+            rows.append(territory_values(territory_data, user_id))
+            indexes.append(index)
+        except Exception as e:
+            failed.append({'index': index, 'name': territory_data.get('name'), 'error': str(e)})
+
+    if not rows:
+        return 0, failed
+
+    territory_table = Territory.__table__
+    inserted = rows
+    try:
+        with db.session.begin_nested():
+            db.session.execute(territory_table.insert(), rows)
+    except DBAPIError as e:
+        app.logger.warning(f"Échec de l'insertion groupée ({str(e.orig)}) : insertion ligne par ligne")
+        inserted = []
+        for index, row in zip(indexes, rows):
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(territory_table.insert(), [row])
+                inserted.append(row)
+            except DBAPIError as row_error:
+                failed.append({'index': index, 'name': row['name'], 'error': str(row_error.orig)})
+        failed.sort(key=lambda f: f['index'])
+
+    # L'INSERT groupé contourne l'ORM : mettre à jour les agrégats par ville explicitement
+    rollups.refresh_city_stats(db.session, {(user_id, row['city']) for row in inserted})
+    return len(inserted), failed
+
 def generate_territories(kml_data, user_id):
-    """Génère des territoires à partir des données KML"""
+    """Génère des territoires à partir des données KML, par lots validés séparément
+
+    Retourne (succès, message, échecs) ; un lot validé reste acquis même si un lot suivant échoue.
+    """
     app.logger.info("=== Début de la génération des territoires ===")
+    chunk_size = app.config['BULK_INSERT_CHUNK_SIZE']
+    created, failed = 0, []
     try:
-        territories = []
-        for territory_data in kml_data:
-            try:
-                # Générer un UUID pour le territoire
-                territory_uuid = str(uuid.uuid4())
-                app.logger.info(f"UUID généré: {territory_uuid}")
-
-                # Récupérer ou générer le numéro de territoire
-                territory_number = territory_data.get('number', '')
-                if not territory_number:
-                    territory_number = str(get_next_territory_number())
-                
-                # Récupérer le type de territoire
-                territory_type = territory_data.get('type', 'standard')
-                
-                # Récupérer les coordonnées et calculer les statistiques
-                polygon = territory_data.get('coordinates', [])
-                if not polygon:
-                    app.logger.warning(f"Pas de coordonnées pour le territoire {territory_data.get('name', 'sans nom')}")
-                    continue
-                
-                # Obtenir la ville si elle n'est pas déjà définie
-                city = territory_data.get('city')
-                if not city:
-                    city = get_city_from_coordinates(polygon)
-                
-                # Compter les bâtiments
-                building_stats = count_buildings_and_apartments(polygon)
-                
-                # Créer le territoire
-                territory = Territory(
-                    uuid=territory_uuid,
-                    name=territory_data.get('name', f'Territoire {territory_number}'),
-                    type=territory_type,
-                    number=territory_number,
-                    city=city,
-                    coordinates=polygon,
-                    sonnettes=building_stats['total_doorbells'],  # Nombre total de sonnettes
-                    user_id=user_id,
-                    commentaire=territory_data.get('commentaire', '')
-                )
-                
-                db.session.add(territory)
-                territories.append(territory)
-                app.logger.info(f"Territoire ajouté: {territory.name} ({territory.number})")
-                
-            except Exception as e:
-                app.logger.error(f"Erreur lors de la génération d'un territoire: {str(e)}")
-                app.logger.error(traceback.format_exc())
-                continue
-        
-        if territories:
+        # Les données déjà enrichies (upload KML) ne refont aucune requête réseau
+        enrich_territories([t for t in kml_data if t.get('coordinates')])
+        # Numéros manquants : un seul bloc réservé sur le compteur de l'utilisateur
+        numbering.assign_numbers(kml_data, user_id)
+
+        for start in range(0, len(kml_data), chunk_size):
+            chunk = kml_data[start:start + chunk_size]
             try:
+                count, chunk_failed = insert_territories(chunk, user_id)
                 db.session.commit()
-                app.logger.info(f"{len(territories)} territoires créés avec succès")
-                return True, f"{len(territories)} territoires créés avec succès"
             except Exception as e:
                 db.session.rollback()
-                app.logger.error(f"Erreur lors de la sauvegarde des territoires: {str(e)}")
+                app.logger.error(f"Erreur lors de la sauvegarde du lot {start}-{start + len(chunk)}: {str(e)}")
                 app.logger.error(traceback.format_exc())
-                return False, f"Erreur lors de la sauvegarde des territoires: {str(e)}"
-        else:
-            app.logger.warning("Aucun territoire n'a été créé")
-            return False, "Aucun territoire n'a été créé"
-            
+                count = 0
+                chunk_failed = [{'index': i, 'name': t.get('name'), 'error': str(e)} for i, t in enumerate(chunk)]
+            created += count
+            failed += [dict(f, index=f['index'] + start) for f in chunk_failed]
+            app.logger.info(f"Lot {start}-{start + len(chunk)} : {count} territoires insérés, {len(chunk_failed)} échecs")
+
     except Exception as e:
+        db.session.rollback()
         app.logger.error(f"Erreur lors de la génération des territoires: {str(e)}")
         app.logger.error(traceback.format_exc())
-        return False, str(e)
+        return created > 0, str(e), failed
+
+    for failure in failed:
+        app.logger.warning(f"Territoire non créé ({failure['index']}, {failure['name']}) : {failure['error']}")
+
+    if not created:
+        app.logger.warning("Aucun territoire n'a été créé")
+        return False, "Aucun territoire n'a été créé", failed
+
+    message = f"{created} territoires créés avec succès"
+    if failed:
+        message += f" ({len(failed)} en erreur)"
+    app.logger.info(message)
+    return True, message, failed
+
+@jobs.handler('import_kml')
+def import_kml_chunk(job):
+    """Enrichit et crée un lot de territoires importés, disponibles dès la validation du lot"""
+    seq = job.cursor or 0
+    staged = ImportChunk.query.filter_by(job_id=job.id, seq=seq).first()
+    if staged is None:
+        return True
+    chunk = staged.placemarks
+    
+    # Un territoire dont l'enrichissement a échoué n'est pas créé : il est compté en erreur
+    not_enriched = enrich_territories([t for t in chunk if t.get('coordinates')])
+    not_enriched_ids = {id(t) for t in not_enriched}
+    to_insert = [t for t in chunk if id(t) not in not_enriched_ids]
+    # Le lot est validé par le moteur de tâches avec la progression
+    count, failed = insert_territories(to_insert, job.user_id)
+    job.processed += len(chunk)
+    job.failed += len(not_enriched) + len(failed)
+    job.cursor = seq + 1
+    # Le lot traité est supprimé dans la même transaction que la progression
+    db.session.delete(staged)
+    app.logger.info(f"Tâche {job.id} : {job.processed}/{job.total} territoires importés")
+    return False
 
 @app.route('/generate_territories', methods=['POST'])
 @login_required
 def generate_territories_view():
     try:
         app.logger.info("=== Début de la génération des territoires ===")
-        coordinates = territories_store.get('coordinates', [])
+        coordinates = get_staged_import(current_user.id)
         app.logger.info(f"Nombre de territoires à générer: {len(coordinates)}")
-        app.logger.info(f"Contenu du store: {coordinates}")
 
         if not coordinates:
             app.logger.error("Aucune coordonnée trouvée dans le store")
             return jsonify({'status': 'error', 'message': 'Aucune coordonnée trouvée'}), 400
 
-        success, result = generate_territories(coordinates, current_user.id)
+        success, result, failed = generate_territories(coordinates, current_user.id)
         if success:
-            return jsonify({'status': 'success', 'message': f"Territoires créés avec succès: {', '.join(result)}"}), 200
+            # Les territoires sont créés : l'upload en attente ne doit pas être généré une seconde fois
+            ImportStaging.query.filter_by(user_id=current_user.id).delete(synchronize_session=False)
+            db.session.commit()
+            return jsonify({'status': 'success', 'message': result, 'failed': failed}), 200
         else:
-            return jsonify({'status': 'error', 'message': f"Erreurs lors de la génération des territoires: {', '.join(result)}"}), 400
+            return jsonify({'status': 'error', 'message': f"Erreurs lors de la génération des territoires: {result}", 'failed': failed}), 400
 
     except Exception as e:
         app.logger.error(f"Erreur générale: {str(e)}")
         app.logger.error(traceback.format_exc())
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-def generate_google_maps_url(coordinates):
-    # Calculer le centre du polygone
-    lats = [coord[1] if isinstance(coord, list) else coord['lat'] for coord in coordinates]
-    lngs = [coord[0] if isinstance(coord, list) else coord['lng'] for coord in coordinates]
-    center_lat = sum(lats) / len(lats)
-    center_lng = sum(lngs) / len(lngs)
+def generate_google_maps_url(territory):
+    # Centre précalculé à l'écriture de la géométrie
+    center_lat, center_lng = territory.centroid
     
     # Créer l'URL avec le centre et le zoom
     base_url = f"https://www.google.com/maps/search/?api=1&query={center_lat},{center_lng}"
@@ -564,20 +1050,9 @@ def view_territory(uuid):
             return redirect(url_for('index'))
         
         app.logger.info(f"Territoire trouvé : {territory.name}")
-        app.logger.info(f"Coordonnées : {territory.coordinates}")
+        app.logger.info(f"Géométrie : {territory.vertex_count} sommets, {territory.area_m2 or 0:.0f} m²")
         app.logger.info(f"Commentaire : {territory.commentaire}")
         
-        # Générer le QR code pour Google Maps
-        maps_url = generate_google_maps_url(territory.coordinates)
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(maps_url)
-        qr.make(fit=True)
-        
-        # Créer l'image QR code
-        qr_img = qr.make_image(fill_color="black", back_color="white")
-        qr_path = os.path.join(app.config['QR_FOLDER'], f'{territory.uuid}.png')
-        qr_img.save(qr_path)
-        
         # Récupérer la clé API Google Maps
         google_maps_api_key = os.getenv('GOOGLE_MAPS_API_KEY')
         if not google_maps_api_key:
@@ -607,14 +1082,11 @@ def delete_territory(uuid):
         return redirect(url_for('index'))
     
     try:
-        # Supprimer le QR code associé
-        qr_path = os.path.join(app.config['QR_FOLDER'], f'{territory.uuid}.png')
-        if os.path.exists(qr_path):
-            os.remove(qr_path)
-        
         # Supprimer le territoire de la base de données
         db.session.delete(territory)
         db.session.commit()
+        # Le QR code peut être partagé : le nettoyage des fichiers orphelins se fait en tâche de fond
+        schedule_qr_cleanup(current_user.id)
         
         flash('Le territoire a été supprimé avec succès.', 'success')
         return redirect(url_for('index'))
@@ -628,57 +1100,392 @@ def delete_territory(uuid):
 @login_required
 def print_territories_by_city(city):
     """Affiche tous les territoires d'une ville pour impression"""
-    territories = Territory.query.filter_by(city=city).order_by(Territory.name).all()
+    # Contours simplifiés au niveau de détail adapté au zoom, chargés avec les territoires pour versionner les vignettes
+    level = geometry_codec.level_for_zoom(request.args.get('zoom', app.config['PRINT_MAP_ZOOM'], type=int))
+    territories = Territory.query.options(
+        db.undefer(Territory.geometry_column(level))
+    ).filter_by(city=city, user_id=current_user.id).order_by(Territory.name).all()
     return render_template(
         'print_territories.html',
         territories=territories,
+        level=level,
         city=city,
-        google_maps_api_key=os.getenv('GOOGLE_MAPS_API_KEY')
+        zip_export_max=app.config['ZIP_EXPORT_MAX_TERRITORIES']
+    )
+
+def card_streets(territories, workers=None):
+    """Rues de chaque territoire (cache Overpass ou snapshot), récupérées en parallèle"""
+    workers = workers or app.config['ENRICHMENT_WORKERS']
+
+    def streets(coordinates):
+        with app.app_context():
+            return get_streets_in_territory(coordinates)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(streets, [t.coordinates for t in territories]))
+
+def card_template_path():
+    return os.path.join(app.static_folder, 'images', 'carte_territoire_template.jpg')
+
+def card_data(territory, level, streets):
+    """Données d'une carte imprimable (types simples, transmissibles à un autre processus)"""
+    return {
+        'city': territory.city, 'name': territory.name, 'number': territory.number,
+        'outline': territory.coordinates_at(level), 'qr_data': generate_google_maps_url(territory),
+        'sonnettes': territory.sonnettes, 'streets': streets,
+    }
+
+_card_render_pool = None
+
+def card_render_pool():
+    """Pool de processus de rendu des pages, créé une fois par worker de tâches (None avec un seul processus)"""
+    global _card_render_pool
+    if _card_render_pool is None and app.config['CARD_RENDER_WORKERS'] > 1:
+        _card_render_pool = ProcessPoolExecutor(max_workers=app.config['CARD_RENDER_WORKERS'])
+    return _card_render_pool
+
+def card_pdf_path(job_id):
+    return os.path.join(app.config['CARD_PDF_FOLDER'], f"{job_id}.pdf")
+
+def purge_card_pdfs():
+    """Supprime les PDF de cartes rendus depuis plus de CARD_PDF_MAX_AGE secondes"""
+    folder = app.config['CARD_PDF_FOLDER']
+    if not os.path.isdir(folder):
+        return
+    expire_before = time.time() - app.config['CARD_PDF_MAX_AGE']
+    for entry in os.scandir(folder):
+        if entry.name.endswith('.pdf') and entry.stat().st_mtime < expire_before:
+            try:
+                os.remove(entry.path)
+            except OSError as e:
+                app.logger.error(f"Erreur lors de la suppression du PDF {entry.name}: {str(e)}")
+
+@app.route('/territories/print/<city>/cards.pdf', methods=['POST'])
+@login_required
+def print_city_cards_pdf(city):
+    """Lance le rendu des cartes d'une ville en un seul PDF (plusieurs cartes par page) en tâche de fond
+
+    Paramètres : `columns` et `rows` (disposition, de 1 à 4) et `streets=0`
+    pour ne pas lister les rues. Le client suit la tâche via /jobs/<id> ;
+    une fois terminée, son `download_url` donne le PDF.
+    """
+    columns = min(max(request.args.get('columns', app.config['CARD_PDF_COLUMNS'], type=int), 1), 4)
+    rows = min(max(request.args.get('rows', app.config['CARD_PDF_ROWS'], type=int), 1), 4)
+    ids = [territory_id for territory_id, in db.session.query(Territory.id).filter(
+        Territory.city == city, Territory.user_id == current_user.id
+    ).order_by(Territory.name, Territory.id)]
+    if not ids:
+        return jsonify({'error': 'Aucun territoire pour cette ville'}), 404
+
+    purge_card_pdfs()
+    job = jobs.enqueue('city_cards_pdf', current_user.id, total=len(ids), payload={
+        'city': city, 'columns': columns, 'rows': rows, 'ids': ids,
+        'streets': request.args.get('streets', '1') != '0', 'size': 0
+    })
+    app.logger.info(f"Tâche {job.id} créée pour le PDF des {len(ids)} cartes de {city}")
+    return jsonify({'job': job_progress(job), 'status_url': url_for('job_status', job_id=job.id)}), 202
+
+@jobs.handler('city_cards_pdf')
+def city_cards_pdf_chunk(job):
+    """Rend un lot de pages de cartes et l'ajoute au PDF de la tâche
+
+    Un lot compte CARD_RENDER_WORKERS pages, rendues dans le pool partagé. La
+    taille du fichier est validée avec la progression : à la reprise après un
+    arrêt, les pages d'un lot non validé sont retirées en tronquant le fichier.
+    """
+    payload = job.payload
+    per_page = payload['columns'] * payload['rows']
+    workers = app.config['CARD_RENDER_WORKERS']
+    start = job.cursor or 0
+    chunk_ids = payload['ids'][start:start + per_page * workers]
+    if not chunk_ids:
+        if not payload['size']:
+            raise ValueError("Aucun territoire à imprimer")
+        return True
+
+    level = geometry_codec.level_for_zoom(app.config['PRINT_MAP_ZOOM'])
+    by_id = {t.id: t for t in Territory.query.options(
+        db.undefer(Territory.geometry), db.undefer(Territory.geometry_column(level))
+    ).filter(Territory.id.in_(chunk_ids), Territory.user_id == job.user_id)}
+    # Les territoires supprimés depuis le lancement sont comptés en erreur
+    territories = [by_id[i] for i in chunk_ids if i in by_id]
+    streets = card_streets(territories) if payload['streets'] else [[] for _ in territories]
+    cards = [card_data(territory, level, territory_streets) for territory, territory_streets in zip(territories, streets)]
+    pages = [cards[i:i + per_page] for i in range(0, len(cards), per_page)]
+    render_page = functools.partial(
+        card_renderer.render_page, card_template_path(), columns=payload['columns'], rows=payload['rows'],
+        dpi=app.config['CARD_PDF_DPI'], font=app.config['CARD_FONT']
     )
 
+    os.makedirs(app.config['CARD_PDF_FOLDER'], exist_ok=True)
+    with open(card_pdf_path(job.id), 'r+b' if payload['size'] else 'w+b') as output:
+        output.truncate(payload['size'])
+        output.seek(payload['size'])
+        count = card_renderer.write_pdf(
+            card_renderer.render_pages(render_page, pages, card_render_pool(), workers),
+            output, app.config['CARD_PDF_DPI'], append=payload['size'] > 0
+        )
+        output.seek(0, os.SEEK_END)
+        size = output.tell()
+
+    job.payload = {**payload, 'size': size}
+    job.processed += len(chunk_ids)
+    job.failed += len(chunk_ids) - len(territories)
+    job.cursor = start + len(chunk_ids)
+    app.logger.info(f"Tâche {job.id} : {job.processed}/{job.total} cartes rendues ({count} pages ajoutées)")
+    return False
+
+@app.route('/jobs/<job_id>/cards.pdf')
+@login_required
+def download_city_cards_pdf(job_id):
+    """PDF de cartes produit par une tâche terminée"""
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id, kind='city_cards_pdf').first_or_404()
+    if job.status != 'done':
+        return jsonify({'error': "Le PDF n'est pas encore prêt", 'job': job_progress(job)}), 409
+    path = card_pdf_path(job.id)
+    if not os.path.exists(path):
+        return jsonify({'error': 'Le PDF a expiré, relancer le rendu'}), 410
+    return send_file(path, mimetype='application/pdf', as_attachment=True,
+                     download_name=f"cartes_{secure_filename(job.payload['city']) or 'territoires'}.pdf")
+
+@app.route('/territories/export.zip')
+@login_required
+def export_territories_zip():
+    """Archive ZIP des QR codes et cartes imprimables, produite en streaming
+
+    Sélection : `city` (tous les territoires d'une ville) ou un ou plusieurs
+    `uuid`, limitée à ZIP_EXPORT_MAX_TERRITORIES car l'archive est rendue dans
+    la requête. `streets=1` ajoute les rues sur les cartes (sélection limitée
+    alors à ZIP_EXPORT_MAX_WITH_STREETS). Les territoires sont chargés par lots
+    de ZIP_EXPORT_CHUNK_SIZE et chaque entrée est envoyée dès qu'elle est
+    rendue : la mémoire ne dépend pas de la taille de l'archive.
+    """
+    city = request.args.get('city')
+    uuids = request.args.getlist('uuid')
+    if not city and not uuids:
+        return jsonify({'error': 'Indiquer une ville (city) ou des territoires (uuid)'}), 400
+
+    query = db.session.query(Territory.id).filter(Territory.user_id == current_user.id)
+    if city:
+        query = query.filter(Territory.city == city)
+    if uuids:
+        query = query.filter(Territory.uuid.in_(uuids))
+    # Seuls les identifiants sont chargés d'avance ; les géométries le sont lot par lot
+    ids = [territory_id for territory_id, in query.order_by(Territory.name, Territory.id)]
+    if not ids:
+        return jsonify({'error': 'Aucun territoire à exporter'}), 404
+
+    with_streets = request.args.get('streets', '0') == '1'
+    limit = app.config['ZIP_EXPORT_MAX_WITH_STREETS' if with_streets else 'ZIP_EXPORT_MAX_TERRITORIES']
+    if len(ids) > limit:
+        return jsonify({
+            'error': f"{len(ids)} territoires sélectionnés, au plus {limit} par archive"
+                     f"{' avec les rues' if with_streets else ''} : réduire la sélection (uuid)"
+        }), 400
+    chunk_size = app.config['ZIP_EXPORT_CHUNK_SIZE']
+    level = geometry_codec.level_for_zoom(app.config['PRINT_MAP_ZOOM'])
+    template = card_renderer.load_template(card_template_path())
+    font = app.config['CARD_FONT']
+
+    def entries():
+        for start in range(0, len(ids), chunk_size):
+            chunk_ids = ids[start:start + chunk_size]
+            by_id = {t.id: t for t in Territory.query.options(
+                db.undefer(Territory.geometry), db.undefer(Territory.geometry_column(level))
+            ).filter(Territory.id.in_(chunk_ids))}
+            territories = [by_id[i] for i in chunk_ids if i in by_id]
+            streets = card_streets(territories) if with_streets else [[] for _ in territories]
+            for territory, territory_streets in zip(territories, streets):
+                basename = f"{secure_filename(territory.number or territory.name or '') or 'territoire'}_{territory.uuid[:8]}"
+                qr_data = generate_google_maps_url(territory)
+                yield f"qr/{basename}.png", render_qr_cached(qr_data, 'png', 10)
+                card = card_data(territory, level, territory_streets)
+                yield f"cartes/{basename}.png", card_renderer.render_card_png(template, card, font)
+            # Libérer les territoires du lot avant de charger le suivant
+            for territory in territories:
+                db.session.expunge(territory)
+
+    filename = secure_filename(city) if city else 'selection'
+    response = Response(stream_with_context(zip_stream.stream_zip(entries())), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f"attachment; filename=territoires_{filename or 'export'}.zip"
+    return response
+
+EXPORT_FORMATS = {
+    'geojson': ('application/geo+json', territory_export.stream_geojson),
+    'kml': ('application/vnd.google-earth.kml+xml', territory_export.stream_kml),
+}
+
+@app.route('/territories/export.<fmt>')
+@login_required
+def export_territories(fmt):
+    """Export de tous les territoires en GeoJSON ou KML, écrit en flux
+
+    Filtres facultatifs : `city` et `type`. Les lignes sont lues par lots de
+    EXPORT_YIELD_PER via un curseur côté serveur (stream_results) et chaque
+    territoire est envoyé dès qu'il est lu : la mémoire reste stable et les
+    premiers octets partent immédiatement.
+    """
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"Format non supporté : {fmt}"}), 404
+    mimetype, stream = EXPORT_FORMATS[fmt]
+
+    query = db.select(
+        *[TERRITORY_FIELDS[f] for f in territory_export.EXPORT_FIELDS], Territory.geometry
+    ).where(Territory.user_id == current_user.id)
+    city = request.args.get('city')
+    if city:
+        query = query.where(Territory.city == city)
+    territory_type = request.args.get('type')
+    if territory_type:
+        query = query.where(Territory.type == territory_type)
+    query = query.order_by(Territory.city, Territory.number, Territory.id)
+
+    def rows():
+        yield from db.session.execute(query.execution_options(yield_per=app.config['EXPORT_YIELD_PER']))
+
+    filename = secure_filename('_'.join(filter(None, ['territoires', city, territory_type]))) or 'territoires'
+    args = (rows(), city or 'Territoires') if fmt == 'kml' else (rows(),)
+    response = Response(stream_with_context(stream(*args)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f"attachment; filename={filename}.{fmt}"
+    return response
+
+def tile_query(user_id, z, x, y, *columns):
+    """Territoires de l'utilisateur dont l'emprise croise la tuile (index ix_territory_user_bbox)"""
+    west, south, east, north = tiles.tile_bounds(z, x, y)
+    return db.session.query(*columns).filter(
+        Territory.user_id == user_id,
+        Territory.min_lat <= north, Territory.max_lat >= south,
+        Territory.min_lon <= east, Territory.max_lon >= west
+    )
+
+def render_tile(user_id, z, x, y, signature, clustered=False):
+    """Rend une tuile ; `signature` ne sert qu'à la clé du cache (elle change avec le contenu)"""
+    if clustered:
+        return tiles.cluster_collection(z, x, y, tile_clusters(user_id, z, x, y))
+    level = geometry_codec.level_for_zoom(z)
+    rows = tile_query(
+        user_id, z, x, y, Territory.uuid, Territory.name, Territory.number, Territory.type,
+        Territory.city, Territory.geometry_column(level)
+    ).order_by(Territory.id).all()
+    return tiles.feature_collection(rows)
+
+def tile_clusters(user_id, z, x, y):
+    """Nombre et centre moyen des territoires par case de la grille, d'après leurs centroïdes
+
+    Seuls les centroïdes situés dans la tuile sont comptés : chaque territoire
+    figure dans un seul point, quel que soit le nombre de tuiles qu'il croise.
+    """
+    west, south, east, north = tiles.tile_bounds(z, x, y)
+    grid = app.config['TILE_CLUSTER_GRID']
+    column = db.func.floor((Territory.centroid_lon - west) * (grid / (east - west)))
+    row = db.func.floor((north - Territory.centroid_lat) * (grid / (north - south)))
+    return tile_query(
+        user_id, z, x, y, column, row, db.func.count(Territory.id),
+        db.func.avg(Territory.centroid_lon), db.func.avg(Territory.centroid_lat)
+    ).filter(
+        Territory.centroid_lon >= west, Territory.centroid_lon < east,
+        Territory.centroid_lat > south, Territory.centroid_lat <= north
+    ).group_by(column, row).all()
+
+# Tuiles rendues gardées en mémoire, indexées par (utilisateur, z, x, y, signature, regroupement) :
+# une modification change la signature des seules tuiles concernées
+render_tile_cached = functools.lru_cache(maxsize=app.config['TILE_CACHE_SIZE'])(render_tile)
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>.geojson')
+@login_required
+def territory_tile(z, x, y):
+    """Tuile GeoJSON des territoires qui croisent la tuile, simplifiés pour son zoom
+
+    Un premier agrégat (nombre, dernier updated_at) décide du rendu : points
+    regroupés sous TILE_MIN_ZOOM ou au-delà de TILE_MAX_FEATURES territoires,
+    contours sinon. Pour les contours, la signature (id et updated_at des
+    territoires de la tuile) est lue sur l'index d'emprise sans charger les
+    géométries. Elle sert d'ETag, et une tuile inchangée est resservie depuis
+    le cache ou par un 304.
+    """
+    if not tiles.valid_tile(z, x, y):
+        return jsonify({'error': 'Tuile invalide'}), 404
+
+    count, last_updated = tile_query(
+        current_user.id, z, x, y, db.func.count(Territory.id), db.func.max(Territory.updated_at)
+    ).one()
+    clustered = z < app.config['TILE_MIN_ZOOM'] or count > app.config['TILE_MAX_FEATURES']
+    if clustered:
+        versions = [('clusters', f"{count}:{last_updated}")]
+    else:
+        versions = tile_query(current_user.id, z, x, y, Territory.id, Territory.updated_at).all()
+    etag = tiles.tile_signature(z, x, y, versions)
+    if not_modified(etag):
+        response = Response(status=304)
+    else:
+        response = Response(render_tile_cached(current_user.id, z, x, y, etag, clustered),
+                            mimetype='application/geo+json')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def city_stats_validators(city_rows):
+    """Retourne (ETag, Last-Modified) d'une liste d'agrégats city_stats déjà lus
+
+    L'ETag est l'empreinte des valeurs servies (ville et totaux) : une
+    suppression change le nombre de territoires de sa ville, ou fait disparaître
+    la ville. Last-Modified n'est envoyé qu'à titre indicatif, avec l'ETag.
+    """
+    digest = hashlib.sha1()
+    for row in city_rows:
+        digest.update(f"{row.city}:{row.territories}:{row.buildings}:{row.apartments}:{row.sonnettes};".encode('utf-8'))
+    last_updated = max((row.updated_at for row in city_rows), default=None)
+    last_modified = last_updated.replace(tzinfo=timezone.utc, microsecond=0) if last_updated else None
+    return digest.hexdigest(), last_modified
+
+def not_modified(etag):
+    """Indique si l'ETag de la requête conditionnelle correspond encore à la ressource
+
+    If-Modified-Since seul n'est pas pris en compte : une date ne capte pas les
+    suppressions.
+    """
+    return bool(request.if_none_match) and request.if_none_match.contains(etag)
+
+def with_validators(response, etag, last_modified=None):
+    """Ajoute les validateurs de cache ; le client doit revalider à chaque chargement"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/territories/cities')
 @login_required
 def list_cities():
     """Liste toutes les villes avec leurs statistiques"""
     try:
-        app.logger.info("Récupération de la liste des villes...")
-        territories = Territory.query.filter_by(user_id=current_user.id).all()
-        
-        # Pour les requêtes AJAX, renvoyer du JSON
-        cities = {}
-        for territory in territories:
-            if not territory.city:  # Skip territories without city
-                continue
-                
-            if territory.city not in cities:
-                cities[territory.city] = {
-                    'territories': 0,
-                    'houses': 0,
-                    'apartments': 0,
-                    'sonnettes': 0
-                }
-            cities[territory.city]['territories'] += 1
-            cities[territory.city]['houses'] += territory.buildings or 0
-            cities[territory.city]['apartments'] += territory.apartments or 0
-            # Gérer le cas où sonnettes n'est pas encore défini dans certains enregistrements
-            if hasattr(territory, 'sonnettes'):
-                cities[territory.city]['sonnettes'] += territory.sonnettes or 0
-        
-        # Convertir en liste pour le JSON
+        # Agrégats maintenus par rollups.py (les territoires sans ville ont la clé '') :
+        # une seule requête sert à la fois la réponse et ses validateurs
+        city_rows = CityStats.query.filter(
+            CityStats.user_id == current_user.id,
+            CityStats.city != ''
+        ).order_by(CityStats.city).all()
+
+        etag, last_modified = city_stats_validators(city_rows)
+        if not_modified(etag):
+            return with_validators(Response(status=304), etag, last_modified)
+
         cities_list = [
             {
-                'name': city,
-                'stats': stats
+                'name': row.city,
+                'stats': {
+                    'territories': row.territories,
+                    'houses': row.buildings,
+                    'apartments': row.apartments,
+                    'sonnettes': row.sonnettes
+                }
             }
-            for city, stats in cities.items()
-            if city  # Ne pas inclure les villes None ou vides
+            for row in city_rows
         ]
-        
-        # Trier par nom de ville
-        cities_list.sort(key=lambda x: x['name'])
-        
-        app.logger.info(f"Villes trouvées : {[city['name'] for city in cities_list]}")
-        return jsonify({'cities': cities_list})
+
+        return with_validators(jsonify({'cities': cities_list}), etag, last_modified)
         
     except Exception as e:
         app.logger.error(f"Erreur lors de la récupération des villes : {str(e)}")
@@ -705,19 +1512,18 @@ def delete_territories():
         return jsonify({'error': 'No territories provided'}), 400
         
     try:
-        # Supprimer les QR codes
-        for uuid in territory_ids:
-            qr_path = os.path.join(app.config['QR_FOLDER'], f"{uuid}.png")
-            if os.path.exists(qr_path):
-                os.remove(qr_path)
-        
         # Supprimer les territoires de la base de données
-        Territory.query.filter(
+        selection = Territory.query.filter(
             Territory.uuid.in_(territory_ids),
             Territory.user_id == current_user.id
-        ).delete(synchronize_session=False)
+        )
+        # La suppression en masse contourne l'ORM : mettre à jour les agrégats explicitement
+        affected = {(current_user.id, city) for (city,) in selection.with_entities(Territory.city).distinct()}
+        selection.delete(synchronize_session=False)
+        rollups.refresh_city_stats(db.session, affected)
         
         db.session.commit()
+        schedule_qr_cleanup(current_user.id)
         return jsonify({'success': True})
     except Exception as e:
         db.session.rollback()
@@ -767,47 +1573,34 @@ def analyze_territory(uuid):
         flash(f'Une erreur est survenue : {str(e)}', 'danger')
         return redirect(url_for('view_territory', uuid=uuid))
 
-def calculate_stats(territories):
-    """Calcule les statistiques pour une liste de territoires"""
+def calculate_stats(city_rows):
+    """Calcule les statistiques à partir des agrégats par ville (lignes CityStats)"""
     stats = {
-        'nb_territoires': len(territories),
+        'nb_territoires': 0,
         'nb_maisons': 0,
         'nb_appartements': 0,
         'nb_sonnettes': 0,
         'cities': {}
     }
 
-    for territory in territories:
-        city = territory.city or 'Unknown'
-        
-        # Initialize city stats if not exists
-        if city not in stats['cities']:
-            stats['cities'][city] = {
-                'nb_territoires': 0,
-                'nb_maisons': 0,
-                'nb_appartements': 0,
-                'nb_sonnettes': 0
-            }
-        
-        # Increment territory count for the city
-        stats['cities'][city]['nb_territoires'] += 1
-        
-        # Get building counts if they exist
-        buildings = getattr(territory, 'buildings', 0) or 0
-        apartments = getattr(territory, 'apartments', 0) or 0
-        
-        # Calculate total doorbells (sonnettes)
-        sonnettes = buildings + apartments
-        
-        # Update city stats
-        stats['cities'][city]['nb_maisons'] += buildings
-        stats['cities'][city]['nb_appartements'] += apartments
-        stats['cities'][city]['nb_sonnettes'] += sonnettes
-        
-        # Update global stats
-        stats['nb_maisons'] += buildings
-        stats['nb_appartements'] += apartments
-        stats['nb_sonnettes'] += sonnettes
+    for row in city_rows:
+        city = row.city or 'Unknown'
+
+        city_stats = stats['cities'].setdefault(city, {
+            'nb_territoires': 0,
+            'nb_maisons': 0,
+            'nb_appartements': 0,
+            'nb_sonnettes': 0
+        })
+        city_stats['nb_territoires'] += row.territories
+        city_stats['nb_maisons'] += row.buildings
+        city_stats['nb_appartements'] += row.apartments
+        city_stats['nb_sonnettes'] += row.sonnettes
+
+        stats['nb_territoires'] += row.territories
+        stats['nb_maisons'] += row.buildings
+        stats['nb_appartements'] += row.apartments
+        stats['nb_sonnettes'] += row.sonnettes
 
     return stats
 
@@ -816,22 +1609,17 @@ def calculate_stats(territories):
 def statistics():
     """Affiche les statistiques globales et par ville"""
     try:
-        # Récupérer tous les territoires de l'utilisateur connecté
-        all_territories = Territory.query.filter_by(user_id=current_user.id).all()
-        
-        # Calculer les statistiques globales
-        global_stats = calculate_stats(all_territories)
-        
-        # Statistiques par ville
-        city_stats = {}
-        cities = db.session.query(Territory.city).filter_by(user_id=current_user.id).distinct().order_by(Territory.city).all()
-        
-        for city_tuple in cities:
-            city = city_tuple[0]
-            if city:  # Ignorer les villes None ou vides
-                territories = Territory.query.filter_by(user_id=current_user.id, city=city).all()
-                city_stats[city] = calculate_stats(territories)['cities'][city]
-        
+        # Une seule lecture indexée des agrégats maintenus par rollups.py
+        city_rows = CityStats.query.filter_by(user_id=current_user.id).order_by(CityStats.city).all()
+
+        global_stats = calculate_stats(city_rows)
+
+        # Statistiques par ville (les territoires sans ville ne sont comptés que globalement)
+        city_stats = {
+            city: values for city, values in global_stats['cities'].items()
+            if city != 'Unknown'
+        }
+
         return render_template(
             'statistics.html',
             global_stats=global_stats,
@@ -843,13 +1631,95 @@ def statistics():
         flash("Une erreur est survenue lors du calcul des statistiques.", "error")
         return redirect(url_for('index'))
 
+# Champs disponibles pour la projection de /list_territories (mêmes clés que Territory.to_dict)
+TERRITORY_FIELDS = {
+    'id': Territory.id,
+    'uuid': Territory.uuid,
+    'name': Territory.name,
+    'type': Territory.type,
+    'number': Territory.number,
+    'city': Territory.city,
+    'coordinates': Territory.geometry,
+    'buildings': Territory.buildings,
+    'apartments': Territory.apartments,
+    'sonnettes': Territory.sonnettes,
+    'area_m2': Territory.area_m2,
+    'vertex_count': Territory.vertex_count,
+    'commentaire': Territory.commentaire,
+    'created_at': Territory.created_at,
+    'updated_at': Territory.updated_at,
+}
+
+def encode_cursor(created_at, territory_id):
+    raw = json.dumps([created_at.isoformat(), territory_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Décode un curseur de pagination ; lève ValueError s'il est invalide"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, territory_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(territory_id)
+    except Exception:
+        raise ValueError(f"Curseur invalide : {cursor}")
+
 @app.route('/list_territories')
 @login_required
 def list_territories():
-    territories = Territory.query.filter_by(user=current_user).order_by(Territory.created_at.desc()).all()
-    return jsonify({
-        'territories': [t.to_dict() for t in territories]
-    })
+    """Liste paginée des territoires (du plus récent au plus ancien)
+
+    Paramètres : `limit` (taille de page), `cursor` (valeur `next_cursor` de la page
+    précédente), `fields` (liste de champs séparés par des virgules, par exemple
+    `fields=uuid,name,city` pour omettre la géométrie) et `zoom` (niveau de zoom de
+    la carte, pour recevoir des contours simplifiés). La réponse est écrite en flux.
+    """
+    fields = request.args.get('fields')
+    # Contours au niveau de détail adapté au zoom demandé (pleine résolution par défaut)
+    level = geometry_codec.level_for_zoom(request.args.get('zoom', type=int))
+    fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else list(TERRITORY_FIELDS)
+    unknown = [f for f in fields if f not in TERRITORY_FIELDS]
+    if unknown:
+        return jsonify({'error': f"Champs inconnus : {', '.join(unknown)}"}), 400
+
+    try:
+        limit = int(request.args.get('limit', app.config['LIST_TERRITORIES_PAGE_SIZE']))
+    except ValueError:
+        return jsonify({'error': 'Paramètre limit invalide'}), 400
+    limit = max(1, min(limit, app.config['LIST_TERRITORIES_MAX_PAGE_SIZE']))
+
+    # Pagination par clé (created_at, id) : coût constant quelle que soit la page, via l'index dédié
+    query = db.session.query(
+        Territory.created_at, Territory.id,
+        *[Territory.geometry_column(level) if f == 'coordinates' else TERRITORY_FIELDS[f] for f in fields]
+    ).filter(Territory.user_id == current_user.id)
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        query = query.filter(db.tuple_(Territory.created_at, Territory.id) < after)
+    # Une ligne de plus que la page pour savoir s'il existe une page suivante
+    rows = query.order_by(Territory.created_at.desc(), Territory.id.desc()).limit(limit + 1)
+
+    def serialize(field, value):
+        if field == 'coordinates':
+            return geometry_codec.decode(value)
+        return value.isoformat() if isinstance(value, datetime) else value
+
+    def generate():
+        yield '{"territories": ['
+        last = None
+        for i, row in enumerate(rows.execution_options(yield_per=200)):
+            if i == limit:
+                yield f'], "next_cursor": {json.dumps(encode_cursor(*last))}}}'
+                return
+            item = {f: serialize(f, value) for f, value in zip(fields, row[2:])}
+            yield (', ' if i else '') + json.dumps(item)
+            last = (row[0], row[1])
+        yield '], "next_cursor": null}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 @app.route('/cities')
 @login_required
@@ -866,9 +1736,7 @@ def index():
         'lng': 3.0726    # Longitude de La Madeleine
     }
     
-    territories = Territory.query.filter_by(user=current_user).order_by(Territory.created_at.desc()).all()
     return render_template('index.html', 
-                         territories=territories,
                          default_center=default_center,
                          google_maps_api_key=os.getenv('GOOGLE_MAPS_API_KEY'))
 
@@ -939,35 +1807,70 @@ def recalculate_territory(uuid):
         flash(f'Une erreur est survenue : {str(e)}', 'danger')
         return redirect(url_for('view_territory', uuid=uuid))
 
+@jobs.handler('recalculate_all')
+def recalculate_all_chunk(job):
+    """Recalcule un lot de territoires de l'utilisateur (reprise après le dernier identifiant traité)"""
+    territories = Territory.query.options(db.undefer(Territory.geometry)).filter(
+        Territory.user_id == job.user_id,
+        Territory.id > (job.cursor or 0)
+    ).order_by(Territory.id).limit(app.config['JOBS_CHUNK_SIZE']).all()
+    
+    if not territories:
+        return True
+    
+    for territory in territories:
+        job.processed += 1
+        if not recalculate_territory_stats(territory):
+            job.failed += 1
+    
+    job.cursor = territories[-1].id
+    app.logger.info(f"Tâche {job.id} : {job.processed}/{job.total} territoires recalculés")
+    return False
+
+def wants_json():
+    """Indique si le client attend une réponse JSON (appel fetch) plutôt qu'une page"""
+    return request.accept_mimetypes.best == 'application/json'
+
 @app.route('/territories/recalculate_all', methods=['POST'])
 @login_required
 def recalculate_all_territories():
-    """Recalcule les statistiques pour tous les territoires de l'utilisateur"""
+    """Lance le recalcul des statistiques de tous les territoires de l'utilisateur en tâche de fond"""
     try:
-        territories = Territory.query.filter_by(user_id=current_user.id).all()
-        success_count = 0
-        error_count = 0
+        job = jobs.find_active('recalculate_all', current_user.id)
+        if job is None:
+            total = Territory.query.filter_by(user_id=current_user.id).count()
+            job = jobs.enqueue('recalculate_all', current_user.id, total=total)
+            app.logger.info(f"Tâche de recalcul {job.id} créée pour {total} territoires")
         
-        for territory in territories:
-            if recalculate_territory_stats(territory):
-                success_count += 1
-            else:
-                error_count += 1
+        if wants_json():
+            return jsonify({'job': job.to_dict(), 'status_url': url_for('job_status', job_id=job.id)}), 202
         
-        if success_count > 0:
-            db.session.commit()
-            
-        if error_count == 0:
-            flash(f'Statistiques recalculées avec succès pour {success_count} territoires.', 'success')
-        else:
-            flash(f'Statistiques recalculées pour {success_count} territoires. Erreurs sur {error_count} territoires.', 'warning')
-            
-        return redirect(url_for('list_territories'))
+        flash(f'Recalcul des statistiques lancé pour {job.total} territoires.', 'success')
+        return redirect(url_for('index'))
         
     except Exception as e:
         db.session.rollback()
+        if wants_json():
+            return jsonify({'error': str(e)}), 500
         flash(f'Une erreur est survenue : {str(e)}', 'danger')
-        return redirect(url_for('list_territories'))
+        return redirect(url_for('index'))
+
+def job_progress(job):
+    """État d'une tâche, avec le détail lus/créés/échecs pour les imports KML et le lien des PDF de cartes"""
+    data = job.to_dict()
+    if job.kind == 'import_kml':
+        data['parsed'] = job.total
+        data['created'] = job.processed - job.failed
+    elif job.kind == 'city_cards_pdf' and job.status == 'done':
+        data['download_url'] = url_for('download_city_cards_pdf', job_id=job.id)
+    return data
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    """Progression et temps restant estimé d'une tâche de fond"""
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    return jsonify({'job': job_progress(job)})
 
 def get_streets_in_territory(coordinates):
     """Récupère les noms des rues dans un territoire"""
@@ -975,79 +1878,37 @@ def get_streets_in_territory(coordinates):
         app.logger.info("Début de la récupération des rues")
         app.logger.info(f"Coordonnées reçues : {coordinates}")
         
-        # Préparer les coordonnées pour la requête Overpass
-        polygon_coords = []
-        for coord in coordinates:
-            if isinstance(coord, dict):
-                polygon_coords.append(f"{coord['lat']} {coord['lng']}")
-            else:
-                polygon_coords.append(f"{coord[1]} {coord[0]}")
-        
-        # Créer une requête Overpass qui utilise le polygone exact
-        polygon_str = " ".join(polygon_coords)
-        query = f"""
-        [out:json][timeout:60];
-        (
-          way(poly:"{polygon_str}")[highway][name];
-        );
-        out body;
-        >;
-        out skel qt;
-        """
-        
-        app.logger.info(f"Requête Overpass : {query}")
-
-        # Faire la requête à l'API Overpass
-        response = requests.post("https://overpass-api.de/api/interpreter", 
-                               data=query, 
-                               timeout=30,
-                               headers={'User-Agent': 'Territory-Divider/1.0'})
-        
-        app.logger.info(f"Statut de la réponse : {response.status_code}")
-        app.logger.info(f"Contenu de la réponse : {response.text[:500]}")
-
-        if response.status_code != 200:
-            app.logger.error(f"Erreur Overpass : {response.text}")
-            return []
-        
-        try:
-            data = response.json()
-        except Exception as e:
-            app.logger.error(f"Erreur lors du parsing JSON : {str(e)}")
-            app.logger.error(f"Réponse reçue : {response.text[:500]}")
+        data = fetch_osm_data('streets', coordinates)
+        if data is None:
             return []
 
         # Extraire les informations des rues
-        streets_info = {}
-        nodes = {node['id']: (node['lat'], node['lon']) for node in data.get('elements', []) if node['type'] == 'node'}
+        elements = data.get('elements', [])
+        ways = [
+            element for element in elements
+            if element.get('type') == 'way' and element.get('tags', {}).get('name')
+            and len(element.get('nodes', [])) >= 2
+        ]
         
-        for element in data.get('elements', []):
-            if element.get('type') == 'way' and element.get('tags', {}).get('name'):
-                name = element['tags']['name']
-                nodes_list = element.get('nodes', [])
-                
-                if len(nodes_list) >= 2:
-                    # Calculer le côté de la rue par rapport au polygone
-                    start_node = nodes[nodes_list[0]]
-                    end_node = nodes[nodes_list[-1]]
-                    
-                    # Vérifier si les points sont à gauche ou à droite du polygone
-                    is_left_side = True
-                    for node_id in nodes_list:
-                        node = nodes[node_id]
-                        point = (node[1], node[0])  # (lon, lat)
-                        if point_in_polygon(point, coordinates):
-                            is_left_side = False
-                            break
-                    
-                    # Déterminer côté pair/impair
-                    side = "côté pair" if is_left_side else "côté impair"
-                    
-                    if name in streets_info:
-                        if side not in streets_info[name]:
-                            streets_info[name].append(side)
-                    else:
-                        streets_info[name] = [side]
+        # Tester tous les nœuds des voies en une seule passe contre le polygone préparé
+        ways_inside = ways_intersecting_polygon(
+            [way['nodes'] for way in ways],
+            [element for element in elements if element.get('type') == 'node'],
+            coordinates
+        )
+        
+        streets_info = {}
+        for way, is_inside in zip(ways, ways_inside):
+            name = way['tags']['name']
+            
+            # Une voie dont aucun nœud n'est dans le polygone le borde : côté pair
+            side = "côté impair" if is_inside else "côté pair"
+            
+            if name in streets_info:
+                if side not in streets_info[name]:
+                    streets_info[name].append(side)
+            else:
+                streets_info[name] = [side]
 
         # Formater les résultats
         formatted_streets = []
@@ -1063,6 +1924,38 @@ def get_streets_in_territory(coordinates):
         app.logger.exception(e)
         return []
 
+def ways_intersecting_polygon(ways_nodes, nodes, coordinates):
+    """Indique, pour chaque voie (liste d'identifiants de nœuds), si l'un de ses nœuds est dans le polygone
+
+    Les coordonnées de tous les nœuds sont rassemblées dans des tableaux NumPy et
+    testées en un seul appel vectorisé (shapely.contains_xy) contre le polygone
+    préparé ; le résultat est ensuite réduit par voie avec np.logical_or.reduceat.
+    Les nœuds absents de la réponse sont ignorés.
+    """
+    if not ways_nodes:
+        return []
+    
+    shape = to_shape(coordinates)
+    if shape is None:
+        return [False] * len(ways_nodes)
+    shapely.prepare(shape)
+    
+    node_index = {node['id']: i for i, node in enumerate(nodes)}
+    lons = np.fromiter((node['lon'] for node in nodes), dtype=float, count=len(nodes))
+    lats = np.fromiter((node['lat'] for node in nodes), dtype=float, count=len(nodes))
+    nodes_inside = shapely.contains_xy(shape, lons, lats)
+    
+    # Indices concaténés des nœuds de toutes les voies (un nœud fictif « dehors » pour les voies vides)
+    nodes_inside = np.append(nodes_inside, False)
+    outside = len(nodes_inside) - 1
+    flat, offsets = [], []
+    for way_nodes in ways_nodes:
+        offsets.append(len(flat))
+        indices = [node_index[n] for n in way_nodes if n in node_index]
+        flat.extend(indices or [outside])
+    
+    return np.logical_or.reduceat(nodes_inside[np.asarray(flat)], np.asarray(offsets)).tolist()
+
 def point_in_polygon(point, polygon):
     """Vérifie si un point est à l'intérieur d'un polygone"""
     x, y = point
@@ -1109,9 +2002,150 @@ def get_territory_streets(uuid):
         app.logger.exception(e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/cache/stats')
+@login_required
+def cache_stats():
+    """Compteurs de succès/échecs des caches partagés (géocodage, Overpass)"""
+    try:
+        return jsonify(cache.get_stats())
+    except Exception as e:
+        app.logger.error(f"Erreur lors de la lecture des statistiques de cache : {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def territory_qr_url(territory):
+    """URL du QR code (lien Google Maps) du territoire, généré une seule fois par lien"""
+    if app.config['QR_STORAGE'] == 'memory':
+        # La version (empreinte du lien encodé) change avec la géométrie : l'URL peut être mise en cache longtemps
+        data = generate_google_maps_url(territory)
+        return url_for('territory_qr', uuid=territory.uuid, fmt='png', v=qr_cache.qr_etag(data, 'png', 10)[:16])
+    filename = qr_cache.ensure_qr(app.config['QR_FOLDER'], generate_google_maps_url(territory))
+    return url_for('serve_qr', filename=filename)
+
+# Rendus récents gardés en mémoire, indexés par (lien encodé, format, taille)
+render_qr_cached = functools.lru_cache(maxsize=app.config['QR_MEMORY_CACHE_SIZE'])(qr_cache.render_qr)
+
+@app.route('/territory/<uuid>/qr.<fmt>')
+@login_required
+def territory_qr(uuid, fmt):
+    """QR code du territoire rendu en mémoire (PNG ou SVG), sans écriture sur disque
+
+    Paramètres : `size` (taille d'un module en pixels, de 1 à 40, 10 par défaut) et
+    `v` (version fournie par territory_qr_url ; une URL versionnée est immuable).
+    """
+    if fmt not in qr_cache.MIMETYPES:
+        return jsonify({'error': f"Format non supporté : {fmt}"}), 404
+    box_size = max(1, min(request.args.get('size', 10, type=int), 40))
+
+    territory = Territory.query.options(
+        db.load_only(Territory.uuid, Territory.user_id, Territory.centroid_lat, Territory.centroid_lon)
+    ).filter_by(uuid=uuid, user_id=current_user.id).first_or_404()
+    data = generate_google_maps_url(territory)
+
+    # Le validateur se calcule sans rendu : un 304 ne coûte que la lecture du centre
+    etag = qr_cache.qr_etag(data, fmt, box_size)
+    if not_modified(etag):
+        response = Response(status=304)
+    else:
+        response = Response(render_qr_cached(data, fmt, box_size), mimetype=qr_cache.MIMETYPES[fmt])
+    response.set_etag(etag)
+    response.cache_control.private = True
+    if request.args.get('v') == etag[:16]:
+        response.cache_control.max_age = app.config['QR_MAX_AGE']
+        response.cache_control.immutable = True
+    else:
+        # URL non versionnée : le territoire peut être redessiné, revalider à chaque fois
+        response.cache_control.no_cache = True
+    return response
+
+@app.context_processor
+def qr_code_helpers():
+    return {'territory_qr_url': territory_qr_url}
+
+def territory_thumbnail_url(territory, level=None, width=160, height=120, fmt='svg'):
+    """URL versionnée de la vignette du territoire
+
+    La version est l'empreinte de la géométrie au niveau de détail demandé :
+    charger cette colonne avec les territoires (db.undefer) évite une requête par vignette.
+    """
+    level = app.config['THUMBNAIL_LEVEL'] if level is None else level
+    wkb = getattr(territory, Territory.geometry_column(level).key)
+    etag = thumbnails.thumbnail_etag(wkb, fmt, width, height)
+    return url_for('territory_thumbnail', uuid=territory.uuid, fmt=fmt, level=level,
+                   w=width, h=height, v=etag[:16])
+
+# Rendus récents gardés en mémoire, indexés par (géométrie WKB, format, largeur, hauteur)
+render_thumbnail_cached = functools.lru_cache(maxsize=app.config['THUMBNAIL_CACHE_SIZE'])(thumbnails.render)
+
+@app.route('/territory/<uuid>/thumbnail.<fmt>')
+@login_required
+def territory_thumbnail(uuid, fmt):
+    """Vignette du contour du territoire (SVG ou PNG), sans fond de carte
+
+    Paramètres : `level` (niveau de détail, 0 à 3), `w` et `h` (taille en pixels,
+    de 16 à 800) et `v` (version fournie par territory_thumbnail_url ; une URL
+    versionnée est immuable).
+    """
+    if fmt not in thumbnails.MIMETYPES:
+        return jsonify({'error': f"Format non supporté : {fmt}"}), 404
+    level = max(0, min(request.args.get('level', app.config['THUMBNAIL_LEVEL'], type=int), 3))
+    width = max(16, min(request.args.get('w', 160, type=int), 800))
+    height = max(16, min(request.args.get('h', 120, type=int), 800))
+
+    column = Territory.geometry_column(level)
+    wkb = db.session.query(column).filter(
+        Territory.uuid == uuid, Territory.user_id == current_user.id
+    ).first_or_404()[0]
+
+    etag = thumbnails.thumbnail_etag(wkb, fmt, width, height)
+    if not_modified(etag):
+        response = Response(status=304)
+    else:
+        response = Response(render_thumbnail_cached(wkb, fmt, width, height), mimetype=thumbnails.MIMETYPES[fmt])
+    response.set_etag(etag)
+    response.cache_control.private = True
+    if request.args.get('v') == etag[:16]:
+        response.cache_control.max_age = app.config['THUMBNAIL_MAX_AGE']
+        response.cache_control.immutable = True
+    else:
+        # URL non versionnée : le territoire peut être redessiné, revalider à chaque fois
+        response.cache_control.no_cache = True
+    return response
+
+@app.context_processor
+def thumbnail_helpers():
+    return {'territory_thumbnail_url': territory_thumbnail_url}
+
 @app.route('/static/qrcodes/<path:filename>')
 def serve_qr(filename):
-    return send_from_directory(app.config['QR_FOLDER'], filename)
+    # Le nom du fichier est l'empreinte de son contenu : il peut être mis en cache indéfiniment
+    response = send_from_directory(app.config['QR_FOLDER'], filename, max_age=app.config['QR_MAX_AGE'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def schedule_qr_cleanup(user_id):
+    """Programme la suppression des QR codes orphelins (une seule tâche en attente par utilisateur)"""
+    try:
+        if jobs.find_active('qr_cleanup', user_id) is None:
+            jobs.enqueue('qr_cleanup', user_id)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Erreur lors de la programmation du nettoyage des QR codes: {str(e)}")
+
+@jobs.handler('qr_cleanup')
+def qr_cleanup_job(job):
+    """Supprime les QR codes qui ne correspondent plus au lien d'aucun territoire"""
+    # Seul le centre précalculé est lu : ni la géométrie ni les autres colonnes ne sont chargées
+    territories = Territory.query.options(
+        db.load_only(Territory.centroid_lat, Territory.centroid_lon)
+    ).yield_per(1000)
+    referenced = {qr_cache.qr_filename(generate_google_maps_url(t)) for t in territories}
+    removed = qr_cache.remove_unreferenced(
+        app.config['QR_FOLDER'], referenced, app.config['QR_CLEANUP_GRACE_PERIOD']
+    )
+    job.processed = removed
+    app.logger.info(f"Tâche {job.id} : {removed} QR codes orphelins supprimés")
+    return True
 
 @app.route('/territories/<uuid>/print_card')
 @login_required
@@ -1119,32 +2153,12 @@ def print_territory_card(uuid):
     territory = Territory.query.filter_by(uuid=uuid, user=current_user).first_or_404()
     
     # Récupérer le QR code
-    qr_code_url = url_for('serve_qr', filename=f"{territory.uuid}.png")
+    qr_code_url = territory_qr_url(territory)
     
-    # Traitement des coordonnées
-    try:
-        # Si les coordonnées sont une chaîne JSON, les parser
-        if isinstance(territory.coordinates, str):
-            coordinates = json.loads(territory.coordinates)
-        else:
-            coordinates = territory.coordinates
-
-        # S'assurer que les coordonnées sont dans le bon format (lat, lng)
-        formatted_coordinates = []
-        for coord in coordinates:
-            if len(coord) == 2:
-                # Inverser lat et lng si nécessaire
-                formatted_coordinates.append([float(coord[0]), float(coord[1])])
-        
-        app.logger.info(f"Formatted coordinates for territory {territory.name}: {formatted_coordinates}")
-        
-        if not formatted_coordinates:
-            app.logger.error(f"No valid coordinates found for territory {territory.name}")
-            formatted_coordinates = []
-            
-    except Exception as e:
-        app.logger.error(f"Error processing coordinates for territory {territory.name}: {str(e)}")
-        formatted_coordinates = []
+    # Coordonnées [lng, lat] décodées depuis la géométrie binaire
+    formatted_coordinates = territory.coordinates
+    if not formatted_coordinates:
+        app.logger.error(f"No valid coordinates found for territory {territory.name}")
     
     return render_template('print_territory_card.html',
                          territory=territory,
@@ -1152,6 +2166,55 @@ def print_territory_card(uuid):
                          qr_code_url=qr_code_url,
                          google_maps_api_key=os.getenv('GOOGLE_MAPS_API_KEY'))
 
+@app.cli.command('osm-import')
+@click.argument('path')
+@click.option('--name', default=None, help="Nom de l'extrait (par défaut le nom du fichier)")
+@click.option('--boundary', 'boundary_path', default=None,
+              help="Contour de la zone extraite : fichier .poly (Geofabrik) ou GeoJSON")
+@click.option('--bbox', default=None, help="Zone extraite : ouest,sud,est,nord (en degrés)")
+def osm_import_command(path, name, boundary_path, bbox):
+    """Importe un extrait OSM (Overpass JSON, .osm ou .pbf) dans le snapshot local
+
+    La zone couverte est le contour --boundary, la --bbox, ou à défaut l'emprise
+    déclarée dans l'en-tête du .osm / .pbf.
+    """
+    boundary = None
+    if boundary_path:
+        boundary = osm_snapshot.read_boundary(boundary_path)
+    elif bbox:
+        try:
+            west, south, east, north = (float(v) for v in bbox.split(','))
+        except ValueError:
+            raise click.BadParameter("format attendu : ouest,sud,est,nord", param_hint='--bbox')
+        boundary = box(west, south, east, north)
+    try:
+        extract = osm_snapshot.import_extract(path, name, boundary)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"Extrait {extract.name} importé : {extract.buildings} bâtiments, {extract.streets} rues")
+
+@app.cli.command('evict-caches')
+def evict_caches_command():
+    """Applique l'éviction des caches partagés (à planifier, par exemple toutes les heures)"""
+    cache.evict_geocode_cache()
+    cache.evict_overpass_cache()
+    cache.flush_counters()
+    print("Caches purgés")
+
+@app.cli.command('jobs-worker')
+@click.option('--once', is_flag=True, help="Traiter les tâches en attente puis s'arrêter")
+def jobs_worker_command(once):
+    """Lance le worker local des tâches de fond"""
+    jobs.run_worker(app, once=once)
+
+@app.cli.command('rebuild-city-stats')
+@click.option('--user-id', type=int, default=None, help="Ne reconstruire que les agrégats de cet utilisateur")
+def rebuild_city_stats_command(user_id):
+    """Reconstruit la table des agrégats par ville à partir des territoires"""
+    rollups.rebuild_city_stats(db.session, user_id)
+    db.session.commit()
+    print("Agrégats par ville reconstruits")
+
 if __name__ == '__main__':
     import logging
     # Configuration du logging
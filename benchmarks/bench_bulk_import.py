@@ -0,0 +1,99 @@
+"""Benchmark de la génération de territoires : débit de l'INSERT groupé par lots
+
+Compare, sur une base vide à chaque fois :
+  - bulk : generate_territories (INSERT groupés par lots de BULK_INSERT_CHUNK_SIZE,
+           une validation par lot)
+  - orm  : un objet Territory par placemark, session.add puis une seule validation
+           (approche précédente)
+
+Les placemarks sont déjà enrichis (ville, sonnettes) : aucun appel réseau. Le
+calcul des colonnes de géométrie (WKB, niveaux de détail, mesures), commun aux
+deux variantes, est chronométré à part.
+La base est un fichier SQLite temporaire, ou DATABASE_URL si elle est définie.
+
+Usage : python benchmarks/bench_bulk_import.py [nb_territoires] [sommets_par_polygone]
+"""
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(TMP, 'bench.db')}")
+sys.path.insert(0, ROOT)
+
+import logging
+from app import app, generate_territories
+from models import db, User, Territory
+
+
+def make_placemarks(count, vertices):
+    rng = random.Random(1)
+    cities = [f'Ville {i}' for i in range(20)]
+    placemarks = []
+    for i in range(count):
+        lon, lat = 3.0 + rng.random(), 50.5 + rng.random()
+        # Contour simple (étoilé autour du centre), comme un territoire dessiné à la main
+        ring = [
+            [lon + r * math.cos(a), lat + r * math.sin(a)]
+            for a, r in sorted((rng.uniform(0, 2 * math.pi), rng.uniform(0.002, 0.005)) for _ in range(vertices))
+        ]
+        ring.append(ring[0])
+        placemarks.append({
+            'name': f'T{i}', 'type': 'standard', 'number': str(i + 1),
+            'coordinates': ring, 'city': rng.choice(cities), 'sonnettes': rng.randint(0, 80)
+        })
+    return placemarks
+
+
+def reset():
+    db.drop_all()
+    db.create_all()
+    user = User(email='bench@example.com', name='bench')
+    user.set_password('bench')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def run_bulk(placemarks, user_id):
+    success, message, failed = generate_territories(placemarks, user_id)
+    assert success and not failed, message
+
+
+def run_orm(placemarks, user_id):
+    for data in placemarks:
+        db.session.add(Territory(
+            uuid=str(uuid.uuid4()), name=data['name'], type=data['type'], number=data['number'],
+            city=data['city'], coordinates=data['coordinates'], sonnettes=data['sonnettes'], user_id=user_id
+        ))
+    db.session.commit()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    vertices = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    app.logger.setLevel(logging.ERROR)
+
+    with app.app_context():
+        print(f"{count} territoires de {vertices} sommets, base {db.engine.url.drivername}")
+        placemarks = make_placemarks(count, vertices)
+        start = time.perf_counter()
+        for data in placemarks:
+            Territory.geometry_values(data['coordinates'])
+        geometry_time = time.perf_counter() - start
+        print(f"géométrie seule : {geometry_time:6.2f} s")
+
+        for variant, run in (('bulk', run_bulk), ('orm', run_orm)):
+            placemarks = make_placemarks(count, vertices)
+            user_id = reset()
+            start = time.perf_counter()
+            run(placemarks, user_id)
+            elapsed = time.perf_counter() - start
+            inserted = Territory.query.count()
+            print(f"{variant:4s} : {elapsed:6.2f} s, {inserted / elapsed:8.0f} territoires/s ({inserted} insérés), "
+                  f"hors géométrie {inserted / (elapsed - geometry_time):8.0f} territoires/s")
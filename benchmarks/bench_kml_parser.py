@@ -0,0 +1,102 @@
+"""Benchmark du parser KML en flux : pic de mémoire (RSS) et temps par placemark
+
+Génère un export synthétique de type Google My Maps (styles + placemarks) puis
+mesure, dans un sous-processus isolé pour chaque variante :
+  - staged : stage_kml_job (import asynchrone : placemarks écrits par lots en
+             base au fil de la lecture, rien n'est accumulé)
+  - stream : parse_kml (iterparse, éléments détachés au fur et à mesure)
+  - tree   : lecture complète en mémoire puis ElementTree (approche précédente),
+             avec la même extraction des placemarks
+
+Usage : python benchmarks/bench_kml_parser.py [nb_placemarks] [sommets_par_polygone]
+"""
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_kml(path, placemarks, vertices):
+    rng = random.Random(1)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<kml xmlns="http://www.opengis.net/kml/2.2"><Document><name>Export</name>\n')
+        for i in range(placemarks):
+            f.write(f'<Style id="poly-{i}"><LineStyle><color>ff0000ff</color><width>2</width></LineStyle>'
+                    f'<PolyStyle><color>4d0000ff</color></PolyStyle></Style>\n')
+        f.write('<Folder><name>Territoires</name>\n')
+        for i in range(placemarks):
+            lon, lat = 3.0 + rng.random(), 50.5 + rng.random()
+            coords = ' '.join(
+                f'{lon + rng.uniform(-0.005, 0.005):.7f},{lat + rng.uniform(-0.005, 0.005):.7f},0'
+                for _ in range(vertices)
+            )
+            f.write(f'<Placemark><name>T{i}</name><description>Territoire {i}</description>'
+                    f'<styleUrl>#poly-{i}</styleUrl><Polygon><outerBoundaryIs><LinearRing><tessellate>1</tessellate>'
+                    f'<coordinates>{coords}</coordinates></LinearRing></outerBoundaryIs></Polygon></Placemark>\n')
+        f.write('</Folder></Document></kml>\n')
+
+
+def measure(variant, path):
+    """Exécuté dans le sous-processus : parse le fichier et affiche temps, placemarks et pic RSS"""
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    import logging
+    from app import app, db, parse_kml, parse_placemark, stage_kml_job
+    from models import User
+    app.logger.setLevel(logging.ERROR)
+    if variant == 'staged':
+        with app.app_context():
+            db.create_all()
+            user = User(email='bench@example.com', name='bench')
+            user.set_password('bench')
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with app.app_context(), open(path, 'rb') as f:
+        if variant == 'staged':
+            count = stage_kml_job(f, user_id).total
+        elif variant == 'stream':
+            success, territories = parse_kml(f, enrich=False)
+            count = len(territories)
+        else:
+            import xml.etree.ElementTree as ET
+            content = f.read().decode('utf-8-sig')
+            root = ET.fromstring(content)
+            territories = [parse_placemark(p) for p in root.iter('{http://www.opengis.net/kml/2.2}Placemark')]
+            count = len(territories)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{elapsed} {count} {(peak - baseline) / 1024}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--measure':
+        measure(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    placemarks = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    vertices = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'export.kml')
+        write_kml(path, placemarks, vertices)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        print(f"Fichier de {size_mb:.1f} Mo, {placemarks} placemarks de {vertices} sommets")
+
+        for variant in ('staged', 'stream', 'tree'):
+            output = subprocess.run(
+                [sys.executable, __file__, '--measure', variant, path],
+                capture_output=True, text=True, check=True
+            ).stdout.split()
+            elapsed, count, peak_mb = float(output[-3]), int(output[-2]), float(output[-1])
+            print(f"{variant:6s} : {elapsed:6.2f} s, {elapsed / count * 1e6:6.1f} µs/placemark, "
+                  f"pic RSS +{peak_mb:7.1f} Mo")
@@ -0,0 +1,88 @@
+"""Benchmark du classement des rues (côté pair/impair) sur un territoire urbain dense
+
+Compare la boucle historique (point_in_polygon nœud par nœud) au test vectorisé
+(ways_intersecting_polygon) sur des données synthétiques au format Overpass.
+
+Usage : python benchmarks/bench_street_sides.py [nb_voies] [nœuds_par_voie] [sommets_polygone]
+"""
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from app import point_in_polygon, ways_intersecting_polygon  # noqa: E402
+
+
+def make_polygon(vertices, center=(3.07, 50.65), radius=0.01):
+    """Polygone étoilé irrégulier (contour de quartier) en [lng, lat]"""
+    rng = random.Random(1)
+    points = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        r = radius * (0.7 + 0.3 * rng.random())
+        points.append([center[0] + r * math.cos(angle), center[1] + r * math.sin(angle)])
+    points.append(points[0])
+    return points
+
+
+def make_elements(ways, nodes_per_way, center=(3.07, 50.65), spread=0.015):
+    rng = random.Random(2)
+    elements, ways_nodes = [], []
+    node_id = 1
+    for _ in range(ways):
+        lon = center[0] + rng.uniform(-spread, spread)
+        lat = center[1] + rng.uniform(-spread, spread)
+        refs = []
+        for _ in range(nodes_per_way):
+            lon += rng.uniform(-0.0002, 0.0002)
+            lat += rng.uniform(-0.0002, 0.0002)
+            elements.append({'type': 'node', 'id': node_id, 'lat': lat, 'lon': lon})
+            refs.append(node_id)
+            node_id += 1
+        ways_nodes.append(refs)
+    return elements, ways_nodes
+
+
+def legacy(ways_nodes, elements, coordinates):
+    nodes = {node['id']: (node['lat'], node['lon']) for node in elements}
+    result = []
+    for way_nodes in ways_nodes:
+        inside = False
+        for node_id in way_nodes:
+            lat, lon = nodes[node_id]
+            if point_in_polygon((lon, lat), coordinates):
+                inside = True
+                break
+        result.append(inside)
+    return result
+
+
+def timed(func, *args, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == '__main__':
+    ways = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    nodes_per_way = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    vertices = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    coordinates = make_polygon(vertices)
+    elements, ways_nodes = make_elements(ways, nodes_per_way)
+    print(f"{ways} voies, {len(elements)} nœuds, polygone de {vertices} sommets")
+
+    legacy_time, legacy_result = timed(legacy, ways_nodes, elements, coordinates)
+    vector_time, vector_result = timed(ways_intersecting_polygon, ways_nodes, elements, coordinates)
+
+    mismatches = sum(a != b for a, b in zip(legacy_result, vector_result))
+    print(f"boucle point_in_polygon : {legacy_time * 1000:8.1f} ms")
+    print(f"vectorisé (contains_xy) : {vector_time * 1000:8.1f} ms  (x{legacy_time / vector_time:.1f})")
+    print(f"voies classées différemment : {mismatches}")
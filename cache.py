@@ -0,0 +1,295 @@
+"""Caches persistants partagés entre les workers gunicorn (stockés en base de données)
+
+Les lectures et écritures passent par une connexion dédiée afin de ne jamais
+interférer avec la transaction de la requête en cours. Une lecture ne coûte
+qu'un SELECT : last_used_at n'est réécrit que s'il date de plus de
+CACHE_TOUCH_INTERVAL, les compteurs de succès/échecs sont tenus en mémoire et
+reportés en base par lots, et l'éviction ne passe que toutes les
+CACHE_EVICT_EVERY écritures (ou via `flask evict-caches`). L'invalidation liée à
+un territoire redessiné attend la validation de sa transaction : annulée, elle
+laisse le cache intact.
+"""
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, select, update, delete, insert, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, attributes, object_session
+import geometry_codec
+from models import db, GeocodeCache, OverpassCache, CacheCounter, Territory
+
+geocode_table = GeocodeCache.__table__
+overpass_table = OverpassCache.__table__
+counter_table = CacheCounter.__table__
+
+INVALIDATE_KEY = 'overpass_cache_invalidate'
+
+
+def geocode_cell(lat, lon, precision=None):
+    """Retourne la clé de la cellule de grille contenant le point (lat, lon)
+
+    La grille est quantifiée selon GEOCODE_CACHE_PRECISION (en degrés), de sorte
+    que les territoires voisins d'une même commune partagent la même cellule.
+    """
+    if precision is None:
+        precision = current_app.config['GEOCODE_CACHE_PRECISION']
+    return f"{math.floor(lat / precision)}:{math.floor(lon / precision)}"
+
+
+def geometry_hash(coordinates):
+    """Empreinte canonique d'un polygone (coordonnées [lng, lat] ou {'lat', 'lng'} arrondies à 1e-7)"""
+    points = [
+        (coord['lng'], coord['lat']) if isinstance(coord, dict) else (coord[0], coord[1])
+        for coord in coordinates or []
+    ]
+    canonical = json.dumps([[round(float(lon), 7), round(float(lat), 7)] for lon, lat in points])
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+# Compteurs du processus pas encore reportés en base : {nom: [succès, échecs]}
+_pending_counts = defaultdict(lambda: [0, 0])
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+# Écritures depuis la dernière éviction, par table
+_stores_since_evict = defaultdict(int)
+
+
+def _record(name, hit):
+    """Compte un succès ou un échec en mémoire ; reporte les compteurs par lots"""
+    global _last_flush
+    with _pending_lock:
+        _pending_counts[name][0 if hit else 1] += 1
+        pending = sum(hits + misses for hits, misses in _pending_counts.values())
+        due = (pending >= current_app.config['CACHE_COUNTER_FLUSH_EVERY']
+               or time.monotonic() - _last_flush >= current_app.config['CACHE_COUNTER_FLUSH_INTERVAL'])
+    if due:
+        flush_counters()
+
+
+def flush_counters():
+    """Reporte en base les compteurs accumulés par ce processus (une transaction)"""
+    global _last_flush
+    with _pending_lock:
+        counts = {name: tuple(values) for name, values in _pending_counts.items() if any(values)}
+        _pending_counts.clear()
+        _last_flush = time.monotonic()
+    if not counts:
+        return
+    try:
+        with db.engine.begin() as conn:
+            for name, (hits, misses) in counts.items():
+                result = conn.execute(
+                    update(counter_table)
+                    .where(counter_table.c.name == name)
+                    .values(hits=counter_table.c.hits + hits, misses=counter_table.c.misses + misses)
+                )
+                if result.rowcount == 0:
+                    conn.execute(insert(counter_table).values(name=name, hits=hits, misses=misses))
+    except IntegrityError:
+        # Compteur créé en parallèle par un autre worker : on perd ce lot au pire
+        pass
+    except Exception as e:
+        current_app.logger.error(f"Erreur lors de la mise à jour des compteurs de cache: {str(e)}")
+
+
+def get_stats():
+    """Retourne les compteurs de succès/échecs et la taille de chaque cache"""
+    flush_counters()
+    with db.engine.connect() as conn:
+        counters = {
+            name: {'hits': hits, 'misses': misses}
+            for name, hits, misses in conn.execute(
+                select(counter_table.c.name, counter_table.c.hits, counter_table.c.misses)
+            )
+        }
+        sizes = {
+            'geocode': conn.execute(select(func.count()).select_from(geocode_table)).scalar(),
+            'overpass': conn.execute(select(func.count()).select_from(overpass_table)).scalar(),
+        }
+    stats = {}
+    for name, size in sizes.items():
+        counter = counters.get(name, {'hits': 0, 'misses': 0})
+        total = counter['hits'] + counter['misses']
+        stats[name] = {
+            'entries': size,
+            'hits': counter['hits'],
+            'misses': counter['misses'],
+            'hit_ratio': round(counter['hits'] / total, 3) if total else None,
+        }
+    return stats
+
+
+def _evict(table, ttl, max_entries):
+    """Supprime les entrées expirées puis les moins récemment utilisées au-delà de la taille maximale"""
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(
+                delete(table).where(table.c.created_at < datetime.utcnow() - timedelta(seconds=ttl))
+            )
+            count = conn.execute(select(func.count()).select_from(table)).scalar()
+            if count > max_entries:
+                oldest = (
+                    select(table.c.id)
+                    .order_by(table.c.last_used_at)
+                    .limit(count - max_entries)
+                )
+                conn.execute(delete(table).where(table.c.id.in_(oldest)))
+    except Exception as e:
+        current_app.logger.error(f"Erreur lors de l'éviction du cache {table.name}: {str(e)}")
+
+
+def _evict_periodically(table, ttl, max_entries):
+    """Applique l'éviction toutes les CACHE_EVICT_EVERY écritures de ce processus"""
+    with _pending_lock:
+        _stores_since_evict[table.name] += 1
+        if _stores_since_evict[table.name] < current_app.config['CACHE_EVICT_EVERY']:
+            return
+        _stores_since_evict[table.name] = 0
+    _evict(table, ttl, max_entries)
+
+
+def _lookup(table, column, where, ttl):
+    now = datetime.utcnow()
+    with db.engine.connect() as conn:
+        row = conn.execute(
+            select(column, table.c.last_used_at).where(where, table.c.created_at >= now - timedelta(seconds=ttl))
+        ).first()
+    if row is None:
+        return None
+    value, last_used_at = row
+    # Ordre LRU à gros grain : une écriture au plus par intervalle et par entrée
+    touch_before = now - timedelta(seconds=current_app.config['CACHE_TOUCH_INTERVAL'])
+    if last_used_at is None or last_used_at < touch_before:
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(where).values(last_used_at=now))
+    return value
+
+
+def _store(table, where, values):
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(delete(table).where(where))
+        conn.execute(insert(table).values(created_at=now, last_used_at=now, **values))
+
+
+# --- Géocodage inverse -------------------------------------------------------
+
+def get_cached_city(lat, lon):
+    """Retourne la ville en cache pour ce point, ou None si absente ou expirée"""
+    cell = geocode_cell(lat, lon)
+    try:
+        city = _lookup(
+            geocode_table, geocode_table.c.city, geocode_table.c.cell == cell,
+            current_app.config['GEOCODE_CACHE_TTL']
+        )
+    except Exception as e:
+        current_app.logger.error(f"Erreur lors de la lecture du cache de géocodage: {str(e)}")
+        return None
+    _record('geocode', city is not None)
+    return city
+
+
+def store_city(lat, lon, city):
+    """Enregistre la ville pour la cellule contenant ce point et applique l'éviction"""
+    cell = geocode_cell(lat, lon)
+    try:
+        _store(geocode_table, geocode_table.c.cell == cell, {'cell': cell, 'city': city})
+    except IntegrityError:
+        # Un autre worker a inséré la même cellule entre-temps
+        return
+    except Exception as e:
+        current_app.logger.error(f"Erreur lors de l'écriture du cache de géocodage: {str(e)}")
+        return
+    _evict_periodically(geocode_table, current_app.config['GEOCODE_CACHE_TTL'], current_app.config['GEOCODE_CACHE_MAX_ENTRIES'])
+
+
+def evict_geocode_cache():
+    _evict(geocode_table, current_app.config['GEOCODE_CACHE_TTL'], current_app.config['GEOCODE_CACHE_MAX_ENTRIES'])
+
+
+def evict_overpass_cache():
+    _evict(overpass_table, current_app.config['OVERPASS_CACHE_TTL'], current_app.config['OVERPASS_CACHE_MAX_ENTRIES'])
+
+
+# --- Réponses Overpass -------------------------------------------------------
+
+def _overpass_key(kind, geo_hash):
+    return hashlib.sha256(f"{kind}:{geo_hash}".encode('utf-8')).hexdigest()
+
+
+def get_cached_overpass(kind, coordinates):
+    """Retourne la réponse Overpass en cache pour ce polygone et ce type de requête, ou None"""
+    key = _overpass_key(kind, geometry_hash(coordinates))
+    try:
+        payload = _lookup(
+            overpass_table, overpass_table.c.payload, overpass_table.c.key == key,
+            current_app.config['OVERPASS_CACHE_TTL']
+        )
+    except Exception as e:
+        current_app.logger.error(f"Erreur lors de la lecture du cache Overpass: {str(e)}")
+        return None
+    _record('overpass', payload is not None)
+    return json.loads(payload) if payload is not None else None
+
+
+def store_overpass(kind, coordinates, data):
+    """Enregistre une réponse Overpass et applique l'éviction"""
+    geo_hash = geometry_hash(coordinates)
+    key = _overpass_key(kind, geo_hash)
+    try:
+        _store(overpass_table, overpass_table.c.key == key, {
+            'key': key, 'kind': kind, 'geometry_hash': geo_hash, 'payload': json.dumps(data)
+        })
+    except IntegrityError:
+        return
+    except Exception as e:
+        current_app.logger.error(f"Erreur lors de l'écriture du cache Overpass: {str(e)}")
+        return
+    _evict_periodically(overpass_table, current_app.config['OVERPASS_CACHE_TTL'], current_app.config['OVERPASS_CACHE_MAX_ENTRIES'])
+
+
+def _invalidate_hashes(geo_hashes):
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(delete(overpass_table).where(overpass_table.c.geometry_hash.in_(geo_hashes)))
+    except Exception as e:
+        current_app.logger.error(f"Erreur lors de l'invalidation du cache Overpass: {str(e)}")
+
+
+def invalidate_geometry(coordinates):
+    """Supprime les réponses Overpass en cache pour cette géométrie (tous types de requête)"""
+    _invalidate_hashes([geometry_hash(coordinates)])
+
+
+@event.listens_for(Territory.geometry, 'set', active_history=True)
+def _invalidate_on_geometry_change(target, value, oldvalue, initiator):
+    """Programme l'invalidation du cache Overpass de l'ancienne géométrie lorsqu'un territoire est redessiné
+
+    L'invalidation est exécutée après la validation de la session du territoire
+    (ou immédiatement pour un territoire hors session).
+    """
+    if oldvalue in (None, attributes.NO_VALUE, attributes.NEVER_SET) or oldvalue == value:
+        return
+    geo_hash = geometry_hash(geometry_codec.decode(oldvalue))
+    session = object_session(target)
+    if session is None:
+        _invalidate_hashes([geo_hash])
+    else:
+        session.info.setdefault(INVALIDATE_KEY, set()).add(geo_hash)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_geometries(session):
+    geo_hashes = session.info.pop(INVALIDATE_KEY, None)
+    if geo_hashes:
+        _invalidate_hashes(sorted(geo_hashes))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_geometry_invalidations(session):
+    session.info.pop(INVALIDATE_KEY, None)
@@ -0,0 +1,188 @@
+"""Rendu des cartes de territoire côté serveur, assemblées en un PDF
+
+Chaque carte est composée sur le modèle scanné (carte_territoire_template.jpg)
+avec Pillow : contour du territoire, QR code, lieu, numéro, sonnettes et rues.
+Les cartes sont regroupées N par page (colonnes x lignes sur une page A4) ;
+render_page ne dépend que de ses arguments (types simples) et peut donc être
+exécutée dans un pool de processus. Les données qui demandent la base ou le
+réseau (contours, rues) sont préparées par l'appelant.
+"""
+import collections
+import io
+import math
+from PIL import Image, ImageDraw, ImageFont
+import qr_cache
+
+# Zones de la carte, en pixels du modèle (767 x 505)
+PLACE_POSITION = (78, 62)
+NUMBER_POSITION = (552, 62)
+MAP_BOX = (35, 100, 530, 390)
+QR_BOX = (575, 100, 725, 250)
+DETAILS_BOX = (545, 258, 745, 392)
+
+OUTLINE_COLOR = (200, 30, 30)
+FILL_COLOR = (250, 215, 215)
+
+# Page A4 et marges, en millimètres
+PAGE_SIZE_MM = (210, 297)
+PAGE_MARGIN_MM = 8
+MM_PER_INCH = 25.4
+
+
+def load_font(font, size):
+    """Charge une police TrueType, ou la police bitmap de Pillow si elle est introuvable"""
+    try:
+        return ImageFont.truetype(font, size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def project(outline, box, margin=10):
+    """Projette un contour [lng, lat] dans un rectangle en pixels (équirectangulaire, nord en haut)"""
+    left, top, right, bottom = box
+    lons = [p[0] for p in outline]
+    lats = [p[1] for p in outline]
+    # Les degrés de longitude raccourcissent avec la latitude
+    scale_x = math.cos(math.radians((min(lats) + max(lats)) / 2))
+    width = (max(lons) - min(lons)) * scale_x or 1e-9
+    height = (max(lats) - min(lats)) or 1e-9
+    scale = min((right - left - 2 * margin) / width, (bottom - top - 2 * margin) / height)
+    offset_x = left + (right - left - width * scale) / 2
+    offset_y = top + (bottom - top - height * scale) / 2
+    return [
+        (offset_x + (lon - min(lons)) * scale_x * scale, offset_y + (max(lats) - lat) * scale)
+        for lon, lat in outline
+    ]
+
+
+def wrap(draw, text, font, width):
+    """Découpe un texte en lignes ne dépassant pas `width` pixels"""
+    lines, line = [], ''
+    for word in text.split():
+        candidate = f"{line} {word}".strip()
+        if line and draw.textlength(candidate, font=font) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    if line:
+        lines.append(line)
+    return lines
+
+
+def render_card(template, card, font='DejaVuSans.ttf'):
+    """Compose une carte sur une copie du modèle
+
+    `card` : dict avec city, name, number, outline ([lng, lat]), qr_data,
+    sonnettes et streets (liste de chaînes).
+    """
+    image = template.copy()
+    draw = ImageDraw.Draw(image)
+    regular = load_font(font, 15)
+    small = load_font(font, 11)
+
+    place = card.get('city') or ''
+    if card.get('name'):
+        place = f"{place} - {card['name']}" if place else card['name']
+    draw.text(PLACE_POSITION, place, fill='black', font=regular)
+    draw.text(NUMBER_POSITION, card.get('number') or '', fill='black', font=regular)
+
+    outline = card.get('outline') or []
+    if len(outline) >= 3:
+        draw.polygon(project(outline, MAP_BOX), fill=FILL_COLOR, outline=OUTLINE_COLOR, width=3)
+    elif len(outline) == 2:
+        draw.line(project(outline, MAP_BOX), fill=OUTLINE_COLOR, width=3)
+
+    if card.get('qr_data'):
+        qr = Image.open(io.BytesIO(qr_cache.render_qr(card['qr_data'], 'png', 4))).convert('RGB')
+        left, top, right, bottom = QR_BOX
+        image.paste(qr.resize((right - left, bottom - top), Image.NEAREST), (left, top))
+
+    left, top, right, bottom = DETAILS_BOX
+    line_height = small.getbbox('Ag')[3] + 3
+    lines = [f"Sonnettes : {card.get('sonnettes') or 0}"]
+    for street in card.get('streets') or []:
+        lines.extend(wrap(draw, street, small, right - left))
+    max_lines = (bottom - top) // line_height
+    if len(lines) > max_lines:
+        lines = lines[:max_lines - 1] + ['…']
+    for i, line in enumerate(lines):
+        draw.text((left, top + i * line_height), line, fill='black', font=small)
+    return image
+
+
+def load_template(template_path):
+    """Charge le modèle de carte en RGB"""
+    with Image.open(template_path) as template:
+        return template.convert('RGB')
+
+
+def render_card_png(template, card, font='DejaVuSans.ttf'):
+    """Rend une carte seule et retourne les octets PNG"""
+    stream = io.BytesIO()
+    render_card(template, card, font).save(stream, 'PNG', optimize=True)
+    return stream.getvalue()
+
+
+def page_layout(columns, rows, dpi):
+    """Taille de la page et emplacement (x, y, largeur, hauteur) de chaque carte, en pixels"""
+    page = tuple(round(mm / MM_PER_INCH * dpi) for mm in PAGE_SIZE_MM)
+    margin = round(PAGE_MARGIN_MM / MM_PER_INCH * dpi)
+    cell_width = (page[0] - 2 * margin) // columns
+    cell_height = (page[1] - 2 * margin) // rows
+    slots = [
+        (margin + column * cell_width, margin + row * cell_height, cell_width, cell_height)
+        for row in range(rows) for column in range(columns)
+    ]
+    return page, slots
+
+
+def render_page(template_path, cards, columns=2, rows=4, dpi=200, font='DejaVuSans.ttf'):
+    """Rend une page A4 de cartes (au plus colonnes x lignes) et retourne l'image"""
+    template = load_template(template_path)
+    page_size, slots = page_layout(columns, rows, dpi)
+    page = Image.new('RGB', page_size, 'white')
+    for card, (x, y, width, height) in zip(cards, slots):
+        image = render_card(template, card, font)
+        # Conserver les proportions du modèle, centré dans sa case avec un petit espacement
+        scale = min((width - 8) / image.width, (height - 8) / image.height)
+        size = (round(image.width * scale), round(image.height * scale))
+        image = image.resize(size, Image.LANCZOS)
+        page.paste(image, (x + (width - size[0]) // 2, y + (height - size[1]) // 2))
+    return page
+
+
+def render_pages(render, pages, executor=None, window=1):
+    """Rend les pages dans l'ordre, avec au plus `window` pages soumises au pool à la fois
+
+    Une page A4 rendue pèse une dizaine de Mo : la page suivante n'est soumise
+    qu'une fois la plus ancienne récupérée, si bien que la mémoire reste bornée
+    à `window` pages quel que soit leur nombre. Sans `executor`, les pages
+    sont rendues une à une dans le processus courant.
+    """
+    if executor is None:
+        yield from map(render, pages)
+        return
+    pending = collections.deque()
+    for page in pages:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(render, page))
+    while pending:
+        yield pending.popleft().result()
+
+
+def write_pdf(pages, stream, dpi=200, append=False):
+    """Écrit les pages dans un PDF au fur et à mesure qu'elles arrivent
+
+    Chaque page est ajoutée au fichier (mode append de Pillow) dès qu'elle est
+    produite ; la mémoire dépend donc de l'itérable `pages` (voir render_pages).
+    `stream` doit être un fichier binaire ouvert en lecture et écriture ; avec
+    append=True, les pages s'ajoutent à un PDF existant. Retourne le nombre de
+    pages écrites.
+    """
+    count = 0
+    for page in pages:
+        page.save(stream, 'PDF', resolution=dpi, append=append or count > 0)
+        count += 1
+    return count
@@ -0,0 +1,98 @@
+"""Stockage binaire compact des géométries de territoire
+
+Le contour est conservé tel quel (ordre et fermeture des points) sous forme de
+WKB : LineString pour deux points ou plus, Point pour un seul. Les mesures
+dérivées (emprise, centroïde, surface, nombre de sommets) et les niveaux de
+détail simplifiés sont calculés à l'écriture pour ne plus avoir à relire la
+géométrie complète dans les vues.
+"""
+import math
+import shapely
+from shapely.geometry import LineString, Point, Polygon
+
+# Mètres par degré de latitude (approximation sphérique, suffisante à l'échelle d'un quartier)
+METERS_PER_DEGREE = 111320.0
+
+# Niveaux de détail 1, 2, 3 : tolérance Douglas-Peucker en degrés (~1 m, ~5 m, ~20 m) ; 0 = pleine résolution
+LOD_TOLERANCES = (0.00001, 0.00005, 0.0002)
+
+
+def normalize(coordinates):
+    """Convertit des coordonnées ([lng, lat] ou {'lat', 'lng'}) en liste de [lng, lat] flottants"""
+    return [
+        [float(coord['lng']), float(coord['lat'])] if isinstance(coord, dict) else [float(coord[0]), float(coord[1])]
+        for coord in coordinates or []
+    ]
+
+
+def encode(coordinates):
+    """Encode un contour en WKB (None si aucun point)"""
+    points = normalize(coordinates)
+    if not points:
+        return None
+    geometry = LineString(points) if len(points) >= 2 else Point(points[0])
+    return shapely.to_wkb(geometry)
+
+
+def decode(wkb):
+    """Décode un contour WKB en liste de [lng, lat]"""
+    if not wkb:
+        return []
+    geometry = shapely.from_wkb(bytes(wkb))
+    return [[x, y] for x, y in geometry.coords]
+
+
+def measures(coordinates):
+    """Mesures précalculées d'un contour : emprise, centroïde, surface et nombre de sommets"""
+    points = normalize(coordinates)
+    if not points:
+        return {
+            'min_lat': None, 'min_lon': None, 'max_lat': None, 'max_lon': None,
+            'centroid_lat': None, 'centroid_lon': None, 'area_m2': None, 'vertex_count': 0
+        }
+
+    lons = [p[0] for p in points]
+    lats = [p[1] for p in points]
+    # Moyenne des sommets pour les contours dégénérés, centroïde surfacique si le polygone est valide
+    centroid_lon, centroid_lat = sum(lons) / len(lons), sum(lats) / len(lats)
+    area_degrees = 0.0
+    if len(points) >= 3:
+        polygon = Polygon(points)
+        if polygon.is_valid:
+            if not polygon.is_empty:
+                centroid_lon, centroid_lat = polygon.centroid.x, polygon.centroid.y
+            area_degrees = polygon.area
+        else:
+            area_degrees = polygon.buffer(0).area
+
+    # Projection équirectangulaire locale : une surface en degrés² se convertit par un simple facteur d'échelle
+    scale_x = METERS_PER_DEGREE * math.cos(math.radians(centroid_lat))
+    return {
+        'min_lat': min(lats), 'min_lon': min(lons), 'max_lat': max(lats), 'max_lon': max(lons),
+        'centroid_lat': centroid_lat, 'centroid_lon': centroid_lon,
+        'area_m2': area_degrees * scale_x * METERS_PER_DEGREE,
+        'vertex_count': len(points),
+    }
+
+
+def simplified_levels(coordinates):
+    """Contours simplifiés (WKB) pour chaque niveau de détail de LOD_TOLERANCES"""
+    points = normalize(coordinates)
+    if len(points) < 3:
+        wkb = encode(points)
+        return [wkb for _ in LOD_TOLERANCES]
+    line = LineString(points)
+    # Les extrémités sont conservées par la simplification : un contour fermé le reste
+    return [shapely.to_wkb(line.simplify(tolerance, preserve_topology=True)) for tolerance in LOD_TOLERANCES]
+
+
+def level_for_zoom(zoom):
+    """Niveau de détail le moins coûteux dont l'erreur reste sous un pixel au zoom donné (échelle Google Maps)"""
+    if zoom is None:
+        return 0
+    degrees_per_pixel = 360.0 / (256 * 2 ** zoom)
+    level = 0
+    for i, tolerance in enumerate(LOD_TOLERANCES, start=1):
+        if tolerance <= degrees_per_pixel:
+            level = i
+    return level
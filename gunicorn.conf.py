@@ -1,3 +1,30 @@
+import os
+
 workers = 4
 bind = "0.0.0.0:10000"
 timeout = 120
+
+_jobs_worker = None
+
+
+def when_ready(server):
+    """Démarre le worker local des tâches de fond à côté des workers web"""
+    global _jobs_worker
+    if os.getenv('JOBS_EMBEDDED_WORKER', '1') != '1':
+        return
+
+    import multiprocessing
+
+    def run():
+        from app import app
+        import jobs
+        jobs.run_worker(app)
+
+    _jobs_worker = multiprocessing.Process(target=run, name='jobs-worker', daemon=True)
+    _jobs_worker.start()
+    server.log.info(f"Worker de tâches de fond démarré (pid {_jobs_worker.pid})")
+
+
+def on_exit(server):
+    if _jobs_worker is not None and _jobs_worker.is_alive():
+        _jobs_worker.terminate()
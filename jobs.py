@@ -0,0 +1,201 @@
+"""Moteur de tâches de fond sans broker externe
+
+Les tâches sont stockées dans la table `job` et exécutées par un processus worker
+local (`flask jobs-worker`, ou démarré par gunicorn via gunicorn.conf.py). Chaque
+gestionnaire traite un lot par appel et met à jour `job.cursor` : le lot et la
+progression sont validés ensemble, si bien qu'un worker interrompu reprend là où
+il s'était arrêté. Pendant l'exécution, un thread rafraîchit `heartbeat_at` à
+intervalle fixe, indépendamment de la durée d'un lot : une tâche n'est reprise
+par un autre worker que si le sien ne donne plus signe de vie. Une tâche restée
+au statut 'staging' au-delà de JOBS_STAGING_TIMEOUT (upload interrompu) est
+passée en échec par le worker et ses lots sont supprimés.
+"""
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from models import db, Job, ImportChunk
+
+ACTIVE_STATUSES = ('pending', 'running')
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Enregistre le gestionnaire d'un type de tâche
+
+    Le gestionnaire reçoit la tâche, traite un lot, met à jour processed/failed/cursor
+    et retourne True lorsque la tâche est terminée.
+    """
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, user_id, total=0, payload=None, status='pending'):
+    """Crée une tâche et la retourne (validée en base)
+
+    Une tâche créée au statut 'staging' n'est pas réservée par les workers tant
+    que l'appelant ne l'a pas passée à 'pending' (données encore en préparation).
+    """
+    job = Job(id=str(uuid.uuid4()), user_id=user_id, kind=kind, status=status,
+              total=total, processed=0, failed=0, payload=payload)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def find_active(kind, user_id):
+    """Retourne la tâche en cours ou en attente de ce type pour l'utilisateur, s'il y en a une"""
+    return Job.query.filter(
+        Job.kind == kind,
+        Job.user_id == user_id,
+        Job.status.in_(ACTIVE_STATUSES)
+    ).order_by(Job.created_at).first()
+
+
+def claim_next(stale_after):
+    """Réserve la prochaine tâche à exécuter : en attente, ou en cours mais abandonnée par un worker mort"""
+    stale_before = datetime.utcnow() - timedelta(seconds=stale_after)
+    job = Job.query.filter(
+        db.or_(
+            Job.status == 'pending',
+            db.and_(Job.status == 'running', Job.heartbeat_at < stale_before)
+        )
+    ).order_by(Job.created_at).with_for_update(skip_locked=True).first()
+
+    if job is None:
+        db.session.rollback()
+        return None
+
+    now = datetime.utcnow()
+    job.status = 'running'
+    job.started_at = job.started_at or now
+    job.heartbeat_at = now
+    db.session.commit()
+    return job
+
+
+def expire_staging(timeout):
+    """Passe en échec les tâches restées en préparation plus de `timeout` secondes et supprime leurs lots
+
+    Retourne le nombre de tâches expirées.
+    """
+    now = datetime.utcnow()
+    stale = db.select(Job.id).where(
+        Job.status == 'staging',
+        Job.created_at < now - timedelta(seconds=timeout)
+    )
+    job_ids = db.session.execute(stale.with_for_update(skip_locked=True)).scalars().all()
+    if not job_ids:
+        db.session.rollback()
+        return 0
+
+    ImportChunk.query.filter(ImportChunk.job_id.in_(job_ids)).delete(synchronize_session=False)
+    Job.query.filter(Job.id.in_(job_ids), Job.status == 'staging').update({
+        'status': 'failed',
+        'error': "Préparation interrompue avant la fin de l'envoi",
+        'finished_at': now
+    }, synchronize_session=False)
+    db.session.commit()
+    return len(job_ids)
+
+
+class Heartbeat(threading.Thread):
+    """Rafraîchit heartbeat_at de la tâche toutes les `interval` secondes, sur sa propre connexion"""
+
+    def __init__(self, app, job_id, interval):
+        super().__init__(name=f'heartbeat-{job_id}', daemon=True)
+        self.app = app
+        self.job_id = job_id
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        table = Job.__table__
+        with self.app.app_context():
+            while not self.stopped.wait(self.interval):
+                try:
+                    with db.engine.begin() as conn:
+                        conn.execute(
+                            table.update()
+                            .where(table.c.id == self.job_id, table.c.status == 'running')
+                            .values(heartbeat_at=datetime.utcnow())
+                        )
+                except Exception as e:
+                    self.app.logger.error(f"Erreur lors du battement de cœur de la tâche {self.job_id}: {str(e)}")
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_job(app, job):
+    """Exécute une tâche lot par lot en validant chaque lot"""
+    func = HANDLERS.get(job.kind)
+    if func is None:
+        job.status = 'failed'
+        job.error = f"Type de tâche inconnu : {job.kind}"
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return
+
+    app.logger.info(f"Exécution de la tâche {job.id} ({job.kind})")
+    heartbeat = Heartbeat(app, job.id, app.config['JOBS_HEARTBEAT_INTERVAL'])
+    heartbeat.start()
+    try:
+        while True:
+            finished = func(job)
+            job.heartbeat_at = datetime.utcnow()
+            if finished:
+                job.status = 'done'
+                job.finished_at = job.heartbeat_at
+            db.session.commit()
+            if finished:
+                break
+        app.logger.info(f"Tâche {job.id} terminée : {job.processed} traités, {job.failed} erreurs")
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Erreur lors de l'exécution de la tâche {job.id}: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        job = db.session.get(Job, job.id)
+        job.status = 'failed'
+        job.error = str(e)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+    finally:
+        heartbeat.stop()
+
+
+def run_worker(app, poll_interval=None, once=False):
+    """Boucle du worker : réserve et exécute les tâches jusqu'à l'arrêt du processus"""
+    poll_interval = poll_interval or app.config['JOBS_POLL_INTERVAL']
+    with app.app_context():
+        app.logger.info("Démarrage du worker de tâches de fond")
+        while True:
+            try:
+                job = claim_next(app.config['JOBS_STALE_AFTER'])
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Erreur lors de la réservation d'une tâche: {str(e)}")
+                job = None
+
+            if job is not None:
+                run_job(app, job)
+                db.session.remove()
+                continue
+
+            try:
+                expired = expire_staging(app.config['JOBS_STAGING_TIMEOUT'])
+                if expired:
+                    app.logger.warning(f"{expired} tâche(s) en préparation expirée(s)")
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Erreur lors de l'expiration des tâches en préparation: {str(e)}")
+
+            if once:
+                return
+            time.sleep(poll_interval)
+            db.session.remove()
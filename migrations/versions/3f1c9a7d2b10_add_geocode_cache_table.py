@@ -0,0 +1,37 @@
+"""Add geocode_cache table
+
+Revision ID: 3f1c9a7d2b10
+Revises: d6c86b69f9f9
+Create Date: 2026-10-18 09:12:41.208377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2b10'
+down_revision = 'd6c86b69f9f9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('geocode_cache',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('cell', sa.String(length=40), nullable=False),
+        sa.Column('city', sa.String(length=100), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('last_used_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('cell')
+    )
+    with op.batch_alter_table('geocode_cache', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_geocode_cache_last_used_at'), ['last_used_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('geocode_cache', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_geocode_cache_last_used_at'))
+
+    op.drop_table('geocode_cache')
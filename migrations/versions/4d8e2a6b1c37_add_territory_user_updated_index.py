@@ -0,0 +1,25 @@
+"""Add territory (user_id, updated_at) index
+
+Revision ID: 4d8e2a6b1c37
+Revises: f2b86d0c3e94
+Create Date: 2026-10-18 13:41:08.215734
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4d8e2a6b1c37'
+down_revision = 'f2b86d0c3e94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('territory', schema=None) as batch_op:
+        batch_op.create_index('ix_territory_user_updated', ['user_id', 'updated_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('territory', schema=None) as batch_op:
+        batch_op.drop_index('ix_territory_user_updated')
@@ -0,0 +1,103 @@
+"""Add per-user territory_counter and widen territory.number
+
+Revision ID: 7a1d4c9e2f60
+Revises: e5a2c8f04b19
+Create Date: 2026-10-18 15:48:03.774120
+
+"""
+import re
+import string
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a1d4c9e2f60'
+down_revision = 'e5a2c8f04b19'
+branch_labels = None
+depends_on = None
+
+NUMBER_RE = re.compile(r'\d+')
+
+
+def number_pattern(number_format):
+    """Expression régulière qui retrouve {number} dans un numéro produit par le format utilisateur"""
+    if not number_format or '{number' not in number_format:
+        return None
+    pattern = ''
+    try:
+        for literal, field, _, _ in string.Formatter().parse(number_format):
+            pattern += re.escape(literal)
+            if field is None:
+                continue
+            if field == 'number' and '(?P<number>' not in pattern:
+                pattern += r'(?P<number>\d+)'
+            elif field == 'year':
+                pattern += r'\d{4}'
+            else:
+                pattern += r'.*?'
+    except ValueError:
+        return None
+    return re.compile(pattern + '$')
+
+
+def parse_number(number, pattern):
+    """Numéro séquentiel d'un numéro formaté : selon le format utilisateur, sinon le dernier groupe de chiffres"""
+    match = pattern.match(number) if pattern else None
+    if match:
+        return int(match.group('number'))
+    groups = NUMBER_RE.findall(number)
+    return int(groups[-1]) if groups else None
+
+
+def upgrade():
+    op.create_table('territory_counter',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('next_number', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+    with op.batch_alter_table('territory', schema=None) as batch_op:
+        batch_op.alter_column('number', existing_type=sa.String(length=10), type_=sa.String(length=50))
+
+    # Initialiser chaque compteur après le plus grand numéro déjà attribué, lu selon le format
+    # de l'utilisateur ({year}-{number} ne doit pas donner l'année)
+    conn = op.get_bind()
+    start_numbers, patterns = {}, {}
+    for user_id, start_number, number_format in conn.execute(sa.text(
+        "SELECT user_id, territory_start_number, territory_number_format FROM user_settings"
+    )):
+        start_numbers[user_id] = start_number
+        patterns[user_id] = number_pattern(number_format)
+    highest = {}
+    for user_id, number in conn.execute(sa.text(
+        "SELECT user_id, number FROM territory WHERE number IS NOT NULL"
+    )):
+        value = parse_number(number, patterns.get(user_id) or number_pattern('T-{number}'))
+        if value is not None:
+            highest[user_id] = max(highest.get(user_id, 0), value)
+
+    counter = sa.table(
+        'territory_counter',
+        sa.column('user_id', sa.Integer),
+        sa.column('next_number', sa.Integer),
+        sa.column('updated_at', sa.DateTime),
+    )
+    rows = [
+        {
+            'user_id': user_id,
+            'next_number': max(number + 1, start_numbers.get(user_id) or 1),
+            'updated_at': datetime.utcnow(),
+        }
+        for user_id, number in highest.items()
+    ]
+    if rows:
+        op.bulk_insert(counter, rows)
+
+
+def downgrade():
+    with op.batch_alter_table('territory', schema=None) as batch_op:
+        batch_op.alter_column('number', existing_type=sa.String(length=50), type_=sa.String(length=10))
+    op.drop_table('territory_counter')
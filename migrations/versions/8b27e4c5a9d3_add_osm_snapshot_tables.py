@@ -0,0 +1,78 @@
+"""Add osm snapshot tables
+
+Revision ID: 8b27e4c5a9d3
+Revises: 3f1c9a7d2b10
+Create Date: 2026-10-18 10:03:17.554201
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b27e4c5a9d3'
+down_revision = '3f1c9a7d2b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('osm_extract',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=200), nullable=False),
+        sa.Column('min_lat', sa.Float(), nullable=False),
+        sa.Column('min_lon', sa.Float(), nullable=False),
+        sa.Column('max_lat', sa.Float(), nullable=False),
+        sa.Column('max_lon', sa.Float(), nullable=False),
+        sa.Column('buildings', sa.Integer(), nullable=True),
+        sa.Column('streets', sa.Integer(), nullable=True),
+        sa.Column('loaded_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.create_table('osm_building',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('extract_id', sa.Integer(), nullable=False),
+        sa.Column('osm_type', sa.String(length=10), nullable=False),
+        sa.Column('osm_id', sa.BigInteger(), nullable=False),
+        sa.Column('lat', sa.Float(), nullable=False),
+        sa.Column('lon', sa.Float(), nullable=False),
+        sa.Column('tags', sa.JSON(), nullable=True),
+        sa.ForeignKeyConstraint(['extract_id'], ['osm_extract.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('osm_building', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_osm_building_extract_id'), ['extract_id'], unique=False)
+        batch_op.create_index('ix_osm_building_lat_lon', ['lat', 'lon'], unique=False)
+
+    op.create_table('osm_street',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('extract_id', sa.Integer(), nullable=False),
+        sa.Column('osm_id', sa.BigInteger(), nullable=False),
+        sa.Column('name', sa.String(length=200), nullable=False),
+        sa.Column('highway', sa.String(length=50), nullable=True),
+        sa.Column('points', sa.JSON(), nullable=False),
+        sa.Column('min_lat', sa.Float(), nullable=False),
+        sa.Column('min_lon', sa.Float(), nullable=False),
+        sa.Column('max_lat', sa.Float(), nullable=False),
+        sa.Column('max_lon', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['extract_id'], ['osm_extract.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('osm_street', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_osm_street_extract_id'), ['extract_id'], unique=False)
+        batch_op.create_index('ix_osm_street_bbox', ['min_lat', 'max_lat', 'min_lon', 'max_lon'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('osm_street', schema=None) as batch_op:
+        batch_op.drop_index('ix_osm_street_bbox')
+        batch_op.drop_index(batch_op.f('ix_osm_street_extract_id'))
+
+    op.drop_table('osm_street')
+    with op.batch_alter_table('osm_building', schema=None) as batch_op:
+        batch_op.drop_index('ix_osm_building_lat_lon')
+        batch_op.drop_index(batch_op.f('ix_osm_building_extract_id'))
+
+    op.drop_table('osm_building')
+    op.drop_table('osm_extract')
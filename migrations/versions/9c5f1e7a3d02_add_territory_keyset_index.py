@@ -0,0 +1,25 @@
+"""Add territory (user_id, created_at, id) index for keyset pagination
+
+Revision ID: 9c5f1e7a3d02
+Revises: 4d8e2a6b1c37
+Create Date: 2026-10-18 14:02:51.630918
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9c5f1e7a3d02'
+down_revision = '4d8e2a6b1c37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('territory', schema=None) as batch_op:
+        batch_op.create_index('ix_territory_user_created_id', ['user_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('territory', schema=None) as batch_op:
+        batch_op.drop_index('ix_territory_user_created_id')
@@ -0,0 +1,38 @@
+"""Add import_staging table
+
+Revision ID: a7c3e19d4f56
+Revises: 5e9a0b3f7c21
+Create Date: 2026-10-18 12:21:40.336718
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e19d4f56'
+down_revision = '5e9a0b3f7c21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('import_staging',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('territories', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id')
+    )
+    with op.batch_alter_table('import_staging', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_import_staging_expires_at'), ['expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('import_staging', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_import_staging_expires_at'))
+
+    op.drop_table('import_staging')
@@ -0,0 +1,138 @@
+"""Store territory geometry as WKB with precomputed measures
+
+Revision ID: b3e7d5a91f24
+Revises: 9c5f1e7a3d02
+Create Date: 2026-10-18 14:37:22.091846
+
+"""
+import json
+import math
+from alembic import op
+import sqlalchemy as sa
+import shapely
+from shapely.geometry import LineString, Point, Polygon
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e7d5a91f24'
+down_revision = '9c5f1e7a3d02'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+METERS_PER_DEGREE = 111320.0
+
+territory = sa.table(
+    'territory',
+    sa.column('id', sa.Integer),
+    sa.column('coordinates', sa.JSON),
+    sa.column('geometry', sa.LargeBinary),
+    sa.column('min_lat', sa.Float),
+    sa.column('min_lon', sa.Float),
+    sa.column('max_lat', sa.Float),
+    sa.column('max_lon', sa.Float),
+    sa.column('centroid_lat', sa.Float),
+    sa.column('centroid_lon', sa.Float),
+    sa.column('area_m2', sa.Float),
+    sa.column('vertex_count', sa.Integer),
+)
+
+
+# Copie figée de geometry_codec au moment de la migration
+def _points(coordinates):
+    if isinstance(coordinates, str):
+        coordinates = json.loads(coordinates)
+    return [
+        [float(c['lng']), float(c['lat'])] if isinstance(c, dict) else [float(c[0]), float(c[1])]
+        for c in coordinates or []
+    ]
+
+
+def _convert(coordinates):
+    points = _points(coordinates)
+    if not points:
+        return {'geometry': None, 'vertex_count': 0}
+
+    lons = [p[0] for p in points]
+    lats = [p[1] for p in points]
+    centroid_lon, centroid_lat = sum(lons) / len(lons), sum(lats) / len(lats)
+    area = 0.0
+    if len(points) >= 3:
+        polygon = Polygon(points)
+        if polygon.is_valid and not polygon.is_empty:
+            centroid_lon, centroid_lat = polygon.centroid.x, polygon.centroid.y
+        scale_x = METERS_PER_DEGREE * math.cos(math.radians(centroid_lat))
+        projected = Polygon([(lon * scale_x, lat * METERS_PER_DEGREE) for lon, lat in points])
+        area = (projected if projected.is_valid else projected.buffer(0)).area
+
+    geometry = LineString(points) if len(points) >= 2 else Point(points[0])
+    return {
+        'geometry': shapely.to_wkb(geometry),
+        'min_lat': min(lats), 'min_lon': min(lons), 'max_lat': max(lats), 'max_lon': max(lons),
+        'centroid_lat': centroid_lat, 'centroid_lon': centroid_lon,
+        'area_m2': area, 'vertex_count': len(points),
+    }
+
+
+def upgrade():
+    with op.batch_alter_table('territory', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('geometry', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('min_lat', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('min_lon', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('max_lat', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('max_lon', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('centroid_lat', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('centroid_lon', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('area_m2', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('vertex_count', sa.Integer(), nullable=True))
+
+    # Conversion par lots, dans l'ordre des identifiants
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(territory.c.id, territory.c.coordinates)
+            .where(territory.c.id > last_id)
+            .order_by(territory.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for territory_id, coordinates in rows:
+            conn.execute(territory.update().where(territory.c.id == territory_id).values(**_convert(coordinates)))
+        last_id = rows[-1][0]
+
+    with op.batch_alter_table('territory', schema=None) as batch_op:
+        batch_op.drop_column('coordinates')
+
+
+def downgrade():
+    with op.batch_alter_table('territory', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('coordinates', sa.JSON(), nullable=True))
+
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(territory.c.id, territory.c.geometry)
+            .where(territory.c.id > last_id)
+            .order_by(territory.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for territory_id, wkb in rows:
+            coordinates = [[x, y] for x, y in shapely.from_wkb(bytes(wkb)).coords] if wkb else []
+            conn.execute(territory.update().where(territory.c.id == territory_id).values(coordinates=coordinates))
+        last_id = rows[-1][0]
+
+    with op.batch_alter_table('territory', schema=None) as batch_op:
+        batch_op.drop_column('vertex_count')
+        batch_op.drop_column('area_m2')
+        batch_op.drop_column('centroid_lon')
+        batch_op.drop_column('centroid_lat')
+        batch_op.drop_column('max_lon')
+        batch_op.drop_column('max_lat')
+        batch_op.drop_column('min_lon')
+        batch_op.drop_column('min_lat')
+        batch_op.drop_column('geometry')
@@ -0,0 +1,49 @@
+"""Add overpass_cache and cache_counter tables
+
+Revision ID: c41d7f02e6a8
+Revises: 8b27e4c5a9d3
+Create Date: 2026-10-18 10:48:55.120934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7f02e6a8'
+down_revision = '8b27e4c5a9d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('overpass_cache',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(length=64), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('geometry_hash', sa.String(length=64), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('last_used_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('key')
+    )
+    with op.batch_alter_table('overpass_cache', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_overpass_cache_geometry_hash'), ['geometry_hash'], unique=False)
+        batch_op.create_index(batch_op.f('ix_overpass_cache_last_used_at'), ['last_used_at'], unique=False)
+
+    op.create_table('cache_counter',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('hits', sa.BigInteger(), nullable=False),
+        sa.Column('misses', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('cache_counter')
+    with op.batch_alter_table('overpass_cache', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_overpass_cache_last_used_at'))
+        batch_op.drop_index(batch_op.f('ix_overpass_cache_geometry_hash'))
+
+    op.drop_table('overpass_cache')
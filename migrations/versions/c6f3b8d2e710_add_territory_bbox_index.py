@@ -0,0 +1,25 @@
+"""Add territory (user_id, bbox) index for map tiles
+
+Revision ID: c6f3b8d2e710
+Revises: 7a1d4c9e2f60
+Create Date: 2026-10-18 17:26:51.402918
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6f3b8d2e710'
+down_revision = '7a1d4c9e2f60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('territory', schema=None) as batch_op:
+        batch_op.create_index('ix_territory_user_bbox', ['user_id', 'min_lat', 'max_lat', 'min_lon', 'max_lon'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('territory', schema=None) as batch_op:
+        batch_op.drop_index('ix_territory_user_bbox')
@@ -0,0 +1,63 @@
+"""Add import_chunk table for streamed KML imports
+
+Revision ID: d81e4f6a2b93
+Revises: c6f3b8d2e710
+Create Date: 2026-10-18 18:02:14.630571
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81e4f6a2b93'
+down_revision = 'c6f3b8d2e710'
+branch_labels = None
+depends_on = None
+
+# Copie figée de JOBS_CHUNK_SIZE au moment de la migration
+CHUNK_SIZE = 20
+
+job = sa.table(
+    'job',
+    sa.column('id', sa.String),
+    sa.column('kind', sa.String),
+    sa.column('status', sa.String),
+    sa.column('cursor', sa.Integer),
+    sa.column('payload', sa.JSON),
+)
+
+
+def upgrade():
+    import_chunk = op.create_table('import_chunk',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_id', sa.String(length=36), nullable=False),
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('placemarks', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['job_id'], ['job.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('job_id', 'seq', name='uq_import_chunk_job_seq')
+    )
+
+    # Imports en cours : les placemarks restants passent du payload de la tâche aux lots
+    conn = op.get_bind()
+    pending = conn.execute(
+        sa.select(job.c.id, job.c.cursor, job.c.payload)
+        .where(job.c.kind == 'import_kml', job.c.status.in_(('pending', 'running')))
+    ).all()
+    for job_id, cursor, payload in pending:
+        placemarks = (payload or {}).get('placemarks', [])[cursor or 0:]
+        rows = [
+            {'job_id': job_id, 'seq': seq, 'placemarks': placemarks[start:start + CHUNK_SIZE],
+             'created_at': datetime.utcnow()}
+            for seq, start in enumerate(range(0, len(placemarks), CHUNK_SIZE))
+        ]
+        if rows:
+            op.bulk_insert(import_chunk, rows)
+        conn.execute(job.update().where(job.c.id == job_id).values(cursor=0, payload=None))
+
+
+def downgrade():
+    op.drop_table('import_chunk')
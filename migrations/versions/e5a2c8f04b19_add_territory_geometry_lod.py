@@ -0,0 +1,72 @@
+"""Add simplified territory geometries (levels of detail)
+
+Revision ID: e5a2c8f04b19
+Revises: b3e7d5a91f24
+Create Date: 2026-10-18 15:12:40.517203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import shapely
+from shapely.geometry import LineString
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a2c8f04b19'
+down_revision = 'b3e7d5a91f24'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+# Copie figée de geometry_codec.LOD_TOLERANCES au moment de la migration
+LOD_TOLERANCES = (0.00001, 0.00005, 0.0002)
+
+territory = sa.table(
+    'territory',
+    sa.column('id', sa.Integer),
+    sa.column('geometry', sa.LargeBinary),
+    sa.column('geometry_lod1', sa.LargeBinary),
+    sa.column('geometry_lod2', sa.LargeBinary),
+    sa.column('geometry_lod3', sa.LargeBinary),
+)
+
+
+def _levels(wkb):
+    geometry = shapely.from_wkb(bytes(wkb))
+    if not isinstance(geometry, LineString) or len(geometry.coords) < 3:
+        return [bytes(wkb)] * len(LOD_TOLERANCES)
+    return [shapely.to_wkb(geometry.simplify(t, preserve_topology=True)) for t in LOD_TOLERANCES]
+
+
+def upgrade():
+    with op.batch_alter_table('territory', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('geometry_lod1', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('geometry_lod2', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('geometry_lod3', sa.LargeBinary(), nullable=True))
+
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(territory.c.id, territory.c.geometry)
+            .where(territory.c.id > last_id)
+            .order_by(territory.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for territory_id, wkb in rows:
+            if wkb:
+                lod1, lod2, lod3 = _levels(wkb)
+                conn.execute(
+                    territory.update().where(territory.c.id == territory_id)
+                    .values(geometry_lod1=lod1, geometry_lod2=lod2, geometry_lod3=lod3)
+                )
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    with op.batch_alter_table('territory', schema=None) as batch_op:
+        batch_op.drop_column('geometry_lod3')
+        batch_op.drop_column('geometry_lod2')
+        batch_op.drop_column('geometry_lod1')
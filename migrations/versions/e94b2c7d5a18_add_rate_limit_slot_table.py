@@ -0,0 +1,28 @@
+"""Add rate_limit_slot table
+
+Revision ID: e94b2c7d5a18
+Revises: d81e4f6a2b93
+Create Date: 2026-10-18 19:41:05.218334
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e94b2c7d5a18'
+down_revision = 'd81e4f6a2b93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rate_limit_slot',
+        sa.Column('host', sa.String(length=255), nullable=False),
+        sa.Column('next_slot', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('host')
+    )
+
+
+def downgrade():
+    op.drop_table('rate_limit_slot')
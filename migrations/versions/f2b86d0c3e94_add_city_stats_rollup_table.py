@@ -0,0 +1,45 @@
+"""Add city_stats rollup table
+
+Revision ID: f2b86d0c3e94
+Revises: a7c3e19d4f56
+Create Date: 2026-10-18 13:05:12.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b86d0c3e94'
+down_revision = 'a7c3e19d4f56'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('city_stats',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('city', sa.String(length=100), nullable=False),
+        sa.Column('territories', sa.Integer(), nullable=False),
+        sa.Column('buildings', sa.Integer(), nullable=False),
+        sa.Column('apartments', sa.Integer(), nullable=False),
+        sa.Column('sonnettes', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'city', name='uq_city_stats_user_city')
+    )
+
+    # Remplir les agrégats à partir des territoires existants
+    op.execute(sa.text("""
+        INSERT INTO city_stats (user_id, city, territories, buildings, apartments, sonnettes, updated_at)
+        SELECT user_id, COALESCE(city, ''), COUNT(*), COALESCE(SUM(buildings), 0),
+               COALESCE(SUM(apartments), 0), COALESCE(SUM(sonnettes), 0), CURRENT_TIMESTAMP
+        FROM territory
+        GROUP BY user_id, COALESCE(city, '')
+    """))
+
+
+def downgrade():
+    op.drop_table('city_stats')
@@ -0,0 +1,28 @@
+"""Add boundary to osm_extract
+
+Revision ID: f3c8a1d6e257
+Revises: e94b2c7d5a18
+Create Date: 2026-10-18 20:12:48.093517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c8a1d6e257'
+down_revision = 'e94b2c7d5a18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Les extraits existants n'ont que l'emprise de leurs données : sans contour,
+    # ils ne couvrent plus rien en mode 'auto' tant qu'ils ne sont pas réimportés
+    with op.batch_alter_table('osm_extract', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('boundary', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('osm_extract', schema=None) as batch_op:
+        batch_op.drop_column('boundary')
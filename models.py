@@ -2,6 +2,7 @@ from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+import geometry_codec
 
 db = SQLAlchemy()
 
@@ -28,9 +29,23 @@ class Territory(db.Model):
     uuid = db.Column(db.String(36), unique=True, nullable=False)  # UUID pour identifier de manière unique le territoire
     name = db.Column(db.String(100), nullable=False)
     type = db.Column(db.String(50))
-    number = db.Column(db.String(10))
+    number = db.Column(db.String(50))  # Numéro formaté selon UserSettings.territory_number_format
     city = db.Column(db.String(100))
-    coordinates = db.Column(db.JSON)
+    # Contour en WKB (voir geometry_codec), chargé uniquement à la demande : utiliser la propriété `coordinates`
+    geometry = db.deferred(db.Column(db.LargeBinary))
+    # Contours simplifiés (niveaux de détail 1 à 3 de geometry_codec.LOD_TOLERANCES), chargés eux aussi à la demande
+    geometry_lod1 = db.deferred(db.Column(db.LargeBinary))
+    geometry_lod2 = db.deferred(db.Column(db.LargeBinary))
+    geometry_lod3 = db.deferred(db.Column(db.LargeBinary))
+    # Mesures précalculées à l'écriture du contour
+    min_lat = db.Column(db.Float)
+    min_lon = db.Column(db.Float)
+    max_lat = db.Column(db.Float)
+    max_lon = db.Column(db.Float)
+    centroid_lat = db.Column(db.Float)
+    centroid_lon = db.Column(db.Float)
+    area_m2 = db.Column(db.Float)
+    vertex_count = db.Column(db.Integer, default=0)
     buildings = db.Column(db.Integer, default=0)
     apartments = db.Column(db.Integer, default=0)
     sonnettes = db.Column(db.Integer, default=0)  # Ajout de la colonne sonnettes
@@ -39,8 +54,57 @@ class Territory(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     commentaire = db.Column(db.Text, nullable=True)  # Ajout du champ commentaire
     
+    __table_args__ = (
+        # Validateurs HTTP (ETag/Last-Modified) : max(updated_at) et count(*) lus sur l'index seul
+        db.Index('ix_territory_user_updated', 'user_id', 'updated_at'),
+        # Pagination par clé de /list_territories
+        db.Index('ix_territory_user_created_id', 'user_id', 'created_at', 'id'),
+        # Territoires dont l'emprise croise une tuile de carte
+        db.Index('ix_territory_user_bbox', 'user_id', 'min_lat', 'max_lat', 'min_lon', 'max_lon'),
+    )
+    
     # Relations
     
+    @property
+    def coordinates(self):
+        """Contour du territoire : liste de [lng, lat]"""
+        return geometry_codec.decode(self.geometry)
+
+    @coordinates.setter
+    def coordinates(self, coordinates):
+        for name, value in self.geometry_values(coordinates).items():
+            setattr(self, name, value)
+
+    @staticmethod
+    def geometry_values(coordinates):
+        """Valeurs des colonnes de géométrie (WKB, niveaux de détail, mesures) pour un contour"""
+        values = {'geometry': geometry_codec.encode(coordinates)}
+        for level, wkb in enumerate(geometry_codec.simplified_levels(coordinates), start=1):
+            values[f'geometry_lod{level}'] = wkb
+        values.update(geometry_codec.measures(coordinates))
+        return values
+
+    @classmethod
+    def geometry_column(cls, level):
+        """Colonne du contour au niveau de détail donné (0 = pleine résolution)"""
+        return cls.geometry if level == 0 else getattr(cls, f'geometry_lod{level}')
+
+    def coordinates_at(self, level):
+        """Contour au niveau de détail donné : liste de [lng, lat]"""
+        if level == 0:
+            return self.coordinates
+        return geometry_codec.decode(getattr(self, f'geometry_lod{level}'))
+
+    @property
+    def bbox(self):
+        """Emprise (ouest, sud, est, nord), sans charger la géométrie"""
+        return self.min_lon, self.min_lat, self.max_lon, self.max_lat
+
+    @property
+    def centroid(self):
+        """Centre (lat, lng), sans charger la géométrie"""
+        return self.centroid_lat, self.centroid_lon
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -53,11 +117,19 @@ class Territory(db.Model):
             'buildings': self.buildings,
             'apartments': self.apartments,
             'sonnettes': self.sonnettes,
+            'area_m2': self.area_m2,
+            'vertex_count': self.vertex_count,
             'commentaire': self.commentaire,  # Ajout du commentaire dans le dictionnaire
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
 
+class TerritoryCounter(db.Model):
+    """Prochain numéro de territoire à attribuer pour chaque utilisateur (voir numbering.py)"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    next_number = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class UserSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
@@ -85,3 +157,141 @@ class UserSettings(db.Model):
             'default_map_center_lng': self.default_map_center_lng,
             'default_map_zoom': self.default_map_zoom
         }
+
+class GeocodeCache(db.Model):
+    """Cache partagé (entre les workers) des résultats de géocodage inverse"""
+    id = db.Column(db.Integer, primary_key=True)
+    cell = db.Column(db.String(40), unique=True, nullable=False)  # Cellule de grille quantifiée, ex: "10131:614"
+    city = db.Column(db.String(100), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class OsmExtract(db.Model):
+    """Extrait OSM importé localement (zone couverte par le snapshot)"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), unique=True, nullable=False)  # Nom du fichier importé
+    # Emprise du contour (présélection indexée de covers())
+    min_lat = db.Column(db.Float, nullable=False)
+    min_lon = db.Column(db.Float, nullable=False)
+    max_lat = db.Column(db.Float, nullable=False)
+    max_lon = db.Column(db.Float, nullable=False)
+    boundary = db.Column(db.JSON)  # Contour GeoJSON de la zone extraite (pas l'emprise des données)
+    buildings = db.Column(db.Integer, default=0)
+    streets = db.Column(db.Integer, default=0)
+    loaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class OsmBuilding(db.Model):
+    """Bâtiment du snapshot OSM local, réduit à son centre et à ses tags"""
+    id = db.Column(db.Integer, primary_key=True)
+    extract_id = db.Column(db.Integer, db.ForeignKey('osm_extract.id', ondelete='CASCADE'), nullable=False, index=True)
+    osm_type = db.Column(db.String(10), nullable=False)  # way ou relation
+    osm_id = db.Column(db.BigInteger, nullable=False)
+    lat = db.Column(db.Float, nullable=False)
+    lon = db.Column(db.Float, nullable=False)
+    tags = db.Column(db.JSON)
+
+    __table_args__ = (db.Index('ix_osm_building_lat_lon', 'lat', 'lon'),)
+
+class OsmStreet(db.Model):
+    """Voie nommée du snapshot OSM local avec son tracé et son emprise"""
+    id = db.Column(db.Integer, primary_key=True)
+    extract_id = db.Column(db.Integer, db.ForeignKey('osm_extract.id', ondelete='CASCADE'), nullable=False, index=True)
+    osm_id = db.Column(db.BigInteger, nullable=False)
+    name = db.Column(db.String(200), nullable=False)
+    highway = db.Column(db.String(50))
+    points = db.Column(db.JSON, nullable=False)  # Liste de [lon, lat]
+    min_lat = db.Column(db.Float, nullable=False)
+    min_lon = db.Column(db.Float, nullable=False)
+    max_lat = db.Column(db.Float, nullable=False)
+    max_lon = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (db.Index('ix_osm_street_bbox', 'min_lat', 'max_lat', 'min_lon', 'max_lon'),)
+
+class OverpassCache(db.Model):
+    """Réponses Overpass mises en cache, indexées par empreinte de la géométrie et type de requête"""
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), unique=True, nullable=False)  # sha256(type + empreinte géométrie)
+    kind = db.Column(db.String(20), nullable=False)  # buildings ou streets
+    geometry_hash = db.Column(db.String(64), nullable=False, index=True)
+    payload = db.Column(db.Text, nullable=False)  # Réponse Overpass (JSON)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class CacheCounter(db.Model):
+    """Compteurs de succès/échecs des caches partagés"""
+    name = db.Column(db.String(50), primary_key=True)
+    hits = db.Column(db.BigInteger, default=0, nullable=False)
+    misses = db.Column(db.BigInteger, default=0, nullable=False)
+
+class RateLimitSlot(db.Model):
+    """Prochain créneau d'appel autorisé vers un hôte externe, partagé par tous les processus"""
+    host = db.Column(db.String(255), primary_key=True)
+    next_slot = db.Column(db.Float, nullable=False)  # Horodatage Unix (secondes)
+
+class Job(db.Model):
+    """Tâche de fond exécutée par le worker local, par lots et avec reprise possible"""
+    id = db.Column(db.String(36), primary_key=True)  # UUID
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    kind = db.Column(db.String(50), nullable=False)  # Ex: recalculate_all
+    status = db.Column(db.String(20), default='pending', nullable=False, index=True)  # staging, pending, running, done, failed
+    total = db.Column(db.Integer, default=0)
+    processed = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    cursor = db.Column(db.Integer)  # Point de reprise propre au type : dernier identifiant traité, ou prochain lot (seq) pour import_kml
+    payload = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        remaining = max((self.total or 0) - (self.processed or 0), 0)
+        eta_seconds = None
+        if self.status == 'running' and self.started_at and self.processed:
+            elapsed = (datetime.utcnow() - self.started_at).total_seconds()
+            eta_seconds = round(elapsed / self.processed * remaining)
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'failed': self.failed,
+            'progress': round(self.processed / self.total * 100, 1) if self.total else None,
+            'eta_seconds': eta_seconds,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class ImportStaging(db.Model):
+    """Résultat enrichi du dernier upload KML d'un utilisateur, en attente de génération"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
+    territories = db.Column(db.JSON, nullable=False)  # Territoires parsés et enrichis (ville, sonnettes)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class ImportChunk(db.Model):
+    """Lot de placemarks d'un import KML asynchrone, en attente de traitement par la tâche"""
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(36), db.ForeignKey('job.id', ondelete='CASCADE'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)  # Rang du lot dans le fichier (job.cursor = prochain lot)
+    placemarks = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('job_id', 'seq', name='uq_import_chunk_job_seq'),)
+
+class CityStats(db.Model):
+    """Agrégats par utilisateur et par ville, maintenus à chaque création, suppression ou recalcul de territoire"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    city = db.Column(db.String(100), nullable=False, default='')  # '' pour les territoires sans ville
+    territories = db.Column(db.Integer, default=0, nullable=False)
+    buildings = db.Column(db.Integer, default=0, nullable=False)
+    apartments = db.Column(db.Integer, default=0, nullable=False)
+    sonnettes = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'city', name='uq_city_stats_user_city'),)
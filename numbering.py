@@ -0,0 +1,63 @@
+"""Attribution des numéros de territoire par utilisateur
+
+Un compteur par utilisateur (table territory_counter) est incrémenté d'un bloc
+entier en une seule instruction INSERT ... ON CONFLICT DO UPDATE ... RETURNING :
+la ligne reste verrouillée jusqu'à la validation, si bien que deux imports
+simultanés reçoivent des blocs disjoints.
+"""
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, TerritoryCounter, UserSettings
+
+DEFAULT_FORMAT = 'T-{number}'
+
+counter_table = TerritoryCounter.__table__
+
+
+def allocate_numbers(user_id, count, start=1):
+    """Réserve `count` numéros consécutifs pour l'utilisateur et retourne le range correspondant
+
+    Le compteur ne descend jamais sous `start` (UserSettings.territory_start_number) ;
+    un numéro de départ plus petit que les numéros déjà attribués est ignoré.
+    """
+    if count <= 0:
+        return range(0)
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        insert, greatest = postgresql.insert, func.greatest
+    else:
+        # SQLite (développement) : max() à deux arguments joue le rôle de greatest()
+        insert, greatest = sqlite.insert, func.max
+
+    now = datetime.utcnow()
+    stmt = insert(counter_table).values(user_id=user_id, next_number=start + count, updated_at=now)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[counter_table.c.user_id],
+        set_={'next_number': greatest(counter_table.c.next_number, start) + count, 'updated_at': now}
+    ).returning(counter_table.c.next_number)
+
+    end = db.session.execute(stmt).scalar_one()
+    return range(end - count, end)
+
+
+def format_number(number_format, number):
+    """Applique le format utilisateur ({number}, {year}, spécifications Python comme {number:03d})"""
+    try:
+        return (number_format or DEFAULT_FORMAT).format(number=number, year=datetime.utcnow().year)
+    except (KeyError, IndexError, ValueError):
+        return DEFAULT_FORMAT.format(number=number)
+
+
+def assign_numbers(kml_data, user_id):
+    """Complète les placemarks sans numéro avec un bloc de numéros formatés alloué en une fois"""
+    missing = [t for t in kml_data if t.get('coordinates') and not t.get('number')]
+    if not missing:
+        return
+
+    settings = UserSettings.query.filter_by(user_id=user_id).first()
+    number_format = settings.territory_number_format if settings else DEFAULT_FORMAT
+    start = (settings.territory_start_number if settings else None) or 1
+
+    for territory_data, number in zip(missing, allocate_numbers(user_id, len(missing), start)):
+        territory_data['number'] = format_number(number_format, number)
@@ -0,0 +1,86 @@
+"""Client HTTP partagé pour les services OpenStreetMap (Nominatim, Overpass)"""
+import threading
+import time
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = 'TerritoryDivider/1.0'
+DEFAULT_TIMEOUT = 60
+
+
+class HostRateLimiter:
+    """Impose un intervalle minimal (en secondes) entre deux requêtes vers un même hôte
+
+    Chaque appel réserve le prochain créneau via `reserve(host, interval)`, qui
+    retourne l'horodatage (time.time()) auquel la requête peut partir, puis
+    attend hors verrou, ce qui permet aux requêtes vers d'autres hôtes de
+    continuer. La réservation par défaut est locale au processus : elle ne
+    borne pas le débit cumulé de plusieurs processus. L'application fournit
+    une réservation partagée (rate_limit.shared_reserve) via configure().
+    """
+
+    def __init__(self, intervals=None, reserve=None):
+        self.intervals = dict(intervals or {})
+        self.reserve = reserve or self.reserve_local
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def reserve_local(self, host, interval):
+        """Réserve le prochain créneau dans ce processus uniquement"""
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + interval
+        return slot
+
+    def wait(self, host):
+        interval = self.intervals.get(host, 0)
+        if not interval:
+            return
+        delay = self.reserve(host, interval) - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+rate_limiter = HostRateLimiter()
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def configure(pool_size=10, intervals=None, reserve=None):
+    """Configure la taille du pool de connexions, les intervalles par hôte et la réservation des créneaux"""
+    global _session
+    with _session_lock:
+        session = requests.Session()
+        session.headers['User-Agent'] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session = session
+    if intervals:
+        rate_limiter.intervals.update(intervals)
+    if reserve:
+        rate_limiter.reserve = reserve
+
+
+def get_session():
+    """Retourne la session partagée (connexions keep-alive réutilisées entre les requêtes)"""
+    if _session is None:
+        configure()
+    return _session
+
+
+def _request(method, url, **kwargs):
+    rate_limiter.wait(urlparse(url).hostname)
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    return get_session().request(method, url, **kwargs)
+
+
+def osm_get(url, **kwargs):
+    return _request('GET', url, **kwargs)
+
+
+def osm_post(url, **kwargs):
+    return _request('POST', url, **kwargs)
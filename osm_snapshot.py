@@ -0,0 +1,355 @@
+"""Snapshot OSM local : import d'un extrait (Overpass JSON, .osm ou .pbf) et requêtes indexées
+
+Les fonctions de requête renvoient des données au format de l'API Overpass
+(`{'elements': [...]}`) afin que le code appelant n'ait pas à distinguer la source.
+
+La couverture d'un extrait est le contour de la zone extraite (fichier .poly ou
+GeoJSON, --bbox, ou emprise déclarée dans l'en-tête du .osm / .pbf), jamais
+l'emprise de ses données : celle d'un département déborde largement sur les
+départements voisins, où le snapshot ne contient rien.
+"""
+import functools
+import json
+import os
+import xml.etree.ElementTree as ET
+from itertools import count
+from flask import current_app
+from sqlalchemy import insert, select
+from shapely.geometry import LineString, Point, Polygon, box, mapping, shape
+from shapely.ops import unary_union
+from shapely.prepared import prep
+from models import db, OsmExtract, OsmBuilding, OsmStreet
+
+IMPORT_CHUNK_SIZE = 5000
+
+
+def _is_building(tags):
+    return 'building' in tags
+
+
+def _is_named_street(tags):
+    return 'highway' in tags and 'name' in tags
+
+
+def _center(points):
+    lats = [p[1] for p in points]
+    lons = [p[0] for p in points]
+    return sum(lats) / len(lats), sum(lons) / len(lons)
+
+
+def read_overpass_json(path):
+    """Lit une réponse Overpass JSON (`out body; >; out skel` ou `out geom`/`out center`)"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+
+    elements = data.get('elements', [])
+    nodes = {e['id']: (e['lon'], e['lat']) for e in elements if e.get('type') == 'node' and 'lat' in e}
+
+    for element in elements:
+        if element.get('type') not in ('way', 'relation') or 'tags' not in element:
+            continue
+        tags = element['tags']
+        if 'geometry' in element:
+            points = [(p['lon'], p['lat']) for p in element['geometry'] if p]
+        else:
+            points = [nodes[n] for n in element.get('nodes', []) if n in nodes]
+
+        if _is_building(tags):
+            if 'center' in element:
+                lat, lon = element['center']['lat'], element['center']['lon']
+            elif points:
+                lat, lon = _center(points)
+            else:
+                continue
+            yield 'building', (element['type'], element['id'], lat, lon, tags)
+        elif element['type'] == 'way' and _is_named_street(tags) and len(points) >= 2:
+            yield 'street', (element['id'], tags['name'], tags.get('highway'), points)
+
+
+def read_osm_xml(path):
+    """Lit un fichier .osm en deux passes pour ne garder en mémoire que les nœuds utiles"""
+    ways = []
+    needed = set()
+    for _, elem in ET.iterparse(path, events=('end',)):
+        if elem.tag == 'way':
+            tags = {t.get('k'): t.get('v') for t in elem.findall('tag')}
+            if _is_building(tags) or _is_named_street(tags):
+                refs = [int(nd.get('ref')) for nd in elem.findall('nd')]
+                ways.append((int(elem.get('id')), tags, refs))
+                needed.update(refs)
+            elem.clear()
+        elif elem.tag in ('node', 'relation'):
+            elem.clear()
+
+    nodes = {}
+    for _, elem in ET.iterparse(path, events=('end',)):
+        if elem.tag == 'node':
+            node_id = int(elem.get('id'))
+            if node_id in needed:
+                nodes[node_id] = (float(elem.get('lon')), float(elem.get('lat')))
+            elem.clear()
+        elif elem.tag in ('way', 'relation'):
+            elem.clear()
+
+    for way_id, tags, refs in ways:
+        points = [nodes[r] for r in refs if r in nodes]
+        if not points:
+            continue
+        if _is_building(tags):
+            lat, lon = _center(points)
+            yield 'building', ('way', way_id, lat, lon, tags)
+        elif len(points) >= 2:
+            yield 'street', (way_id, tags['name'], tags.get('highway'), points)
+
+
+def read_osm_pbf(path):
+    """Lit un fichier .osm.pbf (nécessite le paquet optionnel `osmium`)"""
+    try:
+        import osmium
+    except ImportError:
+        raise RuntimeError("L'import des fichiers .pbf nécessite le paquet 'osmium' (pip install osmium)")
+
+    results = []
+
+    class Handler(osmium.SimpleHandler):
+        def way(self, w):
+            tags = {t.k: t.v for t in w.tags}
+            if not (_is_building(tags) or _is_named_street(tags)):
+                return
+            points = [(n.lon, n.lat) for n in w.nodes if n.location.valid()]
+            if not points:
+                return
+            if _is_building(tags):
+                lat, lon = _center(points)
+                results.append(('building', ('way', w.id, lat, lon, tags)))
+            elif len(points) >= 2:
+                results.append(('street', (w.id, tags['name'], tags.get('highway'), points)))
+
+    Handler().apply_file(path, locations=True)
+    return results
+
+
+def read_extract(path):
+    lower = path.lower()
+    if lower.endswith('.json'):
+        return read_overpass_json(path)
+    if lower.endswith('.pbf'):
+        return read_osm_pbf(path)
+    if lower.endswith('.osm') or lower.endswith('.xml'):
+        return read_osm_xml(path)
+    raise ValueError(f"Format d'extrait OSM non supporté : {path}")
+
+
+def read_poly(path):
+    """Lit un contour au format Osmosis .poly (celui des extraits Geofabrik)"""
+    outers, holes = [], []
+    with open(path, encoding='utf-8') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    ring, target = None, None
+    # La première ligne est le nom du contour ; chaque section se termine par END
+    for line in lines[1:]:
+        if ring is None:
+            if line == 'END':
+                break
+            ring, target = [], holes if line.startswith('!') else outers
+        elif line == 'END':
+            if len(ring) >= 3:
+                target.append(Polygon(ring))
+            ring = None
+        else:
+            lon, lat = line.split()[:2]
+            ring.append((float(lon), float(lat)))
+    if not outers:
+        raise ValueError(f"Aucun contour dans le fichier {path}")
+    boundary = unary_union(outers)
+    return boundary.difference(unary_union(holes)) if holes else boundary
+
+
+def read_geojson_boundary(path):
+    """Lit un contour GeoJSON (géométrie, Feature ou FeatureCollection de polygones)"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('type') == 'FeatureCollection':
+        geometries = [feature['geometry'] for feature in data.get('features', [])]
+    elif data.get('type') == 'Feature':
+        geometries = [data['geometry']]
+    else:
+        geometries = [data]
+    boundary = unary_union([shape(geometry) for geometry in geometries if geometry])
+    if boundary.is_empty or boundary.area == 0:
+        raise ValueError(f"Aucun polygone dans le fichier {path}")
+    return boundary
+
+
+def read_boundary(path):
+    if path.lower().endswith('.poly'):
+        return read_poly(path)
+    return read_geojson_boundary(path)
+
+
+def read_header_bounds(path):
+    """Emprise déclarée dans l'en-tête d'un .osm (<bounds>) ou d'un .pbf, ou None"""
+    lower = path.lower()
+    if lower.endswith('.osm') or lower.endswith('.xml'):
+        for _, elem in ET.iterparse(path, events=('start',)):
+            if elem.tag == 'bounds':
+                return box(float(elem.get('minlon')), float(elem.get('minlat')),
+                           float(elem.get('maxlon')), float(elem.get('maxlat')))
+            if elem.tag in ('node', 'way', 'relation'):
+                return None
+    elif lower.endswith('.pbf'):
+        try:
+            import osmium
+        except ImportError:
+            return None
+        header_box = osmium.io.Reader(path, osmium.osm.osm_entity_bits.NOTHING).header().box()
+        if header_box.valid():
+            return box(header_box.bottom_left.lon, header_box.bottom_left.lat,
+                       header_box.top_right.lon, header_box.top_right.lat)
+    return None
+
+
+def import_extract(path, name=None, boundary=None):
+    """Importe un extrait OSM dans le snapshot local (remplace un extrait du même nom)
+
+    `boundary` : contour shapely de la zone extraite. À défaut, l'emprise de
+    l'en-tête du fichier est utilisée ; lève ValueError si elle est absente
+    (Overpass JSON, .osm sans <bounds>).
+    """
+    name = name or os.path.basename(path)
+    boundary = boundary if boundary is not None else read_header_bounds(path)
+    if boundary is None:
+        raise ValueError(
+            f"Zone couverte par l'extrait {name} inconnue : indiquer --boundary (fichier .poly "
+            "ou GeoJSON) ou --bbox"
+        )
+    current_app.logger.info(f"Import de l'extrait OSM {name}")
+
+    existing = OsmExtract.query.filter_by(name=name).first()
+    if existing:
+        OsmBuilding.query.filter_by(extract_id=existing.id).delete(synchronize_session=False)
+        OsmStreet.query.filter_by(extract_id=existing.id).delete(synchronize_session=False)
+        db.session.delete(existing)
+        db.session.commit()
+
+    west, south, east, north = boundary.bounds
+    extract = OsmExtract(name=name, min_lat=south, min_lon=west, max_lat=north, max_lon=east,
+                         boundary=mapping(boundary))
+    db.session.add(extract)
+    db.session.commit()
+
+    buildings, streets = [], []
+    totals = {'building': 0, 'street': 0}
+
+    def flush():
+        if buildings:
+            db.session.execute(insert(OsmBuilding), buildings)
+            buildings.clear()
+        if streets:
+            db.session.execute(insert(OsmStreet), streets)
+            streets.clear()
+        db.session.commit()
+
+    for kind, row in read_extract(path):
+        totals[kind] += 1
+        if kind == 'building':
+            osm_type, osm_id, lat, lon, tags = row
+            buildings.append({
+                'extract_id': extract.id, 'osm_type': osm_type, 'osm_id': osm_id,
+                'lat': lat, 'lon': lon, 'tags': tags
+            })
+        else:
+            osm_id, street_name, highway, points = row
+            lons = [p[0] for p in points]
+            lats = [p[1] for p in points]
+            streets.append({
+                'extract_id': extract.id, 'osm_id': osm_id, 'name': street_name[:200],
+                'highway': highway, 'points': [list(p) for p in points],
+                'min_lat': min(lats), 'min_lon': min(lons), 'max_lat': max(lats), 'max_lon': max(lons)
+            })
+        if len(buildings) + len(streets) >= IMPORT_CHUNK_SIZE:
+            flush()
+
+    extract.buildings = totals['building']
+    extract.streets = totals['street']
+    flush()
+    current_app.logger.info(f"Extrait {name} importé : {totals['building']} bâtiments, {totals['street']} rues")
+    return extract
+
+
+@functools.lru_cache(maxsize=32)
+def _prepared_boundary(extract_id, loaded_at):
+    """Contour préparé d'un extrait, gardé en mémoire tant que l'extrait n'est pas réimporté"""
+    boundary = db.session.get(OsmExtract, extract_id).boundary
+    return prep(shape(boundary))
+
+
+def covers(geometry):
+    """Indique si un extrait importé couvre entièrement la géométrie shapely (territoire ou emprise)
+
+    L'emprise des extraits ne sert que de présélection indexée ; le test porte
+    sur le contour de la zone extraite. Les extraits importés sans contour ne
+    couvrent rien (à réimporter avec --boundary ou --bbox).
+    """
+    west, south, east, north = geometry.bounds
+    candidates = db.session.execute(
+        select(OsmExtract.id, OsmExtract.loaded_at).where(
+            OsmExtract.min_lon <= west, OsmExtract.min_lat <= south,
+            OsmExtract.max_lon >= east, OsmExtract.max_lat >= north,
+            OsmExtract.boundary.isnot(None)
+        )
+    ).all()
+    return any(_prepared_boundary(extract_id, loaded_at).covers(geometry) for extract_id, loaded_at in candidates)
+
+
+def buildings_in_bounds(bounds):
+    """Bâtiments dont le centre est dans l'emprise, au format Overpass `out tags center`"""
+    west, south, east, north = bounds
+    rows = db.session.execute(
+        select(OsmBuilding.osm_type, OsmBuilding.osm_id, OsmBuilding.lat, OsmBuilding.lon, OsmBuilding.tags).where(
+            OsmBuilding.lat.between(south, north),
+            OsmBuilding.lon.between(west, east)
+        )
+    )
+    return {'elements': [
+        {'type': osm_type, 'id': osm_id, 'center': {'lat': lat, 'lon': lon}, 'tags': tags or {}}
+        for osm_type, osm_id, lat, lon, tags in rows
+    ]}
+
+
+def buildings_in_polygon(polygon):
+    """Bâtiments dont le centre est dans le polygone shapely"""
+    data = buildings_in_bounds(polygon.bounds)
+    data['elements'] = [
+        e for e in data['elements']
+        if polygon.intersects(Point(e['center']['lon'], e['center']['lat']))
+    ]
+    return data
+
+
+def streets_in_polygon(polygon):
+    """Voies nommées qui traversent le polygone, au format Overpass `out body; >; out skel`"""
+    west, south, east, north = polygon.bounds
+    rows = db.session.execute(
+        select(OsmStreet.osm_id, OsmStreet.name, OsmStreet.highway, OsmStreet.points).where(
+            OsmStreet.min_lat <= north, OsmStreet.max_lat >= south,
+            OsmStreet.min_lon <= east, OsmStreet.max_lon >= west
+        )
+    )
+
+    # Identifiants de nœuds synthétiques (négatifs) pour reproduire la structure Overpass
+    node_ids = count(-1, -1)
+    elements = []
+    for osm_id, street_name, highway, points in rows:
+        if not polygon.intersects(LineString(points)):
+            continue
+        refs = []
+        for lon, lat in points:
+            node_id = next(node_ids)
+            refs.append(node_id)
+            elements.append({'type': 'node', 'id': node_id, 'lat': lat, 'lon': lon})
+        elements.append({
+            'type': 'way', 'id': osm_id, 'nodes': refs,
+            'tags': {'name': street_name, 'highway': highway}
+        })
+    return {'elements': elements}
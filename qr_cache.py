@@ -0,0 +1,104 @@
+"""QR codes adressés par contenu, sur disque ou rendus en mémoire
+
+Sur disque (QR_STORAGE=disk), le nom du fichier est l'empreinte SHA-256 du
+texte encodé : une image est générée une seule fois, partagée par tous les
+territoires qui encodent le même lien, et ne change jamais (elle peut donc
+être servie avec un cache immuable). Lorsqu'un territoire est redessiné, son
+lien change et pointe vers un nouveau fichier ; les fichiers qui ne sont plus
+référencés sont supprimés par la tâche de fond `qr_cleanup`.
+
+En mémoire (QR_STORAGE=memory, pour les instances sans disque partagé),
+render_qr produit directement les octets PNG ou SVG ; l'application les garde
+dans un cache LRU borné indexé par (contenu, format, taille).
+"""
+import hashlib
+import io
+import os
+import tempfile
+import time
+import qrcode
+import qrcode.image.svg
+
+QR_SUFFIX = '.png'
+
+MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+
+def qr_filename(data):
+    """Nom du fichier QR pour le texte encodé"""
+    return hashlib.sha256(data.encode('utf-8')).hexdigest() + QR_SUFFIX
+
+
+def render_qr_png(data, stream, box_size=10):
+    """Écrit le QR code PNG du texte dans un flux binaire"""
+    qr = qrcode.QRCode(version=1, box_size=box_size, border=5)
+    qr.add_data(data)
+    qr.make(fit=True)
+    qr.make_image(fill_color="black", back_color="white").save(stream)
+
+
+def render_qr(data, fmt='png', box_size=10):
+    """Rend le QR code du texte en mémoire et retourne les octets (PNG ou SVG)"""
+    stream = io.BytesIO()
+    if fmt == 'svg':
+        qr = qrcode.QRCode(version=1, box_size=box_size, border=5,
+                           image_factory=qrcode.image.svg.SvgPathImage)
+        qr.add_data(data)
+        qr.make(fit=True)
+        qr.make_image().save(stream)
+    else:
+        render_qr_png(data, stream, box_size)
+    return stream.getvalue()
+
+
+def qr_etag(data, fmt, box_size):
+    """Validateur HTTP d'un rendu : il ne dépend que du contenu encodé, du format et de la taille"""
+    return hashlib.sha256(f"{fmt}:{box_size}:{data}".encode('utf-8')).hexdigest()
+
+
+def ensure_qr(folder, data):
+    """Génère le QR code s'il n'existe pas encore et retourne son nom de fichier
+
+    L'image est écrite dans un fichier temporaire du même dossier puis renommée
+    atomiquement : deux workers concurrents produisent le même contenu et le
+    dernier renommage l'emporte sans qu'un lecteur voie jamais un fichier partiel.
+    """
+    filename = qr_filename(data)
+    path = os.path.join(folder, filename)
+    if os.path.exists(path):
+        return filename
+
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            render_qr_png(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return filename
+
+
+def remove_unreferenced(folder, referenced, grace_period):
+    """Supprime les QR codes (et fichiers temporaires) absents de `referenced`
+
+    Les fichiers plus récents que `grace_period` secondes sont conservés : ils
+    peuvent correspondre à un territoire en cours de création. Retourne le
+    nombre de fichiers supprimés.
+    """
+    removed = 0
+    cutoff = time.time() - grace_period
+    for entry in os.scandir(folder):
+        if not entry.is_file() or entry.name in referenced:
+            continue
+        if not entry.name.endswith((QR_SUFFIX, '.tmp')):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            # Déjà supprimé par un autre worker
+            continue
+    return removed
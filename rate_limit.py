@@ -0,0 +1,50 @@
+"""Créneaux d'appel aux services externes, partagés entre processus (table rate_limit_slot)
+
+Les workers gunicorn, le worker de tâches de fond et leurs threads passent tous
+par la même ligne par hôte : un INSERT ... ON CONFLICT DO UPDATE ... RETURNING
+avance `next_slot` d'un intervalle et retourne le créneau réservé. La ligne
+reste verrouillée jusqu'à la validation, immédiate sur une connexion dédiée,
+si bien que deux réservations simultanées reçoivent des créneaux distincts et
+que le débit cumulé respecte l'intervalle (politique Nominatim : 1 requête/s).
+Les horodatages sont ceux de l'horloge système des processus.
+"""
+import time
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, RateLimitSlot
+
+slot_table = RateLimitSlot.__table__
+
+
+def reserve_slot(host, interval):
+    """Réserve le prochain créneau d'appel à `host` et retourne son horodatage"""
+    if db.engine.dialect.name == 'postgresql':
+        insert, greatest = postgresql.insert, func.greatest
+    else:
+        # SQLite (développement) : max() à deux arguments joue le rôle de greatest()
+        insert, greatest = sqlite.insert, func.max
+
+    now = time.time()
+    stmt = insert(slot_table).values(host=host, next_slot=now + interval)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[slot_table.c.host],
+        set_={'next_slot': greatest(slot_table.c.next_slot, now) + interval}
+    ).returning(slot_table.c.next_slot)
+    with db.engine.begin() as conn:
+        return conn.execute(stmt).scalar_one() - interval
+
+
+def shared_reserve(app, fallback):
+    """Fonction de réservation pour osm_client, utilisable depuis n'importe quel thread
+
+    En cas d'erreur de base (table absente, base indisponible), la réservation
+    se replie sur `fallback` (locale au processus) plutôt que de bloquer l'appel.
+    """
+    def reserve(host, interval):
+        with app.app_context():
+            try:
+                return reserve_slot(host, interval)
+            except Exception as e:
+                app.logger.error(f"Erreur lors de la réservation d'un créneau pour {host}: {str(e)}")
+                return fallback(host, interval)
+    return reserve
@@ -0,0 +1,143 @@
+"""Maintenance incrémentale des agrégats par ville (table city_stats)
+
+Les territoires créés, supprimés ou modifiés via l'ORM sont repérés après chaque
+flush ; juste avant la validation, les agrégats des seules villes concernées sont
+recalculés par un GROUP BY indexé et écrits par upsert, dans la même transaction
+que le changement.
+Les opérations en masse qui contournent l'ORM (Query.delete, insertions core)
+doivent appeler refresh_city_stats explicitement.
+"""
+from datetime import datetime
+from sqlalchemy import event, inspect, select, delete, func, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import Territory, CityStats
+
+city_stats_table = CityStats.__table__
+
+TRACKED_ATTRIBUTES = ('user_id', 'city', 'buildings', 'apartments', 'sonnettes')
+
+PENDING_KEY = 'city_stats_pending'
+
+
+def city_key(city):
+    """Clé de ville dans la table des agrégats ('' pour les territoires sans ville)"""
+    return city or ''
+
+
+def refresh_city_stats(session, keys):
+    """Recalcule les agrégats des couples (user_id, ville) donnés
+
+    Les agrégats sont écrits par INSERT ... ON CONFLICT (user_id, city) DO UPDATE :
+    deux transactions qui recalculent la même ville en même temps se
+    sérialisent sur la ligne au lieu d'échouer sur uq_city_stats_user_city.
+    Seules les villes qui n'ont plus de territoire sont supprimées.
+    """
+    by_user = {}
+    for user_id, city in keys:
+        if user_id is not None:
+            by_user.setdefault(user_id, set()).add(city_key(city))
+
+    if session.get_bind().dialect.name == 'postgresql':
+        upsert = postgresql.insert
+    else:
+        upsert = sqlite.insert
+
+    now = datetime.utcnow()
+    for user_id, cities in by_user.items():
+        named = [c for c in cities if c]
+        city_filter = Territory.city.in_(named)
+        if '' in cities:
+            city_filter = or_(city_filter, Territory.city.is_(None), Territory.city == '')
+
+        rows = session.execute(
+            select(
+                func.coalesce(Territory.city, ''),
+                func.count(Territory.id),
+                func.coalesce(func.sum(Territory.buildings), 0),
+                func.coalesce(func.sum(Territory.apartments), 0),
+                func.coalesce(func.sum(Territory.sonnettes), 0)
+            ).where(Territory.user_id == user_id, city_filter)
+            .group_by(func.coalesce(Territory.city, ''))
+        ).all()
+
+        if rows:
+            stmt = upsert(city_stats_table)
+            session.execute(stmt.on_conflict_do_update(
+                index_elements=[city_stats_table.c.user_id, city_stats_table.c.city],
+                set_={
+                    'territories': stmt.excluded.territories,
+                    'buildings': stmt.excluded.buildings,
+                    'apartments': stmt.excluded.apartments,
+                    'sonnettes': stmt.excluded.sonnettes,
+                    'updated_at': stmt.excluded.updated_at,
+                }
+            ), [
+                {
+                    'user_id': user_id, 'city': city, 'territories': territories,
+                    'buildings': buildings, 'apartments': apartments, 'sonnettes': sonnettes,
+                    'updated_at': now
+                }
+                for city, territories, buildings, apartments, sonnettes in rows
+            ])
+
+        emptied = cities - {city for city, *_ in rows}
+        if emptied:
+            session.execute(
+                delete(city_stats_table).where(
+                    city_stats_table.c.user_id == user_id,
+                    city_stats_table.c.city.in_(emptied)
+                )
+            )
+
+
+def rebuild_city_stats(session, user_id=None):
+    """Reconstruit entièrement les agrégats (d'un utilisateur, ou de tous)"""
+    query = select(Territory.user_id, Territory.city).distinct()
+    stats_query = select(city_stats_table.c.user_id, city_stats_table.c.city)
+    if user_id is not None:
+        query = query.where(Territory.user_id == user_id)
+        stats_query = stats_query.where(city_stats_table.c.user_id == user_id)
+    keys = set(session.execute(query).all()) | set(session.execute(stats_query).all())
+    refresh_city_stats(session, keys)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_cities(session, flush_context):
+    pending = session.info.setdefault(PENDING_KEY, set())
+    for obj in session.new:
+        if isinstance(obj, Territory):
+            pending.add((obj.user_id, city_key(obj.city)))
+    for obj in session.deleted:
+        if isinstance(obj, Territory):
+            pending.add((obj.user_id, city_key(obj.city)))
+    for obj in session.dirty:
+        if not isinstance(obj, Territory):
+            continue
+        state = inspect(obj)
+        changed = False
+        old_values = {}
+        for name in TRACKED_ATTRIBUTES:
+            history = state.attrs[name].history
+            if history.has_changes():
+                changed = True
+                if history.deleted:
+                    old_values[name] = history.deleted[0]
+        if changed:
+            pending.add((obj.user_id, city_key(obj.city)))
+            pending.add((old_values.get('user_id', obj.user_id), city_key(old_values.get('city', obj.city))))
+
+
+@event.listens_for(Session, 'before_commit')
+def _refresh_changed_cities(session):
+    # Le recalcul peut déclencher un autoflush qui signale d'autres villes : boucler jusqu'à épuisement
+    session.flush()
+    while session.info.get(PENDING_KEY):
+        keys = session.info.pop(PENDING_KEY)
+        refresh_city_stats(session, keys)
+        session.flush()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_cities(session):
+    session.info.pop(PENDING_KEY, None)
@@ -0,0 +1,134 @@
+"""Instrumentation SQL : nombre et durée des requêtes par requête HTTP, détection des N+1
+
+Activée par SQL_BUDGET_ENABLED (par défaut en mode debug). Chaque requête HTTP
+compte ses instructions SQL ; celles répétées au moins SQL_BUDGET_REPEAT_THRESHOLD
+fois (même texte, paramètres différents : boucle de requêtes) sont signalées
+dans les logs, et en debug les totaux sont renvoyés dans les en-têtes X-SQL-*.
+
+Dans les tests, query_budget() borne le nombre de requêtes d'un bloc :
+
+    with query_budget(3):
+        client.get('/statistics')
+"""
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import g, request
+from sqlalchemy import event
+from models import db
+
+_recorders = ContextVar('sql_budget_recorders', default=())
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Le bloc instrumenté a exécuté plus de requêtes que le budget autorisé"""
+
+
+class QueryRecorder:
+    """Accumule les instructions SQL exécutées pendant qu'il est actif"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+    def repeated(self, threshold):
+        """Instructions exécutées au moins `threshold` fois, les plus fréquentes d'abord"""
+        return [(statement, n) for statement, n in self.statements.most_common() if n >= threshold]
+
+    def summary(self):
+        lines = [f"{self.count} requêtes SQL en {self.duration * 1000:.1f} ms"]
+        lines += [f"  {n} x {statement}" for statement, n in self.statements.most_common(5)]
+        return '\n'.join(lines)
+
+
+def _start(recorder):
+    return _recorders.set(_recorders.get() + (recorder,))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _recorders.get():
+        conn.info.setdefault('sql_budget_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    recorders = _recorders.get()
+    starts = conn.info.get('sql_budget_start')
+    if not recorders or not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    statement = ' '.join(statement.split())
+    for recorder in recorders:
+        recorder.record(statement, duration)
+
+
+@contextmanager
+def record_queries():
+    """Enregistre les requêtes SQL exécutées dans le bloc (thread courant uniquement)"""
+    recorder = QueryRecorder()
+    token = _start(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorders.reset(token)
+
+
+@contextmanager
+def query_budget(max_queries, max_repeats=None):
+    """Échoue si le bloc exécute plus de `max_queries` requêtes (ou une même requête plus de `max_repeats` fois)"""
+    with record_queries() as recorder:
+        yield recorder
+    if recorder.count > max_queries:
+        raise QueryBudgetExceeded(f"Budget de {max_queries} requêtes dépassé\n{recorder.summary()}")
+    if max_repeats is not None:
+        repeated = recorder.repeated(max_repeats + 1)
+        if repeated:
+            statement, n = repeated[0]
+            raise QueryBudgetExceeded(f"Requête répétée {n} fois (maximum {max_repeats}) : {statement}")
+
+
+def init_app(app):
+    """Branche les écouteurs SQL sur le moteur et, si activé, le suivi par requête HTTP"""
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+
+    if not app.config['SQL_BUDGET_ENABLED']:
+        return
+
+    @app.before_request
+    def _start_request_recorder():
+        g.sql_recorder = QueryRecorder()
+        g.sql_recorder_token = _start(g.sql_recorder)
+
+    @app.after_request
+    def _report_request_queries(response):
+        recorder = g.get('sql_recorder')
+        if recorder is None:
+            return response
+        threshold = app.config['SQL_BUDGET_REPEAT_THRESHOLD']
+        for statement, n in recorder.repeated(threshold):
+            app.logger.warning(f"Requête SQL répétée {n} fois sur {request.endpoint} : {statement[:300]}")
+        if recorder.count > app.config['SQL_BUDGET_MAX_QUERIES']:
+            app.logger.warning(f"Budget SQL dépassé : {recorder.summary()}")
+        if app.debug:
+            response.headers['X-SQL-Queries'] = str(recorder.count)
+            response.headers['X-SQL-Time'] = f"{recorder.duration * 1000:.1f}"
+        return response
+
+    @app.teardown_request
+    def _stop_request_recorder(exc):
+        token = g.pop('sql_recorder_token', None)
+        if token is None:
+            return
+        try:
+            _recorders.reset(token)
+        except ValueError:
+            # Réponse en flux terminée dans un autre contexte : retirer l'enregistreur à la main
+            _recorders.set(tuple(r for r in _recorders.get() if r is not g.get('sql_recorder')))
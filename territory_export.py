@@ -0,0 +1,80 @@
+"""Export des territoires en KML et GeoJSON, écrit en flux ligne par ligne
+
+Les générateurs reçoivent un itérable de lignes (curseur côté serveur) et
+rendent le document morceau par morceau : l'en-tête part immédiatement et la
+mémoire ne dépend pas du nombre de territoires. Le KML reprend les éléments
+lus par l'import (name, territoryType, territoryNumber) ; la ville et les
+sonnettes sont ajoutées en ExtendedData.
+"""
+import json
+from xml.sax.saxutils import escape
+import geometry_codec
+
+# Colonnes attendues dans chaque ligne, dans cet ordre
+EXPORT_FIELDS = ('uuid', 'name', 'type', 'number', 'city', 'sonnettes', 'buildings', 'apartments')
+
+
+def closed_ring(outline):
+    """Contour fermé (premier point répété à la fin), requis par KML et GeoJSON"""
+    if outline and outline[0] != outline[-1]:
+        return outline + [outline[0]]
+    return outline
+
+
+def geojson_geometry(outline):
+    """Géométrie GeoJSON du contour : Polygon, ou LineString / Point s'il est dégénéré"""
+    if len(outline) >= 3:
+        return {'type': 'Polygon', 'coordinates': [closed_ring(outline)]}
+    if len(outline) == 2:
+        return {'type': 'LineString', 'coordinates': outline}
+    if outline:
+        return {'type': 'Point', 'coordinates': outline[0]}
+    return None
+
+
+def geojson_feature(row):
+    properties = dict(zip(EXPORT_FIELDS, row))
+    return {
+        'type': 'Feature',
+        'id': properties['uuid'],
+        'geometry': geojson_geometry(geometry_codec.decode(row[len(EXPORT_FIELDS)])),
+        'properties': properties,
+    }
+
+
+def stream_geojson(rows):
+    """FeatureCollection GeoJSON, une Feature par ligne"""
+    yield '{"type": "FeatureCollection", "features": ['
+    for i, row in enumerate(rows):
+        yield (',\n' if i else '\n') + json.dumps(geojson_feature(row), ensure_ascii=False)
+    yield '\n]}\n'
+
+
+def kml_placemark(row):
+    values = dict(zip(EXPORT_FIELDS, row))
+    outline = geometry_codec.decode(row[len(EXPORT_FIELDS)])
+    coordinates = ' '.join(f"{lon},{lat},0" for lon, lat in closed_ring(outline))
+    extended = ''.join(
+        f'<Data name="{field}"><value>{escape(str(values[field]))}</value></Data>'
+        for field in ('uuid', 'city', 'sonnettes', 'buildings', 'apartments') if values[field] is not None
+    )
+    return (
+        '<Placemark>'
+        f'<name>{escape(values["name"] or "")}</name>'
+        f'<territoryType>{escape(values["type"] or "")}</territoryType>'
+        f'<territoryNumber>{escape(values["number"] or "")}</territoryNumber>'
+        f'<ExtendedData>{extended}</ExtendedData>'
+        f'<Polygon><outerBoundaryIs><LinearRing><coordinates>{coordinates}</coordinates>'
+        '</LinearRing></outerBoundaryIs></Polygon>'
+        '</Placemark>\n'
+    )
+
+
+def stream_kml(rows, document_name):
+    """Document KML, un Placemark par ligne"""
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>'
+           f'<name>{escape(document_name)}</name>\n')
+    for row in rows:
+        yield kml_placemark(row)
+    yield '</Document></kml>\n'
@@ -0,0 +1,48 @@
+"""Fixtures communes : application sur une base SQLite jetable et client connecté
+
+Les tests tournent sur la base désignée par TEST_DATABASE_URL (PostgreSQL de
+préférence, pour les tests de concurrence), ou sur un fichier SQLite temporaire.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmpdir = tempfile.mkdtemp(prefix='territoires-tests-')
+os.environ['DATABASE_URL'] = os.getenv('TEST_DATABASE_URL', f"sqlite:///{os.path.join(_tmpdir, 'test.db')}")
+os.environ.setdefault('GOOGLE_MAPS_API_KEY', 'test')
+os.environ.setdefault('CARD_PDF_FOLDER', os.path.join(_tmpdir, 'cards'))
+
+import pytest
+from app import app as flask_app, db
+from models import User
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def user(app):
+    user = User(email='test@example.com', name='test')
+    user.set_password('test')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def client(app, user):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+    return client
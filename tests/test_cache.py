@@ -0,0 +1,28 @@
+import cache
+from models import db, Territory, OverpassCache
+
+OLD = [[3.0, 50.6], [3.01, 50.6], [3.01, 50.61]]
+NEW = [[3.1, 50.6], [3.11, 50.6], [3.11, 50.61]]
+
+
+def cached(coordinates):
+    return OverpassCache.query.filter_by(geometry_hash=cache.geometry_hash(coordinates)).count()
+
+
+def test_geometry_invalidation_waits_for_commit(app, user):
+    territory = Territory(uuid='u1', name='t1', number='T-1', user_id=user.id)
+    territory.coordinates = OLD
+    db.session.add(territory)
+    db.session.commit()
+    cache.store_overpass('buildings', OLD, {'elements': []})
+
+    territory.coordinates = NEW
+    db.session.flush()
+    assert cached(OLD) == 1
+    db.session.rollback()
+    # Modification annulée : le cache de la géométrie conservée reste valable
+    assert cached(OLD) == 1
+
+    territory.coordinates = NEW
+    db.session.commit()
+    assert cached(OLD) == 0
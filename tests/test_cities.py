@@ -0,0 +1,45 @@
+from sql_budget import record_queries
+from models import db, Territory
+
+
+def add_territory(user, uuid, city):
+    territory = Territory(uuid=uuid, name=uuid, number=uuid, city=city, user_id=user.id,
+                          buildings=1, apartments=2, sonnettes=3)
+    territory.coordinates = [[3.0, 50.0], [3.01, 50.0], [3.01, 50.01]]
+    db.session.add(territory)
+
+
+def test_cities_are_served_from_the_rollup(client, user):
+    add_territory(user, 't1', 'Lyon')
+    add_territory(user, 't2', 'Lyon')
+    add_territory(user, 't3', None)
+    db.session.commit()
+
+    with record_queries() as recorder:
+        response = client.get('/territories/cities')
+    assert response.json == {'cities': [
+        {'name': 'Lyon', 'stats': {'territories': 2, 'houses': 2, 'apartments': 4, 'sonnettes': 6}}
+    ]}
+    assert not any('FROM territory' in statement for statement in recorder.statements)
+
+
+def test_etag_changes_when_a_territory_is_deleted(client, user):
+    add_territory(user, 't1', 'Lyon')
+    add_territory(user, 't2', 'Lyon')
+    db.session.commit()
+    response = client.get('/territories/cities')
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    assert client.get('/territories/cities', headers={'If-None-Match': etag}).status_code == 304
+
+    db.session.delete(Territory.query.filter_by(uuid='t1').one())
+    db.session.commit()
+    response = client.get('/territories/cities', headers={'If-None-Match': etag, 'If-Modified-Since': last_modified})
+    assert response.status_code == 200
+    assert response.json['cities'][0]['stats']['territories'] == 1
+
+
+def test_bare_if_modified_since_is_not_trusted(client, user):
+    add_territory(user, 't1', 'Lyon')
+    db.session.commit()
+    last_modified = client.get('/territories/cities').headers['Last-Modified']
+    assert client.get('/territories/cities', headers={'If-Modified-Since': last_modified}).status_code == 200
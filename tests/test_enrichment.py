@@ -0,0 +1,20 @@
+import app as app_module
+
+
+def test_failed_territories_only_get_defaults(app, monkeypatch):
+    def count(coordinates, strict=False):
+        if coordinates[0][0] > 3.5:
+            raise RuntimeError('Overpass indisponible')
+        return {'total_doorbells': 7}
+
+    monkeypatch.setattr(app_module, 'get_city_from_coordinates', lambda coordinates, strict=False: 'Lille')
+    monkeypatch.setattr(app_module, 'count_buildings_and_apartments', count)
+    ok = {'name': 'ok', 'coordinates': [[3.0, 50.6]]}
+    broken = {'name': 'broken', 'coordinates': [[4.0, 50.6]]}
+
+    failed = app_module.enrich_territories([ok, broken], workers=2)
+
+    assert failed == [broken]
+    assert (ok['city'], ok['sonnettes']) == ('Lille', 7)
+    # La ville trouvée avant l'échec n'est pas conservée : pas de résultat partiel
+    assert (broken['city'], broken['sonnettes']) == ('Ville inconnue', 0)
@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+import jobs
+from models import db, Job, ImportChunk
+
+
+def staging_job(user, age):
+    job = jobs.enqueue('import_kml', user.id, status='staging')
+    job.created_at = datetime.utcnow() - timedelta(seconds=age)
+    db.session.add(ImportChunk(job_id=job.id, seq=0, placemarks=[{'name': 'T-1'}]))
+    db.session.commit()
+    return job.id
+
+
+def test_worker_expires_abandoned_staging_jobs(app, user):
+    app.config['JOBS_STAGING_TIMEOUT'] = 3600
+    abandoned = staging_job(user, 7200)
+    uploading = staging_job(user, 60)
+
+    jobs.run_worker(app, once=True)
+
+    db.session.expire_all()
+    job = db.session.get(Job, abandoned)
+    assert job.status == 'failed'
+    assert job.finished_at is not None
+    assert ImportChunk.query.filter_by(job_id=abandoned).count() == 0
+    # Un upload encore en cours n'est pas touché
+    assert db.session.get(Job, uploading).status == 'staging'
+    assert ImportChunk.query.filter_by(job_id=uploading).count() == 1
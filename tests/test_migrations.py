@@ -0,0 +1,42 @@
+import importlib.util
+import os
+import sqlalchemy as sa
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+VERSIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations', 'versions')
+
+
+def load_migration(filename):
+    spec = importlib.util.spec_from_file_location(filename[:-3], os.path.join(VERSIONS, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_upgrade(module, conn):
+    module.op = Operations(MigrationContext.configure(conn))
+    module.upgrade()
+
+
+def test_counter_seed_uses_the_user_number_format():
+    migration = load_migration('7a1d4c9e2f60_add_territory_counter.py')
+    engine = sa.create_engine('sqlite://')
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE user (id INTEGER PRIMARY KEY)")
+        conn.exec_driver_sql("CREATE TABLE user_settings (id INTEGER PRIMARY KEY, user_id INTEGER, "
+                             "territory_number_format VARCHAR(50), territory_start_number INTEGER)")
+        conn.exec_driver_sql("CREATE TABLE territory (id INTEGER PRIMARY KEY, user_id INTEGER, number VARCHAR(10))")
+        conn.exec_driver_sql("INSERT INTO user VALUES (1), (2), (3)")
+        conn.exec_driver_sql("INSERT INTO user_settings VALUES (1, 1, '{year}-{number}', 1), "
+                             "(2, 2, '{number:03d}/{year}', 1)")
+        conn.exec_driver_sql("INSERT INTO territory VALUES (1, 1, '2026-7'), (2, 1, '2025-12'), "
+                             "(3, 2, '004/2026'), (4, 3, 'T-9'), (5, 3, 'Zone 2026 n°15')")
+        run_upgrade(migration, conn)
+        counters = dict(conn.exec_driver_sql("SELECT user_id, next_number FROM territory_counter").all())
+
+    # Année en premier : le compteur suit le numéro, pas l'année
+    assert counters[1] == 13
+    assert counters[2] == 5
+    # Sans format utilisateur : dernier groupe de chiffres
+    assert counters[3] == 16
@@ -0,0 +1,69 @@
+import json
+import pytest
+from shapely.geometry import Polygon, box
+import osm_snapshot
+
+
+def write_overpass_json(path, points):
+    """Extrait Overpass JSON : un bâtiment par point (lon, lat)"""
+    elements = [
+        {'type': 'way', 'id': i, 'center': {'lon': lon, 'lat': lat}, 'tags': {'building': 'house'}}
+        for i, (lon, lat) in enumerate(points, start=1)
+    ]
+    path.write_text(json.dumps({'elements': elements}))
+    return str(path)
+
+
+def write_poly(path, ring):
+    lines = ['extrait', '1'] + [f"   {lon} {lat}" for lon, lat in ring] + ['END', 'END']
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+# Zone extraite en L : le coin nord-est de son emprise n'en fait pas partie
+L_SHAPE = [(0, 0), (2, 0), (2, 1), (1, 1), (1, 2), (0, 2), (0, 0)]
+
+
+def square(lon, lat, size=0.1):
+    return box(lon, lat, lon + size, lat + size)
+
+
+def test_coverage_is_the_extract_boundary_not_its_bbox(app, tmp_path):
+    extract = write_overpass_json(tmp_path / 'extrait.json', [(0.1, 0.1), (1.9, 0.5), (0.5, 1.9)])
+    boundary = osm_snapshot.read_boundary(write_poly(tmp_path / 'extrait.poly', L_SHAPE))
+    osm_snapshot.import_extract(extract, 'extrait', boundary)
+
+    assert osm_snapshot.covers(square(0.2, 0.2))
+    # Dans l'emprise de l'extrait (0..2 x 0..2) mais hors de la zone extraite
+    assert not osm_snapshot.covers(square(1.5, 1.5))
+    # À cheval sur le contour
+    assert not osm_snapshot.covers(square(0.95, 1.5))
+
+
+def test_bbox_from_osm_header(app, tmp_path):
+    path = tmp_path / 'extrait.osm'
+    path.write_text(
+        '<?xml version="1.0"?><osm version="0.6">'
+        '<bounds minlat="50.0" minlon="3.0" maxlat="50.5" maxlon="3.5"/>'
+        '<node id="1" lat="50.1" lon="3.1"/><node id="2" lat="50.11" lon="3.11"/>'
+        '<way id="10"><nd ref="1"/><nd ref="2"/><tag k="building" v="yes"/></way>'
+        '</osm>'
+    )
+    extract = osm_snapshot.import_extract(str(path))
+    assert (extract.min_lon, extract.min_lat, extract.max_lon, extract.max_lat) == (3.0, 50.0, 3.5, 50.5)
+    assert osm_snapshot.covers(square(3.3, 50.3))
+    assert not osm_snapshot.covers(square(3.45, 50.3))
+
+
+def test_extract_without_known_boundary_is_rejected(app, tmp_path):
+    extract = write_overpass_json(tmp_path / 'extrait.json', [(0.1, 0.1)])
+    with pytest.raises(ValueError):
+        osm_snapshot.import_extract(extract)
+
+
+def test_poly_holes_are_excluded(tmp_path):
+    path = tmp_path / 'trou.poly'
+    path.write_text('trou\n1\n 0 0\n 4 0\n 4 4\n 0 4\nEND\n!2\n 1 1\n 3 1\n 3 3\n 1 3\nEND\nEND\n')
+    boundary = osm_snapshot.read_poly(str(path))
+    assert boundary.covers(Polygon([(0.1, 0.1), (0.5, 0.1), (0.5, 0.5)]))
+    assert not boundary.covers(square(2, 2))
@@ -0,0 +1,42 @@
+import json
+import math
+import pytest
+from sql_budget import query_budget
+from models import db, Territory
+
+# Requêtes attendues, chargement de l'utilisateur connecté compris ; le nombre
+# ne doit pas dépendre du nombre de territoires (pas de N+1)
+HOT_ENDPOINTS = [
+    ('/list_territories', 2),
+    ('/list_territories?fields=uuid,name&limit=10', 2),
+    ('/statistics', 2),
+    ('/territories/cities', 2),
+    ('/territories/export.geojson', 2),
+    ('/territories/export.kml', 2),
+    ('/tiles/5/16/10.geojson', 3),  # Points regroupés
+    ('/tiles/14/8329/5513.geojson', 4),  # Contours
+]
+
+
+@pytest.fixture(params=[3, 30])
+def territories(request, user):
+    for i in range(request.param):
+        ring = [[3.025 + 0.003 * math.cos(a / 12 * 6.28) + i * 0.0002, 50.6 + 0.002 * math.sin(a / 12 * 6.28)]
+                for a in range(12)]
+        territory = Territory(uuid=f'u{i}', name=f't{i}', number=f'T-{i}', city=f'Ville {i % 4}', user_id=user.id,
+                              buildings=1, apartments=2, sonnettes=3)
+        territory.coordinates = ring
+        db.session.add(territory)
+    db.session.commit()
+    return request.param
+
+
+@pytest.mark.parametrize('path, budget', HOT_ENDPOINTS)
+def test_hot_endpoints_stay_within_query_budget(client, territories, path, budget):
+    with query_budget(budget):
+        response = client.get(path)
+        # Les réponses écrites en flux exécutent leurs requêtes à la lecture du corps
+        data = response.get_data()
+    assert response.status_code == 200
+    if path.startswith('/tiles/14/'):
+        assert len(json.loads(data)['features']) == territories
@@ -0,0 +1,33 @@
+import threading
+import osm_client
+import rate_limit
+
+
+def test_slots_are_shared_between_limiters(app):
+    # Deux limiteurs distincts (deux processus) réservent sur la même ligne en base
+    reserve = rate_limit.shared_reserve(app, lambda host, interval: 0)
+    limiters = [osm_client.HostRateLimiter({'nominatim.example': 1.0}, reserve) for _ in range(2)]
+    slots = []
+    lock = threading.Lock()
+
+    def take(limiter):
+        slot = limiter.reserve('nominatim.example', 1.0)
+        with lock:
+            slots.append(slot)
+
+    threads = [threading.Thread(target=take, args=(limiters[i % 2],)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    slots.sort()
+    assert len(slots) == 6
+    assert all(later - earlier >= 1.0 - 1e-6 for earlier, later in zip(slots, slots[1:]))
+
+
+def test_hosts_have_independent_slots(app):
+    first = rate_limit.reserve_slot('nominatim.example', 1.0)
+    other = rate_limit.reserve_slot('overpass.example', 1.0)
+    assert abs(other - first) < 1.0
+    assert rate_limit.reserve_slot('nominatim.example', 1.0) - first >= 1.0 - 1e-6
@@ -0,0 +1,65 @@
+import threading
+import time
+import rollups
+from models import db, Territory, CityStats
+
+
+def add_territory(user, uuid, city, buildings=1, apartments=2, sonnettes=3):
+    territory = Territory(uuid=uuid, name=uuid, number=uuid, city=city, user_id=user.id,
+                          buildings=buildings, apartments=apartments, sonnettes=sonnettes)
+    territory.coordinates = [[3.0, 50.0], [3.01, 50.0], [3.01, 50.01]]
+    db.session.add(territory)
+    return territory
+
+
+def city_rows(user):
+    return {
+        row.city: (row.territories, row.buildings, row.apartments, row.sonnettes)
+        for row in CityStats.query.filter_by(user_id=user.id)
+    }
+
+
+def test_rollup_follows_territory_changes(user):
+    add_territory(user, 't1', 'Lyon')
+    add_territory(user, 't2', 'Lyon')
+    add_territory(user, 't3', None)
+    db.session.commit()
+    assert city_rows(user) == {'Lyon': (2, 2, 4, 6), '': (1, 1, 2, 3)}
+
+    territory = Territory.query.filter_by(uuid='t1').one()
+    territory.city = 'Paris'
+    territory.sonnettes = 10
+    db.session.commit()
+    assert city_rows(user) == {'Lyon': (1, 1, 2, 3), 'Paris': (1, 1, 2, 10), '': (1, 1, 2, 3)}
+
+    # Une ville sans territoire disparaît des agrégats
+    db.session.delete(Territory.query.filter_by(uuid='t3').one())
+    db.session.commit()
+    assert '' not in city_rows(user)
+
+
+def test_concurrent_refresh_of_same_city(app, user):
+    add_territory(user, 't1', 'Lyon')
+    db.session.commit()
+    user_id = user.id
+    errors = []
+
+    def refresh_in_other_session():
+        with app.app_context():
+            try:
+                rollups.refresh_city_stats(db.session, {(user_id, 'Lyon')})
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                errors.append(e)
+
+    # La première transaction écrit l'agrégat sans valider ; la seconde attend son verrou
+    rollups.refresh_city_stats(db.session, {(user_id, 'Lyon')})
+    other = threading.Thread(target=refresh_in_other_session)
+    other.start()
+    time.sleep(0.3)
+    db.session.commit()
+    other.join()
+
+    assert errors == []
+    assert city_rows(user) == {'Lyon': (1, 1, 2, 3)}
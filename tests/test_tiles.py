@@ -0,0 +1,60 @@
+import json
+import math
+import pytest
+from models import db, Territory
+
+
+def tile_of(lon, lat, z):
+    n = 2 ** z
+    rad = math.radians(lat)
+    return int((lon + 180) / 360 * n), int((1 - math.log(math.tan(rad) + 1 / math.cos(rad)) / math.pi) / 2 * n)
+
+
+@pytest.fixture
+def territories(user):
+    for i in range(12):
+        ring = [[3.0 + 0.003 * math.cos(a / 30 * 6.28) + i * 0.005, 50.6 + 0.002 * math.sin(a / 30 * 6.28)]
+                for a in range(30)]
+        territory = Territory(uuid=f'u{i}', name=f't{i}', number=f'T-{i}', city='Lille', user_id=user.id)
+        territory.coordinates = ring
+        db.session.add(territory)
+    db.session.commit()
+
+
+def get_tile(client, z, lon=3.02, lat=50.6):
+    x, y = tile_of(lon, lat, z)
+    response = client.get(f'/tiles/{z}/{x}/{y}.geojson')
+    assert response.status_code == 200
+    return response, json.loads(response.data)['features']
+
+
+def test_low_zoom_tiles_only_hold_clusters(client, territories):
+    response, features = get_tile(client, 5)
+    assert all(f['geometry']['type'] == 'Point' and f['properties']['cluster'] for f in features)
+    assert sum(f['properties']['count'] for f in features) == 12
+    # Tuile inchangée : même ETag
+    assert client.get(response.request.path, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_cluster_tile_changes_when_a_territory_is_deleted(client, territories):
+    response, _ = get_tile(client, 5)
+    db.session.delete(Territory.query.filter_by(uuid='u3').one())
+    db.session.commit()
+    assert client.get(response.request.path, headers={'If-None-Match': response.headers['ETag']}).status_code == 200
+    _, features = get_tile(client, 5)
+    assert sum(f['properties']['count'] for f in features) == 11
+
+
+def test_high_zoom_tiles_hold_outlines(client, territories):
+    _, features = get_tile(client, 14)
+    assert features and all(f['geometry']['type'] == 'Polygon' for f in features)
+
+
+def test_feature_cap_switches_to_clusters(app, client, territories):
+    app.config['TILE_MAX_FEATURES'] = 5
+    try:
+        _, features = get_tile(client, 14)
+    finally:
+        app.config['TILE_MAX_FEATURES'] = 1000
+    assert len(features) <= app.config['TILE_CLUSTER_GRID'] ** 2
+    assert all(f['properties'].get('cluster') for f in features)
@@ -0,0 +1,66 @@
+"""Vignettes des contours de territoire (SVG ou PNG) rendues côté serveur
+
+Le contour est projeté dans un petit rectangle sans fond de carte : une page
+peut afficher des centaines de formes sans charger Google Maps. Un rendu ne
+dépend que de la géométrie (WKB) et de la taille demandée ; son empreinte sert
+de validateur HTTP et de version d'URL, et l'application garde les rendus
+récents dans un cache LRU indexé par ces mêmes paramètres.
+"""
+import hashlib
+import io
+from PIL import Image, ImageDraw
+import geometry_codec
+from card_renderer import project
+
+# À incrémenter si le style des vignettes change, pour invalider les caches des navigateurs
+STYLE_VERSION = 1
+
+STROKE_COLOR = '#c81e1e'
+FILL_COLOR = '#f5c8c8'
+MARGIN = 4
+
+MIMETYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
+
+
+def thumbnail_etag(wkb, fmt, width, height):
+    """Empreinte d'un rendu : géométrie, format, taille et version du style"""
+    digest = hashlib.sha256(f"{STYLE_VERSION}:{fmt}:{width}x{height}:".encode('utf-8'))
+    digest.update(wkb or b'')
+    return digest.hexdigest()
+
+
+def render_svg(outline, width, height):
+    """SVG du contour ([lng, lat]) ajusté au rectangle, nord en haut"""
+    shape = ''
+    if len(outline) >= 2:
+        points = ' '.join(f"{x:.1f},{y:.1f}" for x, y in project(outline, (0, 0, width, height), MARGIN))
+        if len(outline) >= 3:
+            shape = (f'<polygon points="{points}" fill="{FILL_COLOR}" stroke="{STROKE_COLOR}" '
+                     f'stroke-width="2" stroke-linejoin="round"/>')
+        else:
+            shape = f'<polyline points="{points}" fill="none" stroke="{STROKE_COLOR}" stroke-width="2"/>'
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'viewBox="0 0 {width} {height}">{shape}</svg>')
+
+
+def render_png(outline, width, height):
+    """PNG du contour, dessiné en double résolution puis réduit (bords lissés)"""
+    image = Image.new('RGBA', (width * 2, height * 2), (255, 255, 255, 0))
+    if len(outline) >= 2:
+        points = project(outline, (0, 0, width * 2, height * 2), MARGIN * 2)
+        draw = ImageDraw.Draw(image)
+        if len(outline) >= 3:
+            draw.polygon(points, fill=FILL_COLOR, outline=STROKE_COLOR, width=4)
+        else:
+            draw.line(points, fill=STROKE_COLOR, width=4)
+    stream = io.BytesIO()
+    image.resize((width, height), Image.LANCZOS).save(stream, 'PNG', optimize=True)
+    return stream.getvalue()
+
+
+def render(wkb, fmt='svg', width=160, height=120):
+    """Rend la vignette d'une géométrie WKB et retourne les octets"""
+    outline = geometry_codec.decode(wkb) if wkb else []
+    if fmt == 'png':
+        return render_png(outline, width, height)
+    return render_svg(outline, width, height).encode('utf-8')
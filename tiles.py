@@ -0,0 +1,82 @@
+"""Tuiles GeoJSON des territoires (schéma XYZ de Google Maps / OSM)
+
+Une tuile ne contient que les territoires dont l'emprise croise la tuile,
+avec le contour au niveau de détail adapté à son zoom. Les territoires ne
+sont pas découpés : un territoire à cheval sur plusieurs tuiles figure dans
+chacune avec le même identifiant (uuid), que le client utilise pour
+dédoublonner.
+
+Aux petits zooms (sous TILE_MIN_ZOOM) ou lorsqu'une tuile contiendrait plus
+de TILE_MAX_FEATURES territoires, les contours sont remplacés par des points
+regroupés : les centroïdes situés dans la tuile sont comptés par case d'une
+grille de TILE_CLUSTER_GRID x TILE_CLUSTER_GRID, sans lire les géométries.
+
+La signature d'une tuile est l'empreinte des (id, updated_at) des
+territoires qu'elle contient : elle change dès qu'un de ces territoires est
+créé, modifié, déplacé ou supprimé, et seulement dans ce cas. Elle sert
+d'ETag et de clé du cache des tuiles rendues. Pour une tuile regroupée, le
+nombre de territoires et le plus récent updated_at suffisent.
+"""
+import hashlib
+import json
+import math
+import geometry_codec
+from territory_export import geojson_geometry
+
+MAX_ZOOM = 22
+
+
+def tile_bounds(z, x, y):
+    """Emprise (ouest, sud, est, nord) en degrés d'une tuile Web Mercator"""
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_signature(z, x, y, versions):
+    """Empreinte d'une tuile à partir des (id, updated_at) de ses territoires"""
+    digest = hashlib.sha256(f"{z}/{x}/{y}".encode('utf-8'))
+    for territory_id, updated_at in sorted(versions):
+        digest.update(f":{territory_id}@{updated_at}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def feature(uuid, name, number, territory_type, city, wkb):
+    return {
+        'type': 'Feature',
+        'id': uuid,
+        'geometry': geojson_geometry(geometry_codec.decode(wkb)),
+        'properties': {'uuid': uuid, 'name': name, 'number': number, 'type': territory_type, 'city': city},
+    }
+
+
+def feature_collection(rows):
+    """Tuile encodée en GeoJSON ; `rows` : (uuid, name, number, type, city, wkb)"""
+    return json.dumps(
+        {'type': 'FeatureCollection', 'features': [feature(*row) for row in rows]},
+        ensure_ascii=False, separators=(',', ':')
+    ).encode('utf-8')
+
+
+def cluster_collection(z, x, y, rows):
+    """Tuile de points regroupés ; `rows` : (colonne, ligne, nombre, longitude, latitude) par case"""
+    features = []
+    for column, row, count, lon, lat in rows:
+        cluster_id = f"{z}/{x}/{y}/{int(column)}/{int(row)}"
+        features.append({
+            'type': 'Feature',
+            'id': cluster_id,
+            'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'properties': {'uuid': cluster_id, 'cluster': True, 'count': count},
+        })
+    return json.dumps(
+        {'type': 'FeatureCollection', 'features': features},
+        ensure_ascii=False, separators=(',', ':')
+    ).encode('utf-8')
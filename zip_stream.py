@@ -0,0 +1,47 @@
+"""Archive ZIP produite à la volée, entrée par entrée
+
+zipfile sait écrire dans un flux non positionnable (tailles et CRC dans un
+descripteur après chaque entrée). stream_zip consomme un itérable d'entrées
+et rend les octets de l'archive au fur et à mesure : la mémoire utilisée ne
+dépend que de la plus grosse entrée, pas du nombre d'entrées.
+"""
+import time
+import zipfile
+
+
+class _ChunkWriter:
+    """Flux en écriture seule qui accumule les octets jusqu'au prochain drain()"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries, compression=zipfile.ZIP_STORED):
+    """Générateur des octets d'une archive ZIP
+
+    `entries` : itérable de (nom, octets). Les images PNG sont déjà
+    compressées : par défaut les entrées sont stockées telles quelles.
+    """
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, 'w', compression=compression) as archive:
+        for name, data in entries:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = compression
+            archive.writestr(info, data)
+            chunk = writer.drain()
+            if chunk:
+                yield chunk
+    # Répertoire central, écrit à la fermeture de l'archive
+    yield writer.drain()